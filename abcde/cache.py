@@ -0,0 +1,230 @@
+"""In-process caches"""
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import select
+
+from abcde.sql_models import CacheGeneration, dialect_insert
+
+
+class LRUCache:
+    """Bounded least recently used mapping with hit / miss counters.
+
+    `on_evict` is called with the key of every entry dropped because of the
+    size limit. The operations are locked, the parser caches are shared by
+    the parse threads.
+    """
+
+    def __init__(self, maxsize, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            self._evict(self.maxsize)
+
+    def pop(self, key):
+        with self.lock:
+            return self.data.pop(key, None)
+
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self._evict(max(maxsize, 0))
+
+    def _evict(self, maxsize):
+        while len(self.data) > maxsize:
+            key, _ = self.data.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(key)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SharedGeneration:
+    """Write counter shared by the worker processes through the database.
+
+    Every write increments the counter of the cache_generation table in its
+    transaction. A worker which finds the counter moved further than its own
+    writes moved it missed a write of another worker, and `on_missed` is
+    called. Concurrent writes may call it more often than needed, never
+    less. The counter is read at most every `sync_ms` milliseconds.
+    """
+
+    def __init__(self, sync_ms=0, on_missed=None):
+        self.sync_s = sync_ms / 1000
+        self.on_missed = on_missed
+        self.value = None
+        self.synced = None
+        self.syncs = 0
+        self.missed = 0
+
+    @staticmethod
+    async def bump(session):
+        """Increment the counter in the transaction of session."""
+        stmt = dialect_insert(session.bind.dialect, CacheGeneration).values(
+            id=1, generation=1
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={"generation": CacheGeneration.generation + 1},
+        ).returning(CacheGeneration.generation)
+        return (await session.execute(stmt)).scalar_one()
+
+    async def sync(self, session):
+        """Read the counter, unless it was read in the last `sync_ms`."""
+        now = time.monotonic()
+        if self.synced is not None and now - self.synced < self.sync_s:
+            return
+        self.synced = now
+        self.syncs += 1
+        value = await session.scalar(
+            select(CacheGeneration.generation).where(CacheGeneration.id == 1)
+        )
+        self.observe(value or 0)
+
+    def observe(self, value, own=0):
+        """Record a counter value, `own` is the number of own writes in it."""
+        if self.value is None:
+            # nothing was cached before the first value
+            self.value = value
+            return
+        expected = self.value + own
+        self.value = max(self.value, value)
+        if value != expected:
+            self.missed += 1
+            if self.on_missed:
+                self.on_missed()
+
+    def stats(self):
+        return {"generation": self.value, "syncs": self.syncs, "missed": self.missed}
+
+
+class ResultCache:
+    """Query result cache invalidated by writes.
+
+    Entries are keyed on the parsed sensors, metrics, aggregation and date
+    window. Writing a value of a (sensor, metric) drops every entry which
+    covers it. With `max_staleness` (seconds) the date window is rounded down
+    to `max_staleness` buckets, so queries with relative dates share entries,
+    and entries expire after `max_staleness` seconds.
+
+    With a SharedGeneration (`shared`) the whole cache is dropped when
+    another process wrote, see `sync`.
+    """
+
+    def __init__(self, maxsize, max_staleness=0, shared=None):
+        self.max_staleness = max_staleness
+        self.shared = shared
+        if shared:
+            shared.on_missed = self.clear
+        self.entries = LRUCache(maxsize, on_evict=self._unindex)
+        self.by_metric = defaultdict(set)
+        self.generation = 0
+        self.invalidations = 0
+
+    def key(self, parsed):
+        window = parsed["date"][0] if parsed["date"] else None
+        if window and self.max_staleness:
+            timestamp = window.timestamp()
+            window = timestamp - timestamp % self.max_staleness
+        return (
+            tuple(sorted(set(parsed["sensor"]))),
+            tuple(sorted(set(parsed["metric"]))),
+            parsed["aggregation"][0] if parsed["date"] else None,
+            window,
+            tuple(parsed.get("bucket", ())),
+        )
+
+    async def sync(self, session):
+        """Catch up with the writes of other processes, before a lookup."""
+        if self.shared:
+            await self.shared.sync(session)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        created, rows = entry
+        if self.max_staleness and time.monotonic() - created > self.max_staleness:
+            self._pop(key)
+            return None
+        return rows
+
+    def put(self, key, rows, generation):
+        """Store rows read while the cache was at `generation`.
+
+        Results which were read before a write invalidated the cache are not
+        stored, they might miss the written value.
+        """
+        if generation != self.generation:
+            return
+        self.entries.put(key, (time.monotonic(), rows))
+        if key in self.entries.data:
+            for metric in key[1]:
+                self.by_metric[metric].add(key)
+
+    def invalidate(self, pairs):
+        """Drop the entries covering any of the (sensor, metric) pairs."""
+        self.generation += 1
+        for sensor, metric in pairs:
+            for key in list(self.by_metric.get(metric, ())):
+                if sensor in key[0] or "_all_" in key[0]:
+                    self._pop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.by_metric.clear()
+
+    def _pop(self, key):
+        self.entries.pop(key)
+        self._unindex(key)
+
+    def _unindex(self, key):
+        for metric in key[1]:
+            keys = self.by_metric.get(metric)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_metric[metric]
+
+    def stats(self):
+        stats = {**self.entries.stats(), "invalidations": self.invalidations}
+        if self.shared:
+            stats["shared"] = self.shared.stats()
+        return stats
@@ -7,3 +7,82 @@ class Config(BaseSettings, env_prefix="ABCDE_"):
     """App config model."""
 
     db_url: str = "sqlite:////tmp/database.db"
+
+    # worker processes started by startup.sh, with more than one the result
+    # caches of the workers are invalidated through the database
+    workers: int = 1
+
+    # tuned SQLite: WAL journal, synchronous=NORMAL, mmap / cache size and
+    # busy timeout PRAGMAs, a single writer connection and a pool of
+    # read-only connections for the queries
+    sqlite_tuned: bool = False
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    sqlite_cache_kib: int = 32 * 1024
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_read_pool_size: int = 8
+
+    # write-behind ingestion buffer, POST /sensor answers 202 when enabled
+    write_behind: bool = False
+    write_behind_batch_size: int = 500
+    write_behind_flush_ms: int = 100
+    write_behind_queue_size: int = 10000
+    write_behind_put_timeout_ms: int = 1000
+    # a failed flush is retried write_behind_retries times, the first retry
+    # after write_behind_retry_ms, doubled for every further one
+    write_behind_retries: int = 3
+    write_behind_retry_ms: int = 100
+
+    # parsed query cache, number of normalized query texts
+    parse_cache_size: int = 1024
+    # threads parsing the queries and building their statements off the
+    # event loop, 0 parses on the event loop
+    parse_threads: int = 2
+    # longest query text in characters and most words of a query, longer
+    # queries are answered with 400; 0 is unlimited
+    max_query_length: int = 1000
+    max_query_tokens: int = 100
+    # most queries of a POST /query/batch, larger batches are answered with
+    # 400; 0 is unlimited
+    max_batch_queries: int = 100
+    # milliseconds between two reads of the sensor / metric name counts
+    # (multiple workers), the names written by another worker are queryable
+    # after that; a worker knows its own names at once
+    vocabulary_sync_ms: int = 1000
+
+    # /query result cache, number of entries, 0 disables it
+    result_cache_size: int = 0
+    # seconds a cached result of a relative date window may lag behind, 0
+    # keeps the date window exact
+    result_cache_max_staleness: float = 0
+    # milliseconds between two reads of the shared write counter (multiple
+    # workers), 0 reads it before every cache lookup
+    result_cache_sync_ms: int = 0
+
+    # in-memory hot tier of the recent values (single worker only): seconds
+    # loaded at startup, values kept per (sensor, metric) and number of
+    # (sensor, metric) pairs, it takes up to points * series * 16 bytes
+    hot_tier: bool = False
+    hot_tier_window: float = 7 * 24 * 3600
+    hot_tier_points: int = 10080
+    hot_tier_series: int = 256
+
+    # seconds the raw values and the minute / hour / day rollups are kept, 0
+    # keeps them forever, a tier has to be kept at least as long as the finer
+    # ones; a background task deletes the expired rows every
+    # retention_interval seconds, retention_batch_size rows per transaction
+    retention_raw: float = 0
+    retention_minute: float = 0
+    retention_hour: float = 0
+    retention_day: float = 0
+    retention_interval: float = 300
+    retention_batch_size: int = 5000
+
+    # rows fetched and encoded at a time by GET /series
+    series_chunk_size: int = 1000
+
+    # request and per stage latency histograms, DB pool and cache stats in
+    # Prometheus text format on GET /metrics
+    metrics: bool = False
+    # log /query statements taking longer than this many milliseconds with
+    # the parsed query and the SQL, 0 disables the log
+    slow_query_ms: float = 0
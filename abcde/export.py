@@ -0,0 +1,125 @@
+"""Streaming export of raw sensor values"""
+
+import csv
+import importlib
+import io
+import json
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from abcde.utils import get_async_read_engine
+
+COLUMNS = ("sensor", "metric", "unit", "timestamp", "value")
+
+
+async def encode_ndjson(partitions):
+    async for rows in partitions:
+        yield "".join(
+            json.dumps(
+                {
+                    "sensor": sensor,
+                    "metric": metric,
+                    "unit": unit,
+                    "timestamp": timestamp.isoformat(),
+                    "value": value,
+                }
+            )
+            + "\n"
+            for sensor, metric, unit, timestamp, value in rows
+        ).encode()
+
+
+async def encode_csv(partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue().encode()
+    async for rows in partitions:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            (sensor, metric, unit, timestamp.isoformat(), value)
+            for sensor, metric, unit, timestamp, value in rows
+        )
+        yield buffer.getvalue().encode()
+
+
+def get_pyarrow():
+    """Return the pyarrow module, or None when it is not installed."""
+    try:
+        return importlib.import_module("pyarrow")
+    except ImportError:
+        return None
+
+
+class _ArrowSink:
+    """Write target of the Arrow IPC stream writer, drained after every batch."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+async def encode_arrow(partitions):
+    pa = get_pyarrow()
+    schema = pa.schema(
+        [
+            ("sensor", pa.string()),
+            ("metric", pa.string()),
+            ("unit", pa.string()),
+            ("timestamp", pa.timestamp("us")),
+            ("value", pa.float64()),
+        ]
+    )
+    sink = _ArrowSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield sink.drain()
+        async for rows in partitions:
+            columns = zip(*rows)
+            writer.write_batch(
+                pa.record_batch(
+                    [pa.array(col, field.type) for col, field in zip(columns, schema)],
+                    schema=schema,
+                )
+            )
+            yield sink.drain()
+    yield sink.drain()
+
+
+# format -> (media type, encoder)
+FORMATS = {
+    "ndjson": ("application/x-ndjson", encode_ndjson),
+    "csv": ("text/csv", encode_csv),
+    "arrow": ("application/vnd.apache.arrow.stream", encode_arrow),
+}
+
+
+async def stream_rows(stmt, params, encode, chunk_size):
+    """Yield the encoded result of the statement executed with the
+    parameters, chunk_size rows at a time.
+
+    The rows are fetched with a server side cursor in its own session, the
+    session of the request is closed before the response is streamed.
+    """
+    async with AsyncSession(get_async_read_engine()) as session:
+        result = await session.stream(
+            stmt, params, execution_options={"yield_per": chunk_size}
+        )
+        async for chunk in encode(result.partitions()):
+            yield chunk
@@ -0,0 +1,278 @@
+"""In-memory hot tier of the recent sensor values
+
+The values of every (sensor, metric) are kept in a NumPy ring buffer of
+int64 timestamps (microseconds) and float64 values. The buffers are filled
+at startup with the values of the last `window` seconds and by every write
+of the API, and answer latest queries and the min / max / sum / average of
+date windows they cover. Queries which do not fit fall back to SQL.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import select
+
+from abcde.retention import RETENTION
+from abcde.sql_models import Sensor, SensorLatest, SensorMetric, SensorValue
+
+# the covered start of series which were not loaded at startup
+UNBOUNDED = np.iinfo(np.int64).min
+
+
+def to_us(timestamp):
+    """Microseconds since the epoch of a naive datetime (parse_date returns
+    the dates with a timezone as naive UTC)."""
+    return int(np.datetime64(timestamp, "us").astype(np.int64))
+
+
+def to_us_array(timestamps):
+    return np.array(timestamps, dtype="datetime64[us]").astype(np.int64)
+
+
+# pylint: disable=too-few-public-methods,too-many-instance-attributes
+class Series:
+    """Ring buffer of the values of a (sensor, metric).
+
+    Every value with a timestamp >= `covered_since` is in the buffer. The
+    buffer keeps the last written `capacity` values, `covered_since` moves
+    past the timestamps of the overwritten ones.
+    """
+
+    def __init__(self, ids, unit, capacity, covered_since):
+        # (sensor_id, metric_id), the order of the latest rows
+        self.ids = ids
+        self.unit = unit
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.size = 0
+        self.next = 0
+        self.covered_since = covered_since
+        # (timestamp, value) of the newest value, kept like sensor_latest
+        self.latest = None
+
+    def extend(self, timestamps, values):
+        if timestamps.size:
+            index = len(timestamps) - 1 - int(np.argmax(timestamps[::-1]))
+            if self.latest is None or timestamps[index] >= self.latest[0]:
+                self.latest = (int(timestamps[index]), float(values[index]))
+
+        keep = timestamps >= self.covered_since
+        timestamps, values = timestamps[keep], values[keep]
+        capacity = len(self.timestamps)
+        if len(timestamps) > capacity:
+            self._evict(timestamps[: len(timestamps) - capacity])
+            timestamps, values = timestamps[-capacity:], values[-capacity:]
+        if not timestamps.size:
+            return
+
+        positions = (self.next + np.arange(len(timestamps))) % capacity
+        # the empty slots come first, the oldest values after them
+        overwritten = positions[capacity - self.size :]
+        if overwritten.size:
+            self._evict(self.timestamps[overwritten])
+        self.timestamps[positions] = timestamps
+        self.values[positions] = values
+        self.next = (self.next + len(timestamps)) % capacity
+        self.size = min(capacity, self.size + len(timestamps))
+
+    def _evict(self, timestamps):
+        self.covered_since = max(self.covered_since, int(timestamps.max()) + 1)
+
+    def window(self, since):
+        """The values since the timestamp (microseconds)."""
+        timestamps = self.timestamps[: self.size]
+        return self.values[: self.size][timestamps >= since]
+
+
+AGGREGATIONS = {
+    "min": np.min,
+    "max": np.max,
+    "sum": np.sum,
+    "average": np.mean,
+}
+
+
+class HotTier:
+    """The Series of the (sensor, metric) pairs, at most `max_series`.
+
+    Latest and date window queries are answered if every series they read
+    covers the window. Once a series could not be added, queries of all
+    sensors and of unknown pairs fall back to SQL too.
+    """
+
+    def __init__(self, points, max_series, window):
+        self.points = points
+        self.max_series = max_series
+        self.window = window
+        # (sensor, metric) -> Series
+        self.series = {}
+        self.complete = True
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self, session, now, chunk_size=10000):
+        """Load the latest values and the values of the last `window` seconds."""
+        since = now - timedelta(seconds=self.window)
+        await self._load_latest(session, to_us(since))
+        await self._load_values(session, since, chunk_size)
+
+    async def _load_latest(self, session, covered_since):
+        result = await session.execute(
+            select(
+                Sensor.name,
+                SensorMetric.name,
+                SensorMetric.unit,
+                SensorLatest.sensor_id,
+                SensorLatest.metric_id,
+                SensorLatest.timestamp,
+                SensorLatest.value,
+            )
+            .join(Sensor, Sensor.id == SensorLatest.sensor_id)
+            .join(SensorMetric, SensorMetric.id == SensorLatest.metric_id)
+        )
+        for sensor, metric, unit, sensor_id, metric_id, timestamp, value in result:
+            series = self._get_series(
+                (sensor, metric), (sensor_id, metric_id), unit, covered_since
+            )
+            if series:
+                series.latest = (to_us(timestamp), value)
+
+    async def _load_values(self, session, since, chunk_size):
+        stmt = (
+            select(
+                Sensor.name,
+                SensorMetric.name,
+                SensorValue.timestamp,
+                SensorValue.value,
+            )
+            .join(Sensor, Sensor.id == SensorValue.sensor_id)
+            .join(SensorMetric, SensorMetric.id == SensorValue.metric_id)
+            .where(SensorValue.timestamp >= since)
+            .order_by(SensorValue.timestamp)
+            .execution_options(yield_per=chunk_size)
+        )
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            groups = {}
+            for sensor, metric, timestamp, value in rows:
+                groups.setdefault((sensor, metric), ([], []))
+                groups[sensor, metric][0].append(timestamp)
+                groups[sensor, metric][1].append(value)
+            for key, (timestamps, values) in groups.items():
+                if key in self.series:
+                    self.series[key].extend(
+                        to_us_array(timestamps), np.array(values, dtype=np.float64)
+                    )
+
+    def _get_series(self, key, ids, unit, covered_since):
+        series = self.series.get(key)
+        if series is None:
+            if len(self.series) >= self.max_series:
+                self.complete = False
+                return None
+            series = self.series[key] = Series(ids, unit, self.points, covered_since)
+        return series
+
+    def add(self, rows, timestamps, ids):
+        """Add written SensorInput rows, `ids` is the NameIdCache of the
+        committed sensor and metric ids. The series get the stored unit of
+        the metric, not the unit of the row."""
+        groups = {}
+        for row, timestamp in zip(rows, timestamps):
+            groups.setdefault((row.sensor, row.metric), ([], []))
+            groups[row.sensor, row.metric][0].append(timestamp)
+            groups[row.sensor, row.metric][1].append(row.value)
+        for (sensor, metric), (group_timestamps, values) in groups.items():
+            series = self._get_series(
+                (sensor, metric),
+                (ids.sensors[sensor], ids.metrics[metric]),
+                ids.units[metric],
+                UNBOUNDED,
+            )
+            if series:
+                series.extend(
+                    to_us_array(group_timestamps), np.array(values, dtype=np.float64)
+                )
+
+    def _keys(self, parsed):
+        """The tracked (sensor, metric) pairs of the query, None if unknown."""
+        metrics = set(parsed["metric"])
+        if "_all_" in parsed["sensor"]:
+            if not self.complete:
+                return None
+            return [key for key in self.series if key[1] in metrics]
+        keys = [
+            (sensor, metric) for sensor in set(parsed["sensor"]) for metric in metrics
+        ]
+        if not self.complete and any(key not in self.series for key in keys):
+            return None
+        return [key for key in keys if key in self.series]
+
+    def rows(self, parsed):
+        """Result rows of a parsed query, None if it has to be read by SQL."""
+        keys = None if parsed["bucket"] else self._keys(parsed)
+        if keys is not None and not parsed["date"]:
+            self.hits += 1
+            return self._latest_rows(keys)
+
+        # SQL reads windows reaching into expired raw values from whole
+        # rollup buckets, these are not answered
+        if (
+            keys is not None
+            and RETENTION.window_start(parsed["date"][0]) == (parsed["date"][0])
+        ):
+            since = to_us(parsed["date"][0])
+            if all(self.series[key].covered_since <= since for key in keys):
+                self.hits += 1
+                return self._window_rows(keys, since, parsed["aggregation"][0])
+
+        self.misses += 1
+        return None
+
+    def _latest_rows(self, keys):
+        series = [(self.series[key], key) for key in keys]
+        series.sort(key=lambda item: item[0].ids)
+        return [
+            {
+                "sensor": sensor,
+                "metric": metric,
+                "unit": item.unit,
+                "value": item.latest[1],
+            }
+            for item, (sensor, metric) in series
+            if item.latest is not None
+        ]
+
+    def _window_rows(self, keys, since, aggregation):
+        aggregate = AGGREGATIONS[aggregation]
+        rows = []
+        for sensor, metric in keys:
+            series = self.series[sensor, metric]
+            values = series.window(since)
+            if len(values):
+                rows.append(
+                    {
+                        "sensor": sensor,
+                        "metric": metric,
+                        "unit": series.unit,
+                        "value": float(aggregate(values)),
+                    }
+                )
+        rows.sort(key=lambda row: (row["sensor"], row["metric"], row["unit"]))
+        return rows
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "series": len(self.series),
+            "max_series": self.max_series,
+            "points": sum(series.size for series in self.series.values()),
+            "bytes": sum(
+                series.timestamps.nbytes + series.values.nbytes
+                for series in self.series.values()
+            ),
+            "complete": self.complete,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
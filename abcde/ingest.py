@@ -0,0 +1,132 @@
+"""Sensor data ingestion"""
+
+import weakref
+from datetime import datetime
+
+from sqlalchemy import select
+
+from abcde.sql_models import (
+    Sensor,
+    SensorMetric,
+    SensorValue,
+    dialect_insert,
+    latest_rows,
+    latest_upsert,
+    rollup_rows,
+    rollup_upsert,
+)
+from abcde.storage import get_storage
+
+
+# pylint: disable=too-few-public-methods
+class NameIdCache:
+    """In-process sensor / metric name -> id cache.
+
+    Names are never renamed or deleted, so an id stays valid once it was
+    committed. `units` has the stored unit of every cached metric, a write
+    with another unit does not change it.
+    """
+
+    def __init__(self):
+        self.sensors = {}
+        self.metrics = {}
+        self.units = {}
+
+
+_ID_CACHES = weakref.WeakKeyDictionary()
+
+
+def get_id_cache(session):
+    """Return the id cache belonging to the engine of the session."""
+    engine = session.bind.sync_engine
+    cache = _ID_CACHES.get(engine)
+    if cache is None:
+        cache = _ID_CACHES[engine] = NameIdCache()
+    return cache
+
+
+async def _resolve_ids(session, model, values, cache, units=None):
+    """Return name -> id for all names in values, creating the missing ones.
+
+    The stored units of the missing metrics are added to `units`.
+    """
+    ids = {name: cache[name] for name in values if name in cache}
+    missing = [value for name, value in values.items() if name not in ids]
+    if missing:
+        stmt = dialect_insert(session.bind.dialect, model).on_conflict_do_nothing(
+            index_elements=["name"]
+        )
+        await session.execute(stmt, missing)
+        columns = [model.name, model.id]
+        if units is not None:
+            columns.append(model.unit)
+        result = await session.execute(
+            select(*columns).where(model.name.in_([value["name"] for value in missing]))
+        )
+        for name, id_, *unit in result.tuples():
+            ids[name] = id_
+            if units is not None:
+                units[name] = unit[0]
+    return ids
+
+
+async def insert_values(session, rows, timestamps=None, generation=None):
+    """Insert a batch of SensorInput rows in a single transaction.
+
+    Sensor and metric names are resolved through the id cache, the missing
+    ones are created with one upsert each, and the values are written with a
+    single executemany INSERT. sensor_latest and sensor_rollups are updated
+    with one upsert each. Rows without a given timestamp get the current time.
+    A SharedGeneration (`generation`) is incremented in the transaction.
+    """
+    if not rows:
+        return 0
+
+    cache = get_id_cache(session)
+    metrics = {}
+    for row in rows:
+        metrics.setdefault(row.metric, {"name": row.metric, "unit": row.unit})
+
+    sensor_ids = await _resolve_ids(
+        session,
+        Sensor,
+        {row.sensor: {"name": row.sensor} for row in rows},
+        cache.sensors,
+    )
+    metric_units = {}
+    metric_ids = await _resolve_ids(
+        session, SensorMetric, metrics, cache.metrics, metric_units
+    )
+
+    if timestamps is None:
+        timestamps = [datetime.now() for _ in rows]
+
+    values = [
+        {
+            "sensor_id": sensor_ids[row.sensor],
+            "metric_id": metric_ids[row.metric],
+            "value": row.value,
+            "timestamp": timestamp,
+        }
+        for row, timestamp in zip(rows, timestamps)
+    ]
+    dialect = session.bind.dialect
+    storage = get_storage(dialect.name)
+    if storage.partitioned:
+        connection = await session.connection()
+        await connection.run_sync(storage.prepare_insert, timestamps)
+
+    await session.execute(SensorValue.__table__.insert(), values)
+    await session.execute(latest_upsert(dialect), latest_rows(values))
+    await session.execute(rollup_upsert(dialect), rollup_rows(values))
+    if generation:
+        value = await generation.bump(session)
+    await session.commit()
+    if generation:
+        generation.observe(value, own=1)
+
+    # only cache ids which are committed
+    cache.sensors.update(sensor_ids)
+    cache.metrics.update(metric_ids)
+    cache.units.update(metric_units)
+    return len(rows)
@@ -4,52 +4,109 @@ import re
 import math
 from collections import Counter
 from abc import ABC, abstractmethod
-from dateutil import parser
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+from abcde.cache import LRUCache
 
 
 class Tag(ABC):
     """Tag"""
 
+    # eager tags are evaluated for every word, lazy ones only when a pipe
+    # reaches them
+    eager = True
+
     def __init__(self, tag):
         self.tag = tag
 
     def tag_name(self):
         return self.tag
 
+    def key(self):
+        """Tags with the same key tag every word the same way."""
+        return (type(self), id(self))
+
+    def match(self, word):
+        """Return (tag name, matched value) or None, without keeping state."""
+        if m := self.matches(word):
+            return (self.tag_name(), m)
+        return None
+
     @abstractmethod
     def matches(self, word):
         pass
 
 
+def cosine_sim(str1, str2):
+    """Cosine similarity of the character frequency vectors, case insensitive."""
+    # Vectorize the strings based on character frequency
+    vec1 = Counter(str1.lower())
+    vec2 = Counter(str2.lower())
+
+    # Dot Product
+    intersection = set(vec1.keys()) & set(vec2.keys())
+    dot_product = sum(vec1[x] * vec2[x] for x in intersection)
+
+    # Magnitude
+    mag1 = math.sqrt(sum(val**2 for val in vec1.values()))
+    mag2 = math.sqrt(sum(val**2 for val in vec2.values()))
+
+    return dot_product / (mag1 * mag2) if (mag1 * mag2) else 0
+
+
 class SimilarityMatcher:
-    """SimilarityMatcher"""
+    """SimilarityMatcher
+
+    Cosine similarity of character frequency vectors. The vectors of the
+    vocabulary are built once, an input word is scored against the whole
+    vocabulary with one matrix product and the result is cached per word.
+    """
 
-    def __init__(self, words, similarity=0.9, exact_match=False):
+    def __init__(self, words, similarity=0.9, exact_match=False, cache_size=1024):
         self.words = words
         self.similarity = similarity
         self.exact_match = exact_match
+        self.cache = LRUCache(cache_size)
+
+        lowered = [w.lower() for w in words]
+        self.alphabet = {c: i for i, c in enumerate(sorted(set("".join(lowered))))}
+        self.vectors = np.zeros((len(words), len(self.alphabet)), dtype=np.int64)
+        for row, w in enumerate(lowered):
+            for c in w:
+                self.vectors[row, self.alphabet[c]] += 1
+        self.magnitudes = np.sqrt((self.vectors**2).sum(axis=1))
 
     def word_match(self, word):
-        for w in self.words:
-            sim = self.get_cosine_sim(w, word)
-            if sim >= self.similarity:
-                return word
-        return False
+        match = self.cache.get(word)
+        if match is None:
+            sims = self.get_cosine_sims(word)
+            match = word if (sims >= self.similarity).any() else False
+            self.cache.put(word, match)
+        return match
 
-    def get_cosine_sim(self, str1, str2):
-        # Vectorize the strings based on character frequency
-        vec1 = Counter(str1.lower())
-        vec2 = Counter(str2.lower())
+    def get_cosine_sims(self, word):
+        """Cosine similarity of the word and every vocabulary word.
 
-        # Dot Product
-        intersection = set(vec1.keys()) & set(vec2.keys())
-        dot_product = sum(vec1[x] * vec2[x] for x in intersection)
+        Same arithmetic as get_cosine_sim: integer dot products divided by
+        the product of the square root magnitudes.
+        """
+        counts = Counter(word.lower())
+        mag = math.sqrt(sum(val**2 for val in counts.values()))
+        if not mag:
+            return np.zeros(len(self.words))
 
-        # Magnitude
-        mag1 = math.sqrt(sum(val**2 for val in vec1.values()))
-        mag2 = math.sqrt(sum(val**2 for val in vec2.values()))
+        vec = np.zeros(len(self.alphabet), dtype=np.int64)
+        for c, n in counts.items():
+            if (i := self.alphabet.get(c)) is not None:
+                vec[i] = n
 
-        return dot_product / (mag1 * mag2) if (mag1 * mag2) else 0
+        mags = self.magnitudes * mag
+        dots = self.vectors @ vec
+        return np.divide(dots, mags, out=np.zeros(len(self.words)), where=mags != 0)
+
+    def get_cosine_sim(self, str1, str2):
+        return cosine_sim(str1, str2)
 
 
 class SimilarityTag(Tag):
@@ -59,10 +116,32 @@ class SimilarityTag(Tag):
         self.matcher = SimilarityMatcher(words, similarity, exact_match)
         super().__init__(tag)
 
+    def key(self):
+        return (
+            type(self),
+            self.tag,
+            tuple(self.matcher.words),
+            self.matcher.similarity,
+        )
+
     def matches(self, word):
         return self.matcher.word_match(word)
 
 
+class VocabularyTag(Tag):
+    """Names of an abcde.vocabulary.Vocabulary, matches the known name."""
+
+    def __init__(self, tag, vocabulary):
+        self.vocabulary = vocabulary
+        super().__init__(tag)
+
+    def key(self):
+        return (type(self), self.tag, id(self.vocabulary))
+
+    def matches(self, word):
+        return self.vocabulary.lookup(word) or False
+
+
 class ReTag(Tag):
     """ReTag"""
 
@@ -70,20 +149,105 @@ class ReTag(Tag):
         self.exp = re.compile(exp)
         super().__init__(tag)
 
+    def key(self):
+        return (type(self), self.tag, self.exp.pattern)
+
     def matches(self, word):
         if self.exp.fullmatch(word):
             return word
         return False
 
 
+# year first dates, with an optional time: 2024-01-02, 2024.1.2, 2024/01/02,
+# 2024-01-02T10:20:30.5
+YMD_DATE = re.compile(
+    r"(?P<year>\d{4})(?P<sep>[-./])(?P<month>\d{1,2})(?P=sep)(?P<day>\d{1,2})"
+    r"(?:[Tt](?P<hour>\d{1,2}):(?P<minute>\d{2})"
+    r"(?::(?P<second>\d{2})(?:\.(?P<fraction>\d{1,6}))?)?)?"
+)
+# year last dates: 02/01/2024, 13.01.2024; month first unless the first
+# number can't be a month, as dateutil reads them
+DMY_DATE = re.compile(
+    r"(?P<first>\d{1,2})(?P<sep>[-./])(?P<second>\d{1,2})(?P=sep)(?P<year>\d{4})"
+)
+COMPACT_DATE = re.compile(r"(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})")
+
+
+def fast_date(word):
+    """Return the datetime of a date in one of the common numeric formats,
+    None for any other word or an invalid date."""
+    if m := YMD_DATE.fullmatch(word) or COMPACT_DATE.fullmatch(word):
+        parts = m.groupdict()
+        fraction = parts.get("fraction") or "0"
+        fields = (
+            parts["year"],
+            parts["month"],
+            parts["day"],
+            parts.get("hour") or 0,
+            parts.get("minute") or 0,
+            parts.get("second") or 0,
+            fraction.ljust(6, "0"),
+        )
+    elif m := DMY_DATE.fullmatch(word):
+        first, second = int(m["first"]), int(m["second"])
+        month, day = (first, second) if first <= 12 else (second, first)
+        fields = (m["year"], month, day)
+    else:
+        return None
+    try:
+        return datetime(*map(int, fields))
+    except ValueError:
+        return None
+
+
+DATE_CACHE = LRUCache(1024)
+
+# a date window is rounded up to whole rollup buckets (up to a day), the
+# bucket end of a later date is out of the datetime range
+LATEST_DATE = datetime.max - timedelta(days=1)
+
+
+def parse_date(word):
+    """Return the datetime of the word or raise ValueError.
+
+    The common numeric formats are read with the precompiled expressions
+    and cached, any other word goes to dateutil. dateutil fills the missing
+    fields from the current date, its results are not cached. Dates with a
+    timezone are returned as naive UTC datetimes, like the stored timestamps
+    they are compared with. Dates after LATEST_DATE are invalid.
+    """
+    dt = DATE_CACHE.get(word)
+    if dt is not None:
+        return dt
+    dt = fast_date(word)
+    cached = dt is not None
+    if not cached:
+        # imported on the first unusual date, it is not needed to start the app
+        from dateutil import parser  # pylint: disable=import-outside-toplevel
+
+        try:
+            dt = parser.parse(word)
+            if dt.tzinfo is not None:
+                dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        except (ValueError, OverflowError) as e:
+            raise ValueError(f"Invalid date: {word}") from e
+    if dt > LATEST_DATE:
+        raise ValueError(f"Invalid date: {word}")
+    if cached:
+        DATE_CACHE.put(word, dt)
+    return dt
+
+
 class DateTag(Tag):
     """DateTag"""
 
+    eager = False
+
+    def key(self):
+        return (type(self), self.tag)
+
     def matches(self, word):
-        dt = parser.parse(word)
-        if dt:
-            return dt
-        return False
+        return parse_date(word)
 
 
 class CompoundTag(Tag):
@@ -94,6 +258,9 @@ class CompoundTag(Tag):
         self.matched_tag = None
         super().__init__(tag)
 
+    def key(self):
+        return (type(self), self.tag, tuple(part.key() for part in self.parts))
+
     def matches(self, word):
         for part in self.parts:
             if part.matches(word):
@@ -101,5 +268,134 @@ class CompoundTag(Tag):
                 return word
         return False
 
+    def match(self, word):
+        for part in self.parts:
+            if part.matches(word):
+                return (part.tag, word)
+        return None
+
     def tag_name(self):
         return self.matched_tag.tag
+
+
+# pylint: disable=too-few-public-methods
+class Tagger:
+    """Tag words with a deduplicated set of tags.
+
+    A word is tagged with every eager tag at once and the {tag key: match}
+    table is cached per word. Tags with `eager = False` are only evaluated
+    when a pipe needs them (see TagLattice). `clear` drops the tables when
+    what the tags match changed, a table computed before by another thread
+    is not kept.
+    """
+
+    def __init__(self, tags, cache_size=4096):
+        self.tags = {}
+        for tag in tags:
+            self.tags.setdefault(tag.key(), tag)
+        self.eager = [(key, tag) for key, tag in self.tags.items() if tag.eager]
+        self.cache = LRUCache(cache_size)
+        self.generation = 0
+
+    def tag(self, word):
+        table = self.cache.get(word)
+        if table is None:
+            generation = self.generation
+            table = {key: tag.match(word) for key, tag in self.eager}
+            self.cache.put(word, table)
+            if generation != self.generation:
+                self.cache.pop(word)
+        return table
+
+    def clear(self):
+        self.generation += 1
+        self.cache.clear()
+
+
+# pylint: disable=too-few-public-methods
+class TagLattice:
+    """(word index, tag) -> match table of a text.
+
+    Every word is stripped and tagged once, no matter how many pipes use a
+    tag. Lazy tags are evaluated on demand, at most once per word index.
+    """
+
+    def __init__(self, words, tagger):
+        self.words = [word.strip(".,") for word in words]
+        self.tokens = [tagger.tag(word) for word in self.words]
+        self.lazy = {}
+
+    def match(self, index, key, tag):
+        try:
+            return self.tokens[index][key]
+        except KeyError:
+            pass
+        cell = (index, key)
+        try:
+            return self.lazy[cell]
+        except KeyError:
+            match = self.lazy[cell] = tag.match(self.words[index])
+            return match
+
+
+# pylint: disable=too-few-public-methods
+class _TrieNode:
+    __slots__ = ("children", "pipe", "first")
+
+    def __init__(self):
+        self.children = {}
+        self.pipe = None
+        self.first = math.inf
+
+
+class PipeTrie:
+    """Trie over the tag sequences of a list of pipes.
+
+    A pipe is a (tags, resolve) pair. `first_match` returns the pipe which
+    matches at the word index and comes first in the list, the same pipe a
+    linear scan of the list would find. Subtrees which can only contain later
+    pipes than the one already found are not evaluated.
+    """
+
+    def __init__(self, pipes):
+        self.root = _TrieNode()
+        self.tags = []
+        for index, (tags, resolve) in enumerate(pipes):
+            node = self.root
+            node.first = min(node.first, index)
+            self.tags.extend(tags)
+            for tag in tags:
+                key = tag.key()
+                if key not in node.children:
+                    node.children[key] = (tag, _TrieNode())
+                node = node.children[key][1]
+                node.first = min(node.first, index)
+            if node.pipe is None:
+                node.pipe = (index, resolve)
+        self._sort(self.root)
+
+    def _sort(self, node):
+        node.children = sorted(
+            ((key, tag, child) for key, (tag, child) in node.children.items()),
+            key=lambda item: item[2].first,
+        )
+        for _, _, child in node.children:
+            self._sort(child)
+
+    def first_match(self, lattice, index):
+        """Return (resolve, tags) of the first matching pipe or None."""
+        best = self._walk(self.root, lattice, index, [], None)
+        return best[1:] if best else None
+
+    def _walk(self, node, lattice, index, tags, best):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        if node.pipe and (best is None or node.pipe[0] < best[0]):
+            best = (node.pipe[0], node.pipe[1], tags)
+        if index >= len(lattice.words):
+            return best
+        for key, tag, child in node.children:
+            if best is not None and child.first >= best[0]:
+                break
+            if match := lattice.match(index, key, tag):
+                best = self._walk(child, lattice, index + 1, tags + [match], best)
+        return best
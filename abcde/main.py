@@ -1,30 +1,250 @@
 """abcde main app"""
 
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from typing import Annotated
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Query, HTTPException
-from sqlalchemy import select
+from fastapi import FastAPI, Query, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from abcde import models
-from abcde.utils import SessionDep, create_db_and_tables
-from abcde.query_parser import Query as QueryParser
-from abcde.sql_models import Sensor, SensorMetric, SensorValue
+from abcde.cache import ResultCache, SharedGeneration
+from abcde.config import Config
+from abcde.export import FORMATS, get_pyarrow, stream_rows
+from abcde.hot_tier import HotTier
+from abcde.ingest import get_id_cache, insert_values
+from abcde.metrics import (
+    COMPILED_CACHE,
+    Metrics,
+    MetricsMiddleware,
+    execute,
+    listen_cursor_events,
+    log_slow_query,
+    remove_cursor_events,
+    span,
+)
+from abcde.utils import (
+    SessionDep,
+    WriteSessionDep,
+    create_db_and_tables,
+    dispose_engines,
+    get_async_engine,
+    get_async_read_engine,
+)
+from abcde.language_parser import DATE_CACHE
+from abcde.responses import FastJSONResponse, query_payload
+from abcde.retention import RETENTION, Compactor
+from abcde.query_parser import (
+    METRIC_NAMES,
+    PARSE_CACHE,
+    QUERY_LIMITS,
+    SENSOR_NAMES,
+    STMT_CACHE,
+    Query as QueryParser,
+    QueryBatch,
+    SeriesQuery,
+    add_names,
+)
+from abcde.vocabulary import NameLoader
+from abcde.write_behind import BufferFull, WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+SENSOR_INPUT = TypeAdapter(models.SensorInput)
+SENSOR_INPUT_LIST = TypeAdapter(list[models.SensorInput])
+
+
+async def write_values(session, rows, timestamps=None):
+    """Insert the values, add them to the hot tier and invalidate the cached
+    results covering them."""
+    result_cache = getattr(app.state, "result_cache", None)
+    hot_tier = getattr(app.state, "hot_tier", None)
+    generation = result_cache.shared if result_cache else None
+    if timestamps is None:
+        timestamps = [datetime.now() for _ in rows]
+    count = await insert_values(session, rows, timestamps, generation)
+    add_names({row.sensor for row in rows}, {row.metric for row in rows})
+    if hot_tier:
+        hot_tier.add(rows, timestamps, get_id_cache(session))
+    if result_cache:
+        result_cache.invalidate({(row.sensor, row.metric) for row in rows})
+    return count
+
+
+async def flush_sensor_values(rows, timestamps):
+    async with AsyncSession(get_async_engine()) as session:
+        await write_values(session, rows, timestamps)
+
+
+async def expire_results(session):
+    """Drop the cached results after expired rows were deleted."""
+    result_cache = getattr(app.state, "result_cache", None)
+    if result_cache is None:
+        return
+    if result_cache.shared:
+        value = await result_cache.shared.bump(session)
+        await session.commit()
+        result_cache.shared.observe(value, own=1)
+    result_cache.clear()
+
+
+async def load_names(config):
+    """Load the sensor and metric names of the database into the parser,
+    with multiple workers the names of the other workers are synced."""
+    sync_ms = config.vocabulary_sync_ms if config.workers > 1 else None
+    loader = NameLoader(add_names, sync_ms)
+    async with AsyncSession(get_async_read_engine()) as session:
+        await loader.load(session)
+    return loader
+
+
+def start_parse_threads(config):
+    """Configure the parser, return the executor of the parse threads or
+    None to parse on the event loop."""
+    PARSE_CACHE.resize(config.parse_cache_size)
+    QUERY_LIMITS.configure(
+        config.max_query_length, config.max_query_tokens, config.max_batch_queries
+    )
+    if config.parse_threads <= 0:
+        return None
+    return ThreadPoolExecutor(config.parse_threads, thread_name_prefix="parse")
+
+
+def stop_parse_threads(executor):
+    if executor:
+        executor.shutdown()
+    QUERY_LIMITS.configure()
+
+
+def start_metrics(config):
+    """Listen to the engine events, return the Metrics registry or None."""
+    COMPILED_CACHE.listen()
+    if not config.metrics:
+        return None
+    listen_cursor_events()
+    return Metrics()
+
+
+def stop_metrics(metrics):
+    if metrics:
+        remove_cursor_events()
+    COMPILED_CACHE.remove()
+
+
+async def run_parser(fn, *args):
+    """Call a parser method in the parse threads, a long query does not
+    block the other requests."""
+    executor = getattr(app.state, "parse_executor", None)
+    if executor is None:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+async def sync_names(session):
+    """Add the sensor and metric names written by the other workers."""
+    name_loader = getattr(app.state, "name_loader", None)
+    if name_loader:
+        await name_loader.sync(session)
 
 
 @asynccontextmanager
-async def lifespan(_):
+async def lifespan(app_):
+    # every worker process runs the lifespan, the engines and caches are
+    # created per worker
+    get_async_read_engine()
     await create_db_and_tables()
+
+    config = Config()
+    app_.state.parse_executor = start_parse_threads(config)
+    RETENTION.configure(
+        raw=config.retention_raw,
+        minute=config.retention_minute,
+        hour=config.retention_hour,
+        day=config.retention_day,
+    )
+
+    app_.state.name_loader = await load_names(config)
+
+    app_.state.metrics = start_metrics(config)
+    app_.state.slow_query_ms = config.slow_query_ms
+
+    app_.state.result_cache = None
+    if config.result_cache_size > 0:
+        shared = None
+        if config.workers > 1:
+            shared = SharedGeneration(config.result_cache_sync_ms)
+        app_.state.result_cache = ResultCache(
+            config.result_cache_size, config.result_cache_max_staleness, shared
+        )
+
+    app_.state.hot_tier = None
+    if config.hot_tier and config.workers > 1:
+        logger.warning("The hot tier is disabled with multiple workers")
+    elif config.hot_tier:
+        hot_tier = HotTier(
+            config.hot_tier_points, config.hot_tier_series, config.hot_tier_window
+        )
+        async with AsyncSession(get_async_read_engine()) as session:
+            await hot_tier.load(session, datetime.now())
+        app_.state.hot_tier = hot_tier
+
+    app_.state.write_buffer = None
+    if config.write_behind:
+        app_.state.write_buffer = WriteBehindBuffer(
+            flush_sensor_values,
+            batch_size=config.write_behind_batch_size,
+            flush_ms=config.write_behind_flush_ms,
+            queue_size=config.write_behind_queue_size,
+            put_timeout_ms=config.write_behind_put_timeout_ms,
+            retries=config.write_behind_retries,
+            retry_ms=config.write_behind_retry_ms,
+        )
+        await app_.state.write_buffer.start()
+
+    app_.state.compactor = None
+    if any(RETENTION.seconds.values()):
+        app_.state.compactor = Compactor(
+            RETENTION,
+            lambda: AsyncSession(get_async_engine()),
+            interval=config.retention_interval,
+            batch_size=config.retention_batch_size,
+            on_deleted=expire_results,
+        )
+        await app_.state.compactor.start()
+
     yield
 
+    if app_.state.compactor:
+        await app_.state.compactor.stop()
+    app_.state.compactor = None
+    RETENTION.configure()
+    if app_.state.write_buffer:
+        await app_.state.write_buffer.stop()
+    app_.state.write_buffer = None
+    app_.state.result_cache = None
+    app_.state.hot_tier = None
+    stop_metrics(app_.state.metrics)
+    app_.state.metrics = None
+    stop_parse_threads(app_.state.parse_executor)
+    app_.state.parse_executor = None
+    await dispose_engines()
+
 
 app = FastAPI(title="abcde", lifespan=lifespan)  # pylint: disable=unused-argument
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get(
     "/query",
-    response_model=models.SensorMetricResult,
-    response_model_exclude_unset=True,
+    response_model=models.SensorMetricResult | models.SensorMetricSeriesResult,
     status_code=200,
 )
 async def get_query(
@@ -32,23 +252,136 @@ async def get_query(
     session: SessionDep,
 ):
     """GET query"""
+    start = time.perf_counter()
+    await sync_names(session)
     try:
-        parser = QueryParser(data.query)
-        stmt = parser.get_stmt()
+        with span("parse"):
+            parser = QueryParser(data.query)
+            if parser.cached():
+                parser.parse()
+            else:
+                await run_parser(parser.parse)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
-    result = await session.execute(stmt)
-    results = []
-    for res in result.mappings().all():
-        results.append(models.SensorMetric(**res))
-
-    meta = models.QueryMeta(
-        sensor=parser.parsed["sensor"],
-        metric=parser.parsed["metric"],
-        aggregation=parser.parsed["aggregation"][0],
-        date=parser.parsed["date"][0] if len(parser.parsed["date"]) > 0 else None,
+
+    hot_tier = getattr(app.state, "hot_tier", None)
+    result_cache = getattr(app.state, "result_cache", None)
+    rows = None
+    if hot_tier:
+        with span("hot_tier"):
+            rows = hot_tier.rows(parser.parsed)
+    if rows is None and result_cache:
+        with span("cache"):
+            await result_cache.sync(session)
+            key = result_cache.key(parser.parsed)
+            rows = result_cache.get(key)
+    if rows is None:
+        generation = result_cache.generation if result_cache else None
+        # the statement is only built for the queries read by SQL
+        with span("parse"):
+            stmt, params = await run_parser(parser.statement)
+        result = await execute(session, stmt, params)
+        with span("fetch"):
+            rows = [dict(res) for res in result.mappings().all()]
+        log_slow_query(
+            getattr(app.state, "slow_query_ms", 0),
+            start,
+            parser,
+            (stmt, params),
+            session.bind.dialect,
+        )
+        if result_cache:
+            result_cache.put(key, rows, generation)
+
+    with span("build"):
+        payload = query_payload(parser, rows)
+    with span("serialize"):
+        return FastJSONResponse(payload)
+
+
+@app.post(
+    "/query/batch",
+    response_model=list[models.SensorMetricResult | models.SensorMetricSeriesResult],
+    status_code=200,
+)
+async def post_query_batch(  # pylint: disable=too-many-locals
+    data: list[models.QueryInput],
+    session: SessionDep,
+):
+    """POST a list of queries, answered in order
+
+    Queries sharing the aggregation and the date window are answered by a
+    single statement.
+    """
+    await sync_names(session)
+    try:
+        # the size of the batch is checked before it is queued for parsing
+        batch = QueryBatch([query.query for query in data])
+        with span("parse"):
+            await run_parser(batch.parse)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    hot_tier = getattr(app.state, "hot_tier", None)
+    result_cache = getattr(app.state, "result_cache", None)
+    rows = [None] * len(batch.queries)
+    keys = [None] * len(batch.queries)
+    if hot_tier:
+        with span("hot_tier"):
+            rows = [hot_tier.rows(parser.parsed) for parser in batch.queries]
+    if result_cache:
+        await result_cache.sync(session)
+        for index, parser in enumerate(batch.queries):
+            if rows[index] is None:
+                keys[index] = result_cache.key(parser.parsed)
+                rows[index] = result_cache.get(keys[index])
+
+    missing = [index for index, row in enumerate(rows) if row is None]
+    if missing:
+        generation = result_cache.generation if result_cache else None
+        with span("parse"):
+            stmts = await run_parser(batch.get_stmts, missing)
+        for stmt, params, indexes in stmts:
+            result = await execute(session, stmt, params)
+            with span("fetch"):
+                group_rows = [dict(res) for res in result.mappings().all()]
+            for index in indexes:
+                rows[index] = batch.queries[index].select_rows(group_rows)
+                if result_cache:
+                    result_cache.put(keys[index], rows[index], generation)
+
+    with span("build"):
+        payload = [
+            query_payload(parser, query_rows)
+            for parser, query_rows in zip(batch.queries, rows)
+        ]
+    with span("serialize"):
+        return FastJSONResponse(payload)
+
+
+@app.get(
+    "/series",
+    response_class=StreamingResponse,
+    status_code=200,
+)
+async def get_series(data: Annotated[models.SeriesInput, Query()]):
+    """GET the raw values of the sensors and metrics of a query
+
+    The values are streamed as NDJSON, CSV or Arrow IPC stream (needs
+    pyarrow).
+    """
+    try:
+        stmt, params = await run_parser(SeriesQuery(data.query).statement)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    if data.format == "arrow" and get_pyarrow() is None:
+        raise HTTPException(status_code=406, detail="pyarrow is not installed")
+
+    media_type, encode = FORMATS[data.format]
+    return StreamingResponse(
+        stream_rows(stmt, params, encode, Config().series_chunk_size),
+        media_type=media_type,
     )
-    return models.SensorMetricResult(data=results, meta=meta)
 
 
 @app.post(
@@ -57,21 +390,102 @@ async def get_query(
 )
 async def post_sensor_data(
     data: models.SensorInput,
-    session: SessionDep,
+    session: WriteSessionDep,
+    response: Response,
 ):
-    """POST sensor"""
-    result = await session.execute(select(Sensor).where(Sensor.name == data.sensor))
-    sensor = result.scalars().first()
+    """POST sensor
 
-    result = await session.execute(
-        select(SensorMetric).where(SensorMetric.name == data.metric)
-    )
-    metric = result.scalars().first()
+    With the write-behind buffer enabled the value is queued and the request
+    is answered with 202.
+    """
+    write_buffer = getattr(app.state, "write_buffer", None)
+    if write_buffer:
+        try:
+            with span("enqueue"):
+                await write_buffer.put(data)
+        except BufferFull as e:
+            raise HTTPException(status_code=503, detail=str(e)) from e
+        response.status_code = 202
+        return
+    with span("write"):
+        await write_values(session, [data])
 
-    if not sensor:
-        sensor = Sensor(name=data.sensor)
-    if not metric:
-        metric = SensorMetric(name=data.metric, unit=data.unit)
 
-    session.add(SensorValue(value=data.value, sensor=sensor, metric=metric))
-    await session.commit()
+@app.post(
+    "/sensor/batch",
+    response_model=models.SensorBatchResult,
+    status_code=200,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": SENSOR_INPUT_LIST.json_schema()},
+                "application/x-ndjson": {"schema": SENSOR_INPUT.json_schema()},
+            },
+        }
+    },
+)
+async def post_sensor_batch(
+    request: Request,
+    session: WriteSessionDep,
+):
+    """POST a list (JSON array or NDJSON) of sensor values"""
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            rows = [
+                SENSOR_INPUT.validate_json(line)
+                for line in body.splitlines()
+                if line.strip()
+            ]
+        else:
+            rows = SENSOR_INPUT_LIST.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors()) from e
+
+    count = await write_values(session, rows)
+    return models.SensorBatchResult(count=count)
+
+
+def subsystem_stats():
+    write_buffer = getattr(app.state, "write_buffer", None)
+    result_cache = getattr(app.state, "result_cache", None)
+    hot_tier = getattr(app.state, "hot_tier", None)
+    compactor = getattr(app.state, "compactor", None)
+    name_loader = getattr(app.state, "name_loader", None)
+    return {
+        "write_behind": write_buffer.stats() if write_buffer else None,
+        "parse_cache": PARSE_CACHE.stats(),
+        "date_cache": DATE_CACHE.stats(),
+        "statements": {**STMT_CACHE.stats(), "compiled": COMPILED_CACHE.stats()},
+        "vocabulary": {
+            "sensors": len(SENSOR_NAMES),
+            "metrics": len(METRIC_NAMES),
+            **(name_loader.stats() if name_loader else {}),
+        },
+        "result_cache": result_cache.stats() if result_cache else None,
+        "hot_tier": hot_tier.stats() if hot_tier else None,
+        "compaction": compactor.stats() if compactor else None,
+    }
+
+
+@app.get("/stats", status_code=200)
+async def get_stats():
+    """GET internal statistics"""
+    return {"pid": os.getpid(), **subsystem_stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, status_code=200)
+async def get_metrics():
+    """GET request / stage latency histograms, DB pool and cache statistics
+    in Prometheus text format, needs ABCDE_METRICS"""
+    metrics = getattr(app.state, "metrics", None)
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    engines = [("write", get_async_engine())]
+    if get_async_read_engine() is not engines[0][1]:
+        engines.append(("read", get_async_read_engine()))
+    return PlainTextResponse(
+        metrics.render(engines, subsystem_stats()),
+        media_type="text/plain; version=0.0.4",
+    )
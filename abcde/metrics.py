@@ -0,0 +1,326 @@
+"""Request timing instrumentation, Prometheus text format metrics
+
+The middleware times every request and collects the stages recorded with
+`span` while the request is handled. The stages and the request durations
+are kept in histograms of the Metrics registry (app.state.metrics), which
+is only created when ABCDE_METRICS is enabled; without it `span` and the
+middleware only check a context variable.
+"""
+
+import contextvars
+import logging
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_query_logger = logging.getLogger("abcde.slow_query")
+
+# stage -> seconds of the current request, None when metrics are disabled
+TIMINGS = contextvars.ContextVar("timings", default=None)
+
+# seconds, the stages of a request are well below a millisecond
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# stats fields which only grow, exported as counters
+COUNTERS = {
+    "hits",
+    "misses",
+    "invalidations",
+    "flushes",
+    "rows_flushed",
+    "retries",
+    "rows_dropped",
+    "errors",
+    "runs",
+    "rows_deleted",
+    "partitions_dropped",
+}
+
+
+# pylint: disable=invalid-name,too-few-public-methods
+class span:
+    """Add the time spent in the block to a stage of the current request."""
+
+    __slots__ = ("stage", "timings", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.timings = None
+        self.start = 0.0
+
+    def __enter__(self):
+        self.timings = TIMINGS.get()
+        if self.timings is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.timings is not None:
+            end = time.perf_counter()
+            self.timings[self.stage] = (
+                self.timings.get(self.stage, 0.0) + end - self.start
+            )
+            # the response is serialized after the last span of the endpoint
+            self.timings["_last"] = end
+
+
+async def execute(session, stmt, params=None):
+    """session.execute, its time is split into the compile and db stages.
+
+    db is the time spent in the driver (cursor execute, recorded by the
+    engine events), compile is the rest: statement compilation or compiled
+    cache lookup, parameter processing and the async adaption.
+    """
+    timings = TIMINGS.get()
+    if timings is None:
+        return await session.execute(stmt, params)
+    db = timings.get("db", 0.0)
+    start = time.perf_counter()
+    result = await session.execute(stmt, params)
+    elapsed = time.perf_counter() - start
+    timings["compile"] = (
+        timings.get("compile", 0.0) + elapsed - (timings.get("db", 0.0) - db)
+    )
+    return result
+
+
+def _before_cursor_execute(_conn, cursor, *_args):
+    timings = TIMINGS.get()
+    if timings is not None:
+        timings["_cursor", id(cursor)] = time.perf_counter()
+
+
+def _after_cursor_execute(_conn, cursor, *_args):
+    timings = TIMINGS.get()
+    if timings is not None:
+        start = timings.pop(("_cursor", id(cursor)), None)
+        if start is not None:
+            timings["db"] = timings.get("db", 0.0) + time.perf_counter() - start
+
+
+def listen_cursor_events():
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def remove_cursor_events():
+    event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class CompiledCacheStats:
+    """Hits and misses of SQLAlchemy's compiled cache by the executed
+    statements, counted by an engine event while listening."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def _after_cursor_execute(self, _conn, _cursor, _stmt, _params, context, *_):
+        if context is None:
+            return
+        if context.cache_hit == context.dialect.CACHE_HIT:
+            self.hits += 1
+        elif context.cache_hit == context.dialect.CACHE_MISS:
+            self.misses += 1
+
+    def listen(self):
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def remove(self):
+        event.remove(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+COMPILED_CACHE = CompiledCacheStats()
+
+
+def log_slow_query(threshold_ms, start, parser, statement, dialect):
+    """Log the query (a parsed Query) and its (statement, parameters) if it
+    ran longer than threshold_ms since start."""
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if not threshold_ms or elapsed_ms < threshold_ms:
+        return
+    stmt, params = statement
+    compiled = stmt.compile(dialect=dialect)
+    slow_query_logger.warning(
+        "Slow query (%.1f ms): %r parsed=%r sql=%s params=%r",
+        elapsed_ms,
+        parser.text,
+        parser.parsed,
+        compiled,
+        {**compiled.params, **params},
+    )
+
+
+class Histogram:
+    """Cumulative histogram of durations per label values."""
+
+    def __init__(self, name, help_, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [bucket counts..., +Inf count], sum
+        self.series = {}
+
+    def observe(self, label_values, seconds):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, seconds)] += 1
+        series[1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in sorted(self.series.items()):
+            labels = ",".join(
+                f'{name}="{value}"' for name, value in zip(self.labels, label_values)
+            )
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """Request and stage duration histograms of the app."""
+
+    def __init__(self):
+        self.requests = Histogram(
+            "abcde_request_duration_seconds",
+            "Duration of the HTTP requests.",
+            ("route", "method", "status"),
+        )
+        self.stages = Histogram(
+            "abcde_stage_duration_seconds",
+            "Duration of the stages of the HTTP requests.",
+            ("route", "stage"),
+        )
+
+    def observe(self, route, method, status, timings):
+        """Record a request, the seconds of its stages are in timings."""
+        self.requests.observe((route, method, str(status)), timings["_total"])
+        for stage, stage_seconds in timings.items():
+            if isinstance(stage, str) and not stage.startswith("_"):
+                self.stages.observe((route, stage), stage_seconds)
+
+    def render(self, engines=(), stats=None):
+        """Prometheus text format of the histograms, pools and stats.
+
+        `engines` are (name, AsyncEngine) pairs, `stats` maps a subsystem to
+        its stats dict (see GET /stats), None for disabled subsystems.
+        """
+        lines = [*self.requests.render(), *self.stages.render()]
+        lines.extend(render_pools(engines))
+        for subsystem, values in (stats or {}).items():
+            lines.extend(render_stats(subsystem, values))
+        return "\n".join(lines) + "\n"
+
+
+def render_pools(engines):
+    name = "abcde_db_pool_connections"
+    lines = [
+        f"# HELP {name} Connections of the database pools.",
+        f"# TYPE {name} gauge",
+    ]
+    for engine_name, engine in engines:
+        pool = engine.sync_engine.pool
+        for state, method in (
+            ("size", "size"),
+            ("checked_out", "checkedout"),
+            ("idle", "checkedin"),
+            ("overflow", "overflow"),
+        ):
+            # only the queue pools count their connections
+            if hasattr(pool, method):
+                lines.append(
+                    f'{name}{{engine="{engine_name}",state="{state}"}}'
+                    f" {getattr(pool, method)()}"
+                )
+    return lines
+
+
+def render_stats(subsystem, values):
+    lines = []
+    for key, value in (values or {}).items():
+        if isinstance(value, dict):
+            lines.extend(render_stats(f"{subsystem}_{key}", value))
+            continue
+        if not isinstance(value, (int, float)):
+            continue
+        name = f"abcde_{subsystem}_{key}"
+        kind = "gauge"
+        if key in COUNTERS:
+            name += "_total"
+            kind = "counter"
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {float(value)}")
+    return lines
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing the requests, when app.state.metrics is set."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        metrics = None
+        if scope["type"] == "http":
+            metrics = getattr(scope["app"].state, "metrics", None)
+        if metrics is None:
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = TIMINGS.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                last = timings.pop("_last", None)
+                if last is not None:
+                    timings["serialize"] = (
+                        timings.get("serialize", 0.0) + time.perf_counter() - last
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            TIMINGS.reset(token)
+            timings["_total"] = time.perf_counter() - start
+            route = scope.get("route")
+            metrics.observe(
+                route.path if route else "unmatched", scope["method"], status, timings
+            )
@@ -1,6 +1,8 @@
 """Request and response models."""
 
 from datetime import datetime
+from typing import Literal
+
 from pydantic import BaseModel, field_validator, Field
 
 
@@ -12,6 +14,13 @@ class QueryInput(BaseModel):
     )
 
 
+class SeriesInput(QueryInput):
+    """SeriesInput"""
+
+    query: str = Field(example="temperature sensor 1 in the last week")
+    format: Literal["ndjson", "csv", "arrow"] = "ndjson"
+
+
 class SensorMetric(BaseModel):
     """SensorMetric"""
 
@@ -28,6 +37,18 @@ class QueryMeta(BaseModel):
     metric: list[str]
     aggregation: str
     date: datetime | None
+    # seconds, only set for per time bucket queries
+    bucket: int | None = None
+
+
+class SensorMetricSeries(BaseModel):
+    """SensorMetricSeries"""
+
+    sensor: str = Field(example="sensor1")
+    metric: str = Field(example="temperature")
+    unit: str = Field(example="C")
+    timestamps: list[datetime]
+    values: list[float]
 
 
 class SensorInput(SensorMetric):
@@ -39,8 +60,21 @@ class SensorInput(SensorMetric):
         return v.replace(" ", "")
 
 
+class SensorBatchResult(BaseModel):
+    """SensorBatchResult"""
+
+    count: int = Field(example=1000)
+
+
 class SensorMetricResult(BaseModel):
     """SensorMetricResult"""
 
     data: list[SensorMetric]
     meta: QueryMeta
+
+
+class SensorMetricSeriesResult(BaseModel):
+    """SensorMetricSeriesResult"""
+
+    data: list[SensorMetricSeries]
+    meta: QueryMeta
@@ -1,16 +1,75 @@
 """Natural language query parsing"""
 
 from datetime import datetime
-from sqlalchemy import and_, select, func
-from dateutil.relativedelta import relativedelta
+from sqlalchemy import (
+    and_,
+    bindparam,
+    literal,
+    literal_column,
+    select,
+    func,
+    union_all,
+)
 
-from abcde.sql_models import Sensor, SensorMetric, SensorValue
-from abcde.language_parser import SimilarityTag, ReTag, CompoundTag, DateTag
+from abcde.sql_models import (
+    ROLLUP_RESOLUTIONS,
+    Sensor,
+    SensorLatest,
+    SensorMetric,
+    SensorRollup,
+    SensorValue,
+    bucket_ceil,
+    epoch_bucket,
+)
+from abcde.cache import LRUCache
+from abcde.retention import RETENTION
+from abcde.language_parser import (
+    SimilarityTag,
+    ReTag,
+    CompoundTag,
+    DateTag,
+    PipeTrie,
+    TagLattice,
+    Tagger,
+    VocabularyTag,
+)
+from abcde.vocabulary import Vocabulary
 
 
 def last_to_dt(n, type_):
+    # pylint: disable=import-outside-toplevel
+    from dateutil.relativedelta import relativedelta
+
     kwargs = {type_: n}
-    return datetime.now() - relativedelta(**kwargs)
+    try:
+        return datetime.now() - relativedelta(**kwargs)
+    except (ValueError, OverflowError) as e:
+        raise ValueError(f"Invalid date: last {n} {type_}") from e
+
+
+# the metrics of the demo data are known before they are written
+SENSOR_NAMES = Vocabulary()
+METRIC_NAMES = Vocabulary(["temperature", "humidity", "rain", "wind"])
+
+BUCKET_SECONDS = {"seconds": 1, "minutes": 60, "hours": 3600, "days": 86400}
+
+
+def bucket_seconds(n, type_):
+    if n <= 0:
+        raise ValueError(f"Invalid bucket size: {n} {type_}")
+    return n * BUCKET_SECONDS[type_]
+
+
+def bucket_units():
+    return CompoundTag(
+        None,
+        [
+            SimilarityTag("seconds", ["second", "seconds"]),
+            SimilarityTag("minutes", ["minute", "minutes"]),
+            SimilarityTag("hours", ["hour", "hours"]),
+            SimilarityTag("days", ["day", "days"]),
+        ],
+    )
 
 
 EXTRACT_PIPES = {
@@ -52,6 +111,23 @@ EXTRACT_PIPES = {
         ),
         ((SimilarityTag("since", ["since"]), DateTag("date")), lambda x, y: y[1]),
     ),
+    "bucket": (
+        (
+            (
+                SimilarityTag("per", ["per", "every"]),
+                ReTag("n", r"\d+"),
+                bucket_units(),
+            ),
+            lambda x, y, z: bucket_seconds(int(y[1]), z[0]),
+        ),
+        (
+            (SimilarityTag("per", ["per", "every"]), bucket_units()),
+            lambda x, y: bucket_seconds(1, y[0]),
+        ),
+        ((SimilarityTag("minutely", ["minutely"]),), lambda x: 60),
+        ((SimilarityTag("hourly", ["hourly"]),), lambda x: 3600),
+        ((SimilarityTag("daily", ["daily"]),), lambda x: 86400),
+    ),
     "sensor": (
         (
             (
@@ -68,6 +144,7 @@ EXTRACT_PIPES = {
             ),
             lambda x, y: "_all_",
         ),
+        ((VocabularyTag("sensor", SENSOR_NAMES),), lambda x: x[1]),
     ),
     "aggregation": (
         ((SimilarityTag("min", ["min"]),), lambda x: x[0]),
@@ -75,126 +152,303 @@ EXTRACT_PIPES = {
         ((SimilarityTag("sum", ["sum"]),), lambda x: x[0]),
         ((SimilarityTag("average", ["average"]),), lambda x: x[0]),
     ),
-    "metric": (
-        ((SimilarityTag("temperature", ["temperature"]),), lambda x: x[0]),
-        ((SimilarityTag("humidity", ["humidity"]),), lambda x: x[0]),
-        ((SimilarityTag("rain", ["rain"]),), lambda x: x[0]),
-        ((SimilarityTag("wind", ["wind"]),), lambda x: x[0]),
-    ),
+    "metric": (((VocabularyTag("metric", METRIC_NAMES),), lambda x: x[1]),),
 }
 
 
+PIPE_TRIES = {type_: PipeTrie(pipes) for type_, pipes in EXTRACT_PIPES.items()}
+TAGGER = Tagger(tag for trie in PIPE_TRIES.values() for tag in trie.tags)
+
+PARSE_CACHE = LRUCache(maxsize=1024)
+
+# statement shape (see Query.stmt_key) -> statement, the names and the date
+# window are bind parameters: the same statement object is executed again,
+# its cache key is computed once and SQLAlchemy's compiled cache is hit
+STMT_CACHE = LRUCache(maxsize=256)
+
+
+def add_names(sensors=(), metrics=()):
+    """Add sensor and metric names to the vocabularies, return the number
+    of new ones. A word may match a new name, the cached parse results and
+    word tags are dropped."""
+    added = SENSOR_NAMES.add(sensors) + METRIC_NAMES.add(metrics)
+    if added:
+        # the parse threads check the tagger generation before caching
+        TAGGER.clear()
+        PARSE_CACHE.clear()
+    return added
+
+
+class QueryLimits:
+    """Longest query text, most words parsed and most queries of a batch,
+    0 is unlimited."""
+
+    def __init__(self, length=0, tokens=0, batch=0):
+        self.length = length
+        self.tokens = tokens
+        self.batch = batch
+
+    def configure(self, length=0, tokens=0, batch=0):
+        self.length = length
+        self.tokens = tokens
+        self.batch = batch
+
+    def check(self, text):
+        if self.length and len(text) > self.length:
+            raise ValueError(f"The query is longer than {self.length} characters")
+        if self.tokens and len(text.split(None, self.tokens)) > self.tokens:
+            raise ValueError(f"The query has more than {self.tokens} words")
+
+    def check_batch(self, texts):
+        if self.batch and len(texts) > self.batch:
+            raise ValueError(f"The batch has more than {self.batch} queries")
+
+
+QUERY_LIMITS = QueryLimits()
+
+
+def normalize(text):
+    """Normalize the query text, queries with the same words parse the same."""
+    return " ".join(text.split())
+
+
+def window_params(since):
+    """Bind parameter values of the date window statement, the window starts
+    in the finest tier kept at since (see abcde.retention)."""
+    since = RETENTION.window_start(since)
+    params = {"since": since}
+    for resolution in ROLLUP_RESOLUTIONS:
+        params[f"since_{resolution}"] = bucket_ceil(since, resolution)
+    return params
+
+
+def name_ids(parsed):
+    """Sensor and metric id subqueries of the "sensors" / "metrics" bind
+    parameters.
+
+    The sensor ids are always listed (even for all sensors), this way the
+    (sensor_id, metric_id, ...) indexes can be searched.
+    """
+    sensor_ids = select(Sensor.id)
+    if "_all_" not in parsed["sensor"]:
+        sensor_ids = sensor_ids.where(
+            Sensor.name.in_(bindparam("sensors", expanding=True))
+        )
+    metric_ids = select(SensorMetric.id).where(
+        SensorMetric.name.in_(bindparam("metrics", expanding=True))
+    )
+    return sensor_ids, metric_ids
+
+
+def name_params(parsed):
+    """Values of the "sensors" / "metrics" bind parameters."""
+    params = {"metrics": parsed["metric"]}
+    if "_all_" not in parsed["sensor"]:
+        params["sensors"] = parsed["sensor"]
+    return params
+
+
+# pylint: disable=too-few-public-methods
+class ParsedQuery:
+    """Parse result of a normalized query text, shared through PARSE_CACHE.
+
+    Holds the matched pipes with their tags instead of the values, the values
+    are resolved on every use so relative dates ("last 7 days") always refer
+    to the current time.
+    """
+
+    def __init__(self, matches):
+        self.matches = matches
+
+
 class Query:
+    # types which have to be found in the text, besides date
+    required = ("sensor", "aggregation", "metric")
+
     def __init__(self, text):
         self.text = text
         self.parsed = None
+        self.entry = None
+
+    def _extract(self, words):
+        lattice = TagLattice(words, TAGGER)
+        matches = []
+        for index in range(len(words)):
+            for type_, trie in PIPE_TRIES.items():
+                if m := trie.first_match(lattice, index):
+                    matches.append((type_, *m))
+        return ParsedQuery(matches)
+
+    def cached(self):
+        """True if parsing the text is a parse cache lookup."""
+        return normalize(self.text) in PARSE_CACHE.data
 
     def parse(self):
-        def check_match(pipe, words, index):
-            tags = []
-            for i, p in enumerate(pipe):
-                idx = index + i
-                if idx >= len(words):
-                    return False, []
-                word = words[idx].strip(".,")
-                if m := p.matches(word):
-                    tags.append((p.tag_name(), m))
-                else:
-                    return False, []
-            return True, tags
+        QUERY_LIMITS.check(self.text)
+        key = normalize(self.text)
+        entry = PARSE_CACHE.get(key)
+        cached = entry is not None
+        if not cached:
+            generation = TAGGER.generation
+            entry = self._extract(key.split())
 
-        matches = {key: [] for key in EXTRACT_PIPES}
-        words = self.text.split()
-        index = 0
-        while index < len(words):
-            for type_, pipes in EXTRACT_PIPES.items():
-                for pipe in pipes:
-                    m, tags = check_match(pipe[0], words, index)
-                    if m:
-                        value = pipe[1](*tags)
-                        matches[type_].append(value)
-                        break
-            index += 1
-
-        missing = [k for k, v in matches.items() if v == [] and k != "date"]
+        # checked on hits too, the entry may be cached by a query with less
+        # required types
+        found = {type_ for type_, _, _ in entry.matches}
+        missing = [k for k in EXTRACT_PIPES if k not in found and k in self.required]
 
         if missing:
             raise ValueError(
                 f"Could not extract all information from the Query. Missing: {','.join(missing)}"
             )
+        if not cached:
+            PARSE_CACHE.put(key, entry)
+            # names were added while parsing
+            if generation != TAGGER.generation:
+                PARSE_CACHE.pop(key)
+
+        matches = {key: [] for key in EXTRACT_PIPES}
+        for type_, resolve, tags in entry.matches:
+            matches[type_].append(resolve(*tags))
+        if matches["bucket"] and not matches["date"]:
+            raise ValueError("A date is needed for a per time bucket query")
 
+        self.entry = entry
         self.parsed = matches
         return matches
 
     def _latest_stmt(self, parsed):
-        rank_col = (
-            func.row_number()
-            .over(
-                partition_by=[SensorValue.sensor_id, SensorValue.metric_id],
-                order_by=SensorValue.timestamp.desc(),
-            )
-            .label("rn")
-        )
-
-        # 3. Build the inner query with Joins and Filters
-        inner_stmt = (
+        stmt = (
             select(
                 Sensor.name.label("sensor"),
                 SensorMetric.name.label("metric"),
                 SensorMetric.unit.label("unit"),
-                SensorValue.value.label("value"),
-                rank_col,
+                SensorLatest.value.label("value"),
             )
-            .join(SensorValue, Sensor.id == SensorValue.sensor_id)
-            .join(SensorMetric, SensorMetric.id == SensorValue.metric_id)
+            .join(SensorLatest, Sensor.id == SensorLatest.sensor_id)
+            .join(SensorMetric, SensorMetric.id == SensorLatest.metric_id)
+            .order_by(SensorLatest.sensor_id, SensorLatest.metric_id)
         )
-        conditions = [SensorMetric.name.in_(parsed["metric"])]
+        conditions = [SensorMetric.name.in_(bindparam("metrics", expanding=True))]
         if "_all_" not in parsed["sensor"]:
-            conditions.append(Sensor.name.in_(parsed["sensor"]))
-        inner_stmt = inner_stmt.where(and_(*conditions))
+            conditions.append(Sensor.name.in_(bindparam("sensors", expanding=True)))
+        return stmt.where(and_(*conditions))
 
-        inner_stmt = inner_stmt.subquery()
+    def _window_stmt(self, parsed, resolutions):
+        """count / sum / min / max rows covering the window since the date.
 
-        # 4. Select only the latest (Rank 1) from the subquery
-        return select(inner_stmt).where(inner_stmt.c.rn == 1)
+        The whole minute / hour / day buckets of the window are read from
+        sensor_rollups, only the partial minute at the start of the window is
+        read from sensor_values:
 
-    def _date_stmt(self, parsed):
-        stmt = (
+            since -> ceil(minute) -> ceil(hour) -> ceil(day) -> ...
+            [raw]    [minutes]       [hours]       [days]
+
+        Only the given (finest first) rollup resolutions are used, without
+        any the whole window is read from sensor_values. `start` is the
+        timestamp of the value / the start of the rollup bucket.
+        """
+        sensor_ids, metric_ids = name_ids(parsed)
+
+        def conditions(sensor_id, metric_id):
+            return [sensor_id.in_(sensor_ids), metric_id.in_(metric_ids)]
+
+        raw_end = []
+        if resolutions:
+            raw_end.append(SensorValue.timestamp < bindparam(f"since_{resolutions[0]}"))
+
+        parts = [
             select(
-                Sensor.name.label("sensor"),
-                SensorMetric.name.label("metric"),
-                SensorMetric.unit.label("unit"),
+                SensorValue.sensor_id,
+                SensorValue.metric_id,
+                literal(1).label("count"),
+                SensorValue.value.label("sum"),
+                SensorValue.value.label("min"),
+                SensorValue.value.label("max"),
+                SensorValue.timestamp.label("start"),
+            ).where(
+                SensorValue.timestamp >= bindparam("since"),
+                *raw_end,
+                *conditions(SensorValue.sensor_id, SensorValue.metric_id),
             )
-            .join(SensorValue, Sensor.id == SensorValue.sensor_id)
-            .join(SensorMetric, SensorMetric.id == SensorValue.metric_id)
-            .group_by(Sensor.name, SensorMetric.name)
-        )
-
-        conditions = [
-            SensorValue.timestamp >= parsed["date"][0],
-            SensorMetric.name.in_(parsed["metric"]),
         ]
 
-        if "_all_" not in parsed["sensor"]:
-            conditions.append(Sensor.name.in_(parsed["sensor"]))
+        for resolution, coarser in zip(resolutions, resolutions[1:] + [None]):
+            window = [
+                SensorRollup.resolution == resolution,
+                SensorRollup.bucket_start >= bindparam(f"since_{resolution}"),
+            ]
+            if coarser:
+                window.append(SensorRollup.bucket_start < bindparam(f"since_{coarser}"))
+            parts.append(
+                select(
+                    SensorRollup.sensor_id,
+                    SensorRollup.metric_id,
+                    SensorRollup.count,
+                    SensorRollup.sum,
+                    SensorRollup.min,
+                    SensorRollup.max,
+                    SensorRollup.bucket_start.label("start"),
+                ).where(
+                    *window,
+                    *conditions(SensorRollup.sensor_id, SensorRollup.metric_id),
+                )
+            )
+
+        return union_all(*parts).subquery()
 
-        stmt = stmt.where(and_(*conditions))
+    def _date_stmt(self, parsed):
+        """Aggregate over the window, per time bucket of a bucketed query.
+
+        Buckets are aligned to the unix epoch, so the rollups of the
+        resolutions dividing the bucket size lie in a single bucket each.
+        """
+        resolutions = list(ROLLUP_RESOLUTIONS)
+        if parsed["bucket"]:
+            seconds = parsed["bucket"][0]
+            resolutions = [
+                resolution
+                for resolution, width in ROLLUP_RESOLUTIONS.items()
+                if seconds % width.total_seconds() == 0
+            ]
+        window = self._window_stmt(parsed, resolutions)
+
+        columns = [
+            Sensor.name.label("sensor"),
+            SensorMetric.name.label("metric"),
+            SensorMetric.unit.label("unit"),
+        ]
+        # unit is grouped too, PostgreSQL only allows selecting columns which
+        # depend on the grouped primary keys
+        groups = [Sensor.name, SensorMetric.name, SensorMetric.unit]
+        if parsed["bucket"]:
+            start = epoch_bucket(window.c.start, literal_column(str(seconds)))
+            columns.append(start.label("timestamp"))
+            groups.append(start)
+        stmt = (
+            select(*columns)
+            .select_from(window)
+            .join(Sensor, Sensor.id == window.c.sensor_id)
+            .join(SensorMetric, SensorMetric.id == window.c.metric_id)
+            .group_by(*groups)
+            .order_by(*groups)
+        )
 
         if parsed["aggregation"][0] == "min":
             stmt = stmt.add_columns(
-                func.min(SensorValue.value).label("value"),
+                func.min(window.c.min).label("value"),
             )
         elif parsed["aggregation"][0] == "max":
             stmt = stmt.add_columns(
-                func.max(SensorValue.value).label("value"),
+                func.max(window.c.max).label("value"),
             )
         elif parsed["aggregation"][0] == "sum":
             stmt = stmt.add_columns(
-                func.sum(SensorValue.value).label("value"),
+                func.sum(window.c.sum).label("value"),
             )
         elif parsed["aggregation"][0] == "average":
             stmt = stmt.add_columns(
-                func.avg(SensorValue.value).label("value"),
+                (func.sum(window.c.sum) / func.sum(window.c.count)).label("value"),
             )
         else:
             raise ValueError(
@@ -203,8 +457,174 @@ class Query:
 
         return stmt
 
-    def get_stmt(self):
-        parsed = self.parse()
+    def build_stmt(self, parsed):
+        """Statement answering the parse results of its shape, the names and
+        the date window are bind parameters (see stmt_params)."""
         if parsed["date"]:
             return self._date_stmt(parsed)
         return self._latest_stmt(parsed)
+
+    @staticmethod
+    def stmt_key(parsed):
+        """Shape of the statement, the parse results with the same key are
+        answered by the same statement."""
+        all_sensors = "_all_" in parsed["sensor"]
+        if not parsed["date"]:
+            return ("latest", all_sensors)
+        return ("date", parsed["aggregation"][0], tuple(parsed["bucket"]), all_sensors)
+
+    @staticmethod
+    def stmt_params(parsed):
+        params = name_params(parsed)
+        if parsed["date"]:
+            params.update(window_params(parsed["date"][0]))
+        return params
+
+    def bind(self, parsed):
+        """(statement, parameters) answering the parse result, the statement
+        is shared through STMT_CACHE."""
+        key = self.stmt_key(parsed)
+        stmt = STMT_CACHE.get(key)
+        if stmt is None:
+            stmt = self.build_stmt(parsed)
+            STMT_CACHE.put(key, stmt)
+        return stmt, self.stmt_params(parsed)
+
+    def window_key(self):
+        """None for latest queries, else the aggregation, bucket and date match.
+
+        Queries with the same window key read the same window, the date is
+        compared by its tags as relative dates resolve to a new time on every
+        parse.
+        """
+        for type_, resolve, tags in self.entry.matches:
+            if type_ == "date":
+                return (
+                    self.parsed["aggregation"][0],
+                    tuple(self.parsed["bucket"]),
+                    resolve,
+                    tuple(tags),
+                )
+        return None
+
+    def select_rows(self, rows):
+        """The rows of a coalesced result which belong to this query."""
+        sensors = set(self.parsed["sensor"])
+        metrics = set(self.parsed["metric"])
+        return [
+            row
+            for row in rows
+            if row["metric"] in metrics
+            and ("_all_" in sensors or row["sensor"] in sensors)
+        ]
+
+    def statement(self):
+        """(statement, parameters) of the query, the text is parsed unless it
+        already was."""
+        parsed = self.parsed if self.parsed is not None else self.parse()
+        return self.bind(parsed)
+
+    def get_stmt(self):
+        """Statement of the query with the parameters bound.
+
+        Binding copies the statement, the endpoints execute the shared
+        statement with the parameters of `statement()` instead.
+        """
+        stmt, params = self.statement()
+        return stmt.params(params)
+
+
+class SeriesQuery(Query):
+    """Raw values of the sensors and metrics of a query.
+
+    The aggregation is not needed, the values are ordered by sensor, metric
+    and timestamp along the (sensor_id, metric_id, timestamp) index.
+    """
+
+    required = ("sensor", "metric")
+
+    def build_stmt(self, parsed):
+        sensor_ids, metric_ids = name_ids(parsed)
+        conditions = [
+            SensorValue.sensor_id.in_(sensor_ids),
+            SensorValue.metric_id.in_(metric_ids),
+        ]
+        if parsed["date"]:
+            conditions.append(SensorValue.timestamp >= bindparam("since"))
+
+        return (
+            select(
+                Sensor.name.label("sensor"),
+                SensorMetric.name.label("metric"),
+                SensorMetric.unit.label("unit"),
+                SensorValue.timestamp.label("timestamp"),
+                SensorValue.value.label("value"),
+            )
+            .join(Sensor, Sensor.id == SensorValue.sensor_id)
+            .join(SensorMetric, SensorMetric.id == SensorValue.metric_id)
+            .where(*conditions)
+            .order_by(
+                SensorValue.sensor_id, SensorValue.metric_id, SensorValue.timestamp
+            )
+        )
+
+    @staticmethod
+    def stmt_key(parsed):
+        return ("series", "_all_" in parsed["sensor"], bool(parsed["date"]))
+
+    @staticmethod
+    def stmt_params(parsed):
+        params = name_params(parsed)
+        if parsed["date"]:
+            params["since"] = parsed["date"][0]
+        return params
+
+    def statement(self):
+        return self.bind(self.parse())
+
+
+class QueryBatch:
+    """Coalesce several queries into as few statements as possible.
+
+    Latest queries, and queries with the same aggregation over the same date
+    window, are answered by one statement selecting the union of their
+    sensors and metrics. Every query picks its own rows from the result.
+    """
+
+    def __init__(self, texts):
+        QUERY_LIMITS.check_batch(texts)
+        self.queries = [Query(text) for text in texts]
+
+    def parse(self):
+        for index, query in enumerate(self.queries):
+            try:
+                query.parse()
+            except ValueError as e:
+                raise ValueError(f"Query {index}: {e}") from e
+
+    def get_stmts(self, indexes=None):
+        """[(statement, parameters, query indexes)] answering the given (or
+        all) queries."""
+        if indexes is None:
+            indexes = range(len(self.queries))
+        groups = {}
+        for index in indexes:
+            groups.setdefault(self.queries[index].window_key(), []).append(index)
+
+        stmts = []
+        for group in groups.values():
+            first = self.queries[group[0]]
+            sensors = set()
+            metrics = set()
+            for index in group:
+                sensors.update(self.queries[index].parsed["sensor"])
+                metrics.update(self.queries[index].parsed["metric"])
+            parsed = {
+                "sensor": ["_all_"] if "_all_" in sensors else sorted(sensors),
+                "metric": sorted(metrics),
+                "aggregation": first.parsed["aggregation"],
+                "bucket": first.parsed["bucket"],
+                "date": first.parsed["date"],
+            }
+            stmts.append((*first.bind(parsed), group))
+        return stmts
@@ -0,0 +1,51 @@
+"""Query responses serialized without per row models
+
+The result rows of the statements already have the shape of the response
+models (sensor, metric, unit, value). The responses are built from them as
+plain dicts and lists, and encoded by pydantic-core in one pass. The models
+of abcde.models stay the response_model of the routes, they describe the
+responses in the OpenAPI schema.
+"""
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded by pydantic-core (datetimes as ISO 8601)."""
+
+    def render(self, content):
+        return to_json(content)
+
+
+def query_payload(parser, rows):
+    """SensorMetricResult (or SensorMetricSeriesResult) of a parsed query.
+
+    The rows are used as they are. The rows of a per time bucket query are
+    returned as one timestamps and values array per (sensor, metric).
+    """
+    parsed = parser.parsed
+    meta = {
+        "sensor": parsed["sensor"],
+        "metric": parsed["metric"],
+        "aggregation": parsed["aggregation"][0],
+        "date": parsed["date"][0] if parsed["date"] else None,
+    }
+    if not parsed["bucket"]:
+        return {"data": rows, "meta": meta}
+
+    meta["bucket"] = parsed["bucket"][0]
+    series = {}
+    for row in rows:
+        key = (row["sensor"], row["metric"])
+        if key not in series:
+            series[key] = {
+                "sensor": row["sensor"],
+                "metric": row["metric"],
+                "unit": row["unit"],
+                "timestamps": [],
+                "values": [],
+            }
+        series[key]["timestamps"].append(row["timestamp"])
+        series[key]["values"].append(row["value"])
+    return {"data": list(series.values()), "meta": meta}
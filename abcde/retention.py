@@ -0,0 +1,198 @@
+"""Retention of the raw values and the rollups
+
+Every tier (the raw sensor_values and the minute / hour / day rollups) is
+kept for a number of seconds, 0 keeps it forever. The rollups are written
+with the values (see abcde.ingest), so expiring a tier only deletes rows:
+the Compactor deletes the expired rows of every (sensor, metric) in
+transactions of about `batch_size` rows, the write lock is released
+between two of them. Date windows starting before the retention of the raw
+values are read from the finest rollups still kept, see `window_start`.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+from abcde.sql_models import (
+    ROLLUP_RESOLUTIONS,
+    SensorLatest,
+    SensorRollup,
+    SensorValue,
+    bucket_floor,
+)
+from abcde.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+TIERS = ("raw", *ROLLUP_RESOLUTIONS)
+
+
+class RetentionPolicy:
+    """Seconds the tiers are kept, a tier has to be kept at least as long as
+    the finer ones."""
+
+    def __init__(self, **seconds):
+        self.seconds = {}
+        self.configure(**seconds)
+
+    def configure(self, **seconds):
+        seconds = {tier: seconds.get(tier, 0) for tier in TIERS}
+        kept = [value or math.inf for value in seconds.values()]
+        if kept != sorted(kept):
+            raise ValueError(
+                f"A tier is kept shorter than a finer one: {', '.join(TIERS)}"
+            )
+        self.seconds = seconds
+
+    def cutoff(self, tier, now=None):
+        """The rows of the tier older than the cutoff are expired, None if the
+        tier is kept forever."""
+        if not self.seconds[tier]:
+            return None
+        return (now or datetime.now()) - timedelta(seconds=self.seconds[tier])
+
+    def window_start(self, since, now=None):
+        """Start of a date window read from the finest tier covering since.
+
+        The rollup buckets are whole, the window of an expired tier starts at
+        the bucket containing since.
+        """
+        for tier in TIERS:
+            cutoff = self.cutoff(tier, now)
+            if cutoff is None or since >= cutoff:
+                return since if tier == "raw" else bucket_floor(since, tier)
+        return since
+
+
+RETENTION = RetentionPolicy()
+
+
+# pylint: disable=too-many-instance-attributes
+class Compactor:
+    """Background task deleting the expired rows every `interval` seconds.
+
+    `get_session` returns a new AsyncSession of the write engine.
+    `on_deleted` is awaited with the session after a run deleted rows, the
+    cached results may have changed.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, policy, get_session, *, interval, batch_size, on_deleted=None):
+        self.policy = policy
+        self.get_session = get_session
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_deleted = on_deleted
+        self.task = None
+
+        self.runs = 0
+        self.rows_deleted = 0
+        self.partitions_dropped = 0
+        self.errors = 0
+        self.last_run_ms = 0.0
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.compact()
+            except Exception:  # pylint: disable=broad-exception-caught
+                self.errors += 1
+                logger.exception("Failed to delete the expired sensor values")
+            await asyncio.sleep(self.interval)
+
+    async def compact(self, now=None):
+        """Delete the rows expired at `now`, return the number of rows."""
+        now = now or datetime.now()
+        start = time.perf_counter()
+        deleted = 0
+        async with self.get_session() as session:
+            pairs = (
+                await session.execute(
+                    select(SensorLatest.sensor_id, SensorLatest.metric_id)
+                )
+            ).all()
+            cutoff = self.policy.cutoff("raw", now)
+            if cutoff:
+                connection = await session.connection()
+                storage = get_storage(session.bind.dialect.name)
+                self.partitions_dropped += await connection.run_sync(
+                    storage.drop_partitions, cutoff
+                )
+                await session.commit()
+                for sensor_id, metric_id in pairs:
+                    deleted += await self._delete(
+                        session,
+                        SensorValue.timestamp,
+                        cutoff,
+                        SensorValue.sensor_id == sensor_id,
+                        SensorValue.metric_id == metric_id,
+                    )
+
+            for resolution in ROLLUP_RESOLUTIONS:
+                cutoff = self.policy.cutoff(resolution, now)
+                if cutoff is None:
+                    continue
+                # the bucket containing the cutoff is kept whole
+                cutoff = bucket_floor(cutoff, resolution)
+                for sensor_id, metric_id in pairs:
+                    deleted += await self._delete(
+                        session,
+                        SensorRollup.bucket_start,
+                        cutoff,
+                        SensorRollup.resolution == resolution,
+                        SensorRollup.sensor_id == sensor_id,
+                        SensorRollup.metric_id == metric_id,
+                    )
+
+            if deleted and self.on_deleted:
+                await self.on_deleted(session)
+
+        self.runs += 1
+        self.rows_deleted += deleted
+        self.last_run_ms = (time.perf_counter() - start) * 1000
+        return deleted
+
+    async def _delete(self, session, column, cutoff, *conditions):
+        """Delete the rows before cutoff along the index of the (sensor,
+        metric), a transaction per `batch_size` rows."""
+        deleted = 0
+        model = column.class_
+        while True:
+            # the timestamp after the batch, rows sharing it are deleted too
+            end = await session.scalar(
+                select(column)
+                .where(*conditions, column < cutoff)
+                .order_by(column)
+                .offset(self.batch_size)
+                .limit(1)
+            )
+            stmt = delete(model).where(
+                *conditions, column <= end if end is not None else column < cutoff
+            )
+            deleted += (await session.execute(stmt)).rowcount
+            await session.commit()
+            if end is None:
+                return deleted
+            # let the writes waiting for the lock in
+            await asyncio.sleep(0)
+
+    def stats(self):
+        return {
+            "retention": self.policy.seconds,
+            "runs": self.runs,
+            "rows_deleted": self.rows_deleted,
+            "partitions_dropped": self.partitions_dropped,
+            "errors": self.errors,
+            "last_run_ms": self.last_run_ms,
+        }
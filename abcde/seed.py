@@ -0,0 +1,82 @@
+"""Sync engine and demo data
+
+Used by the tests, the benchmarks and the seeding command, not by the app:
+
+    python -m abcde.seed
+"""
+
+import functools
+import os
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, create_engine
+
+from abcde.config import Config
+from abcde.sql_models import Sensor, SensorMetric, SensorValue
+from abcde.storage import get_storage, get_url_storage
+
+
+@functools.lru_cache()
+def get_engine():
+    """Return the config loaded from envvars."""
+    config = Config()
+
+    storage = get_url_storage(config.db_url)
+    engine = create_engine(config.db_url, connect_args=storage.connect_args())
+    storage.configure(engine, config)
+
+    return engine
+
+
+def _reset_engine():
+    """Forget the engine inherited by a forked process, see
+    abcde.utils._reset_engines."""
+    # pylint: disable=too-many-function-args
+    if get_engine.cache_info().currsize:
+        get_engine().dispose(close=False)
+    get_engine.cache_clear()
+
+
+os.register_at_fork(after_in_child=_reset_engine)
+
+
+def add_data():
+    engine = get_engine()
+    with engine.begin() as conn:
+        get_storage(engine.dialect.name).create_schema(conn)
+    with Session(engine) as session:
+        dt_now = datetime.now()
+        dt1week = dt_now - timedelta(weeks=1)
+        dt2week = dt1week - timedelta(weeks=1)
+
+        sensor1 = Sensor(name="sensor1")
+        sensor2 = Sensor(name="sensor2")
+
+        metric1 = SensorMetric(name="humidity", unit="%")
+        metric2 = SensorMetric(name="temperature", unit="C")
+
+        values = [
+            # sensor1 - metric1
+            SensorValue(value=1, timestamp=dt_now, sensor=sensor1, metric=metric1),
+            SensorValue(value=2, timestamp=dt1week, sensor=sensor1, metric=metric1),
+            SensorValue(value=3, timestamp=dt2week, sensor=sensor1, metric=metric1),
+            # sensor2 - metric1
+            SensorValue(value=4, timestamp=dt_now, sensor=sensor2, metric=metric1),
+            SensorValue(value=5, timestamp=dt1week, sensor=sensor2, metric=metric1),
+            SensorValue(value=6, timestamp=dt2week, sensor=sensor2, metric=metric1),
+            # sensor1 - metric2
+            SensorValue(value=7, timestamp=dt_now, sensor=sensor1, metric=metric2),
+            SensorValue(value=8, timestamp=dt1week, sensor=sensor1, metric=metric2),
+            SensorValue(value=9, timestamp=dt2week, sensor=sensor1, metric=metric2),
+            # sensor2 - metric2
+            SensorValue(value=10, timestamp=dt_now, sensor=sensor2, metric=metric2),
+            SensorValue(value=11, timestamp=dt1week, sensor=sensor2, metric=metric2),
+            SensorValue(value=12, timestamp=dt2week, sensor=sensor2, metric=metric2),
+        ]
+
+        session.add_all(values)
+        session.commit()
+
+
+if __name__ == "__main__":
+    add_data()
@@ -1,7 +1,13 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import case
+from sqlalchemy import event
 from sqlalchemy import ForeignKey
 from sqlalchemy import String
 from sqlalchemy import Float
+from sqlalchemy import Index
+from sqlalchemy import DateTime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
@@ -35,6 +41,17 @@ class SensorMetric(Base):
 # pylint: disable=too-few-public-methods
 class SensorValue(Base):
     __tablename__ = "sensor_values"
+    # covers the latest / date range queries, see Query._latest_stmt and
+    # Query._date_stmt
+    __table_args__ = (
+        Index(
+            "ix_sensor_values_sensor_metric_timestamp",
+            "sensor_id",
+            "metric_id",
+            "timestamp",
+            "value",
+        ),
+    )
 
     # pylint: disable=unsubscriptable-object
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
@@ -46,3 +63,211 @@ class SensorValue(Base):
 
     sensor: Mapped["Sensor"] = relationship()
     metric: Mapped["SensorMetric"] = relationship()
+
+
+# pylint: disable=too-few-public-methods
+class SensorLatest(Base):
+    """Latest value per (sensor, metric), maintained on every insert."""
+
+    __tablename__ = "sensor_latest"
+
+    # pylint: disable=unsubscriptable-object
+    sensor_id: Mapped[int] = mapped_column(ForeignKey("sensors.id"), primary_key=True)
+    metric_id: Mapped[int] = mapped_column(
+        ForeignKey("sensor_metrics.id"), primary_key=True
+    )
+    timestamp: Mapped[datetime]
+    value: Mapped[float] = mapped_column(Float)
+
+
+ROLLUP_RESOLUTIONS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+
+def bucket_floor(timestamp, resolution):
+    """Return the start of the rollup bucket containing timestamp."""
+    if resolution == "minute":
+        return timestamp.replace(second=0, microsecond=0)
+    if resolution == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if resolution == "day":
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown rollup resolution: {resolution}")
+
+
+def bucket_ceil(timestamp, resolution):
+    """Return the first rollup bucket start which is >= timestamp."""
+    start = bucket_floor(timestamp, resolution)
+    if start == timestamp:
+        return start
+    return start + ROLLUP_RESOLUTIONS[resolution]
+
+
+# pylint: disable=invalid-name,too-many-ancestors,abstract-method
+class epoch_bucket(FunctionElement):
+    """epoch_bucket(timestamp, seconds): start of the `seconds` wide bucket.
+
+    Buckets are aligned to the unix epoch, a bucket of a multiple of a rollup
+    resolution covers whole rollup buckets.
+    """
+
+    type = DateTime()
+    name = "epoch_bucket"
+    inherit_cache = True
+
+
+@compiles(epoch_bucket)
+def _sqlite_epoch_bucket(element, compiler, **kw):
+    timestamp, seconds = (compiler.process(arg, **kw) for arg in element.clauses)
+    # strftime('%s') rounds the fractional seconds, they are cut off first
+    return (
+        f"datetime((CAST(strftime('%s', substr({timestamp}, 1, 19)) AS INTEGER)"
+        f" / {seconds}) * {seconds}, 'unixepoch')"
+    )
+
+
+@compiles(epoch_bucket, "postgresql")
+def _postgresql_epoch_bucket(element, compiler, **kw):
+    timestamp, seconds = (compiler.process(arg, **kw) for arg in element.clauses)
+    return (
+        f"(to_timestamp(floor(extract(epoch from {timestamp}) / {seconds})"
+        f" * {seconds}) AT TIME ZONE 'UTC')"
+    )
+
+
+# pylint: disable=too-few-public-methods
+class SensorRollup(Base):
+    """count / sum / min / max of the values of a time bucket.
+
+    Maintained on every insert for each resolution of ROLLUP_RESOLUTIONS.
+    """
+
+    __tablename__ = "sensor_rollups"
+
+    # pylint: disable=unsubscriptable-object
+    resolution: Mapped[str] = mapped_column(String(10), primary_key=True)
+    sensor_id: Mapped[int] = mapped_column(ForeignKey("sensors.id"), primary_key=True)
+    metric_id: Mapped[int] = mapped_column(
+        ForeignKey("sensor_metrics.id"), primary_key=True
+    )
+    bucket_start: Mapped[datetime] = mapped_column(primary_key=True)
+    count: Mapped[int]
+    sum: Mapped[float] = mapped_column(Float)
+    min: Mapped[float] = mapped_column(Float)
+    max: Mapped[float] = mapped_column(Float)
+
+
+# pylint: disable=too-few-public-methods
+class CacheGeneration(Base):
+    """Counter of the writes, shared by the workers, see abcde.cache."""
+
+    __tablename__ = "cache_generation"
+
+    # pylint: disable=unsubscriptable-object
+    id: Mapped[int] = mapped_column(primary_key=True)
+    generation: Mapped[int]
+
+
+def dialect_insert(dialect, model):
+    """Return an INSERT supporting ON CONFLICT for the dialect."""
+    # the dialect packages are loaded with the engine, only the one in use
+    # pylint: disable=import-outside-toplevel
+    if dialect.name == "sqlite":
+        from sqlalchemy.dialects import sqlite
+
+        return sqlite.insert(model)
+    if dialect.name == "postgresql":
+        from sqlalchemy.dialects import postgresql
+
+        return postgresql.insert(model)
+    raise ValueError(f"Unsupported database dialect: {dialect.name}")
+
+
+def latest_upsert(dialect):
+    """Return the upsert keeping the newest value in sensor_latest."""
+    stmt = dialect_insert(dialect, SensorLatest)
+    return stmt.on_conflict_do_update(
+        index_elements=["sensor_id", "metric_id"],
+        set_={"timestamp": stmt.excluded.timestamp, "value": stmt.excluded.value},
+        where=stmt.excluded.timestamp >= SensorLatest.timestamp,
+    )
+
+
+def rollup_upsert(dialect):
+    """Return the upsert merging bucket aggregates into sensor_rollups."""
+    stmt = dialect_insert(dialect, SensorRollup)
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=["resolution", "sensor_id", "metric_id", "bucket_start"],
+        set_={
+            "count": SensorRollup.count + excluded["count"],
+            "sum": SensorRollup.sum + excluded.sum,
+            "min": case(
+                (excluded.min < SensorRollup.min, excluded.min),
+                else_=SensorRollup.min,
+            ),
+            "max": case(
+                (excluded.max > SensorRollup.max, excluded.max),
+                else_=SensorRollup.max,
+            ),
+        },
+    )
+
+
+def latest_rows(values):
+    """Return the newest of the sensor_values rows per (sensor, metric)."""
+    latest = {}
+    for value in values:
+        key = (value["sensor_id"], value["metric_id"])
+        if key not in latest or value["timestamp"] >= latest[key]["timestamp"]:
+            latest[key] = value
+    return list(latest.values())
+
+
+def rollup_rows(values):
+    """Aggregate sensor_values rows into sensor_rollups rows."""
+    buckets = {}
+    for value in values:
+        for resolution in ROLLUP_RESOLUTIONS:
+            key = (
+                resolution,
+                value["sensor_id"],
+                value["metric_id"],
+                bucket_floor(value["timestamp"], resolution),
+            )
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = {
+                    "resolution": key[0],
+                    "sensor_id": key[1],
+                    "metric_id": key[2],
+                    "bucket_start": key[3],
+                    "count": 1,
+                    "sum": value["value"],
+                    "min": value["value"],
+                    "max": value["value"],
+                }
+            else:
+                bucket["count"] += 1
+                bucket["sum"] += value["value"]
+                bucket["min"] = min(bucket["min"], value["value"])
+                bucket["max"] = max(bucket["max"], value["value"])
+    return list(buckets.values())
+
+
+@event.listens_for(SensorValue, "after_insert")
+def _update_derived(_mapper, connection, target):
+    """Keep sensor_latest and sensor_rollups up to date for ORM inserts."""
+    values = [
+        {
+            "sensor_id": target.sensor_id,
+            "metric_id": target.metric_id,
+            "timestamp": target.timestamp,
+            "value": target.value,
+        }
+    ]
+    connection.execute(latest_upsert(connection.dialect), latest_rows(values))
+    connection.execute(rollup_upsert(connection.dialect), rollup_rows(values))
@@ -0,0 +1,277 @@
+"""Storage backends
+
+The statements of abcde.query_parser and abcde.ingest are dialect neutral,
+the backends hold what differs per database: the drivers, the schema and
+the preparation of inserts.
+"""
+
+import os
+import weakref
+from datetime import datetime
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import make_url
+
+from abcde.sql_models import Base, SensorValue
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+
+
+def run_migrations(connection, command_name, revision="head"):
+    """Run an alembic command (upgrade, stamp) on the connection, in its
+    transaction."""
+    # imported when a schema is created, it is not needed for the queries
+    # pylint: disable=import-outside-toplevel
+    from alembic import command
+    from alembic.config import Config as AlembicConfig
+
+    config = AlembicConfig()
+    config.set_main_option("script_location", MIGRATIONS)
+    config.attributes["connection"] = connection
+    getattr(command, command_name)(config, revision)
+
+
+class Storage:
+    """Base backend, the schema of a new database is created from the models,
+    an existing one is upgraded by the migrations."""
+
+    name = None
+    async_driver = None
+    # sensor_values partitions have to exist before values are inserted
+    partitioned = False
+
+    def connect_args(self):
+        return {}
+
+    def engine_kwargs(self, config, readonly=False):
+        """create_async_engine keyword arguments of the write / read engine."""
+        # pylint: disable=unused-argument
+        return {"connect_args": self.connect_args()}
+
+    def split_reads(self, config):
+        """Whether the queries get a read-only engine of their own."""
+        # pylint: disable=unused-argument
+        return False
+
+    def configure(self, engine, config, readonly=False):
+        """Set up a new (sync) engine, e.g. with connect hooks."""
+
+    def async_url(self, url):
+        """The url of the async engine."""
+        return make_url(url).set(drivername=f"{self.name}+{self.async_driver}")
+
+    def lock_schema(self, connection):
+        """Serialize the schema creation of concurrently starting workers."""
+
+    def create_tables(self, connection):
+        Base.metadata.create_all(bind=connection)
+
+    def create_schema(self, connection):
+        """Create the schema of a new database and mark it with the latest
+        migration, or upgrade the schema of an existing one. A database
+        without an alembic version was created before the migrations and has
+        the initial schema."""
+        self.lock_schema(connection)
+        tables = inspect(connection).get_table_names()
+        if SensorValue.__tablename__ not in tables:
+            self.create_tables(connection)
+            run_migrations(connection, "stamp")
+            return
+        if "alembic_version" not in tables:
+            run_migrations(connection, "stamp", "0001")
+        run_migrations(connection, "upgrade")
+
+    def prepare_insert(self, connection, timestamps):
+        """Called before sensor_values rows with the timestamps are inserted."""
+
+    def drop_partitions(self, connection, cutoff):
+        """Drop the sensor_values partitions ending before the cutoff, return
+        their number."""
+        # pylint: disable=unused-argument
+        return 0
+
+
+class SQLiteStorage(Storage):
+    """Single file database, the default."""
+
+    name = "sqlite"
+    async_driver = "aiosqlite"
+
+    def connect_args(self):
+        return {"check_same_thread": False}
+
+    def engine_kwargs(self, config, readonly=False):
+        kwargs = super().engine_kwargs(config, readonly)
+        if config.sqlite_tuned:
+            # SQLite has a single writer, more write connections would only
+            # wait for the lock of each other
+            pool_size = config.sqlite_read_pool_size if readonly else 1
+            kwargs.update(pool_size=pool_size, max_overflow=0)
+        return kwargs
+
+    def lock_schema(self, connection):
+        # pysqlite does not begin a transaction before DDL, the immediate one
+        # holds the write lock until the commit, other workers wait for it
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def split_reads(self, config):
+        # in WAL mode readers do not block the writer and vice versa
+        return config.sqlite_tuned
+
+    @staticmethod
+    def pragmas(config, readonly=False):
+        pragmas = [
+            f"PRAGMA busy_timeout = {config.sqlite_busy_timeout_ms}",
+            "PRAGMA synchronous = NORMAL",
+            f"PRAGMA mmap_size = {config.sqlite_mmap_size}",
+            f"PRAGMA cache_size = -{config.sqlite_cache_kib}",
+        ]
+        if readonly:
+            pragmas.append("PRAGMA query_only = ON")
+        else:
+            # persistent, set by the writer which creates the schema, after
+            # the busy timeout as it waits for the other workers
+            pragmas.insert(1, "PRAGMA journal_mode = WAL")
+        return pragmas
+
+    def configure(self, engine, config, readonly=False):
+        if not config.sqlite_tuned:
+            return
+        pragmas = self.pragmas(config, readonly)
+
+        @event.listens_for(engine, "connect")
+        def _set_pragmas(dbapi_connection, _connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+
+def month_start(timestamp):
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(start):
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+class PostgresStorage(Storage):
+    """PostgreSQL, sensor_values is range partitioned by month on timestamp.
+
+    Partitions are created on demand before values are inserted, queries
+    with a timestamp range (the date window, /series) are pruned to the
+    partitions of the range. Needs the asyncpg driver.
+    """
+
+    name = "postgresql"
+    async_driver = "asyncpg"
+    partitioned = True
+
+    # the primary key of a partitioned table has to contain the partition key
+    SENSOR_VALUES_DDL = (
+        """
+        CREATE TABLE IF NOT EXISTS sensor_values (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            value FLOAT NOT NULL,
+            sensor_id INTEGER NOT NULL REFERENCES sensors (id),
+            metric_id INTEGER NOT NULL REFERENCES sensor_metrics (id),
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS ix_sensor_values_sensor_metric_timestamp
+        ON sensor_values (sensor_id, metric_id, timestamp, value)
+        """,
+    )
+
+    def __init__(self):
+        # engine -> month starts with an existing partition
+        self.partitions = weakref.WeakKeyDictionary()
+
+    # pg_advisory_xact_lock key of the schema creation
+    SCHEMA_LOCK = 0xABCDE
+
+    def lock_schema(self, connection):
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": self.SCHEMA_LOCK}
+        )
+
+    def create_tables(self, connection):
+        tables = [
+            table
+            for table in Base.metadata.sorted_tables
+            if table is not SensorValue.__table__
+        ]
+        Base.metadata.create_all(bind=connection, tables=tables)
+        for statement in self.SENSOR_VALUES_DDL:
+            connection.execute(text(statement))
+
+    @staticmethod
+    def partition_ddl(start):
+        end = next_month(start)
+        return (
+            f"CREATE TABLE IF NOT EXISTS sensor_values_{start:%Y%m} "
+            f"PARTITION OF sensor_values "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+
+    def prepare_insert(self, connection, timestamps):
+        created = self.partitions.setdefault(connection.engine, set())
+        missing = {month_start(timestamp) for timestamp in timestamps} - created
+        if not missing:
+            return
+        # created in the transaction of the insert (a partition takes locks
+        # on the referenced sensors / sensor_metrics the transaction may
+        # have written), the cache is dropped if it is rolled back
+        for start in sorted(missing):
+            connection.execute(text(self.partition_ddl(start)))
+        created.update(missing)
+        event.listen(connection, "rollback", lambda _: created.clear(), once=True)
+
+    def drop_partitions(self, connection, cutoff):
+        # a dropped partition is not deleted row by row, it takes a short
+        # exclusive lock on sensor_values
+        names = connection.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'sensor_values'::regclass"
+            )
+        ).scalars()
+        expired = []
+        for name in names:
+            start = datetime.strptime(name.rsplit("_", 1)[1], "%Y%m")
+            if next_month(start) <= cutoff:
+                expired.append(start)
+        for start in sorted(expired):
+            connection.execute(text(f"DROP TABLE IF EXISTS sensor_values_{start:%Y%m}"))
+        self.partitions.get(connection.engine, set()).difference_update(expired)
+        return len(expired)
+
+
+STORAGES = {storage.name: storage for storage in (SQLiteStorage(), PostgresStorage())}
+
+
+def get_storage(name):
+    """Return the backend of a dialect name."""
+    if name not in STORAGES:
+        raise ValueError(f"Unsupported database dialect: {name}")
+    return STORAGES[name]
+
+
+def get_url_storage(url):
+    """Return the backend of a database url."""
+    return get_storage(make_url(url).get_backend_name())
+
+
+@event.listens_for(SensorValue, "before_insert")
+def _prepare_insert(_mapper, connection, target):
+    """Prepare the backend for ORM inserts, see abcde.ingest for batches."""
+    storage = get_storage(connection.dialect.name)
+    if storage.partitioned:
+        if target.timestamp is None:
+            target.timestamp = datetime.now()
+        storage.prepare_insert(connection, [target.timestamp])
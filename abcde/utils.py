@@ -1,87 +1,97 @@
+"""Async engines and sessions of the app
+
+The sync engine and the demo data are in abcde.seed, they are not imported
+by the app.
+"""
+
 from typing import Annotated
-from datetime import datetime, timedelta
 import functools
+import os
 
 from fastapi import Depends
-from sqlmodel import Session, create_engine
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 
 from abcde.config import Config
-from abcde.sql_models import Sensor, SensorMetric, SensorValue, Base
+from abcde.storage import get_storage, get_url_storage
 
 
-@functools.lru_cache()
-def get_engine():
-    """Return the config loaded from envvars."""
+def _create_async_engine(readonly):
     config = Config()
-
-    connect_args = {"check_same_thread": False}
-    engine = create_engine(config.db_url, connect_args=connect_args)
-
+    storage = get_url_storage(config.db_url)
+    engine = create_async_engine(
+        storage.async_url(config.db_url), **storage.engine_kwargs(config, readonly)
+    )
+    storage.configure(engine.sync_engine, config, readonly)
     return engine
 
 
 @functools.lru_cache()
 def get_async_engine():
-    config = Config()
-    connect_args = {"check_same_thread": False}
-    url = config.db_url
-    url = url.replace("sqlite:", "sqlite+aiosqlite:")
-    engine = create_async_engine(url, connect_args=connect_args)
-    return engine
+    """The engine of the writes, and of the reads unless they are split."""
+    return _create_async_engine(readonly=False)
+
+
+@functools.lru_cache()
+def _get_async_read_engine(write_engine):
+    storage = get_storage(write_engine.dialect.name)
+    if not storage.split_reads(Config()):
+        return write_engine
+    return _create_async_engine(readonly=True)
+
+
+def get_async_read_engine():
+    """The engine of the queries, belongs to the current write engine."""
+    return _get_async_read_engine(get_async_engine())
+
+
+async def dispose_engines():
+    """Close the pooled connections of the async engines of this process."""
+    write_engine = get_async_engine()
+    read_engine = get_async_read_engine()
+    if read_engine is not write_engine:
+        await read_engine.dispose()
+    await write_engine.dispose()
+
+
+def _reset_engines():
+    """Forget the engines inherited by a forked worker process.
+
+    The pooled connections belong to the parent, they are dropped without
+    being closed and the worker creates engines of its own.
+    """
+    # pylint: disable=too-many-function-args
+    engines = []
+    if get_async_engine.cache_info().currsize:
+        write_engine = get_async_engine()
+        engines.append(write_engine.sync_engine)
+        if _get_async_read_engine.cache_info().currsize:
+            engines.append(_get_async_read_engine(write_engine).sync_engine)
+    for engine in engines:
+        engine.dispose(close=False)
+    get_async_engine.cache_clear()
+    _get_async_read_engine.cache_clear()
+
+
+os.register_at_fork(after_in_child=_reset_engines)
 
 
 async def create_db_and_tables():
     engine = get_async_engine()
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(get_storage(engine.dialect.name).create_schema)
 
 
 async def get_session():
-    engine = get_async_engine()
+    engine = get_async_read_engine()
     async with AsyncSession(engine) as session:
         yield session
 
 
-SessionDep = Annotated[AsyncSession, Depends(get_session)]
+async def get_write_session():
+    engine = get_async_engine()
+    async with AsyncSession(engine) as session:
+        yield session
 
 
-def add_data():
-    engine = get_engine()
-    Base.metadata.create_all(bind=engine)
-    with Session(engine) as session:
-        dt_now = datetime.now()
-        dt1week = dt_now - timedelta(weeks=1)
-        dt2week = dt1week - timedelta(weeks=1)
-
-        sensor1 = Sensor(name="sensor1")
-        sensor2 = Sensor(name="sensor2")
-
-        metric1 = SensorMetric(name="humidity", unit="%")
-        metric2 = SensorMetric(name="temperature", unit="C")
-
-        values = [
-            # sensor1 - metric1
-            SensorValue(value=1, timestamp=dt_now, sensor=sensor1, metric=metric1),
-            SensorValue(value=2, timestamp=dt1week, sensor=sensor1, metric=metric1),
-            SensorValue(value=3, timestamp=dt2week, sensor=sensor1, metric=metric1),
-            # sensor2 - metric1
-            SensorValue(value=4, timestamp=dt_now, sensor=sensor2, metric=metric1),
-            SensorValue(value=5, timestamp=dt1week, sensor=sensor2, metric=metric1),
-            SensorValue(value=6, timestamp=dt2week, sensor=sensor2, metric=metric1),
-            # sensor1 - metric2
-            SensorValue(value=7, timestamp=dt_now, sensor=sensor1, metric=metric2),
-            SensorValue(value=8, timestamp=dt1week, sensor=sensor1, metric=metric2),
-            SensorValue(value=9, timestamp=dt2week, sensor=sensor1, metric=metric2),
-            # sensor2 - metric2
-            SensorValue(value=10, timestamp=dt_now, sensor=sensor2, metric=metric2),
-            SensorValue(value=11, timestamp=dt1week, sensor=sensor2, metric=metric2),
-            SensorValue(value=12, timestamp=dt2week, sensor=sensor2, metric=metric2),
-        ]
-
-        session.add_all(values)
-        session.commit()
-
-
-if __name__ == "__main__":
-    add_data()
+SessionDep = Annotated[AsyncSession, Depends(get_session)]
+WriteSessionDep = Annotated[AsyncSession, Depends(get_write_session)]
@@ -0,0 +1,196 @@
+"""Sensor and metric names known to the query parser
+
+A word is looked up exactly (case insensitive) first, then fuzzy matched
+like a SimilarityTag (cosine similarity of the character counts) against
+the names with the same numbers: the numbers in a name identify it, they
+are never corrected. Only the names which share all but at most
+MAX_MISSED of their character trigrams with the word, and the word with
+them, are scored: one typo (a letter inserted, deleted, replaced or two
+neighbours swapped) changes up to four. They are found in the posting
+lists of the rarest trigrams of the word instead of scanning every name.
+
+The names are loaded from the sensors and sensor_metrics tables at startup
+and added when a write creates new ones (see abcde.query_parser.add_names).
+"""
+
+import re
+import time
+from collections import Counter
+
+from sqlalchemy import func, select
+
+from abcde.language_parser import cosine_sim
+from abcde.sql_models import Sensor, SensorMetric
+
+NUMBERS = re.compile(r"\d+")
+
+MAX_MISSED = 4
+
+# groups up to this size are scanned, bigger ones get posting lists
+SCAN_SIZE = 32
+
+
+def trigrams(word):
+    """Character trigrams of the word padded with two leading and one
+    trailing space."""
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Names with their character trigram posting lists, split by the
+    number of trigrams of the name."""
+
+    def __init__(self):
+        self.names = []
+        self.sizes = []
+        self.postings = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        # the lookups of the parse threads read the index while it is added
+        # to: the size comes first and the posting lists are built aside
+        self.sizes.append(len(trigrams(name.lower())))
+        self.names.append(name)
+        if self.postings is not None:
+            self._index(self.postings, len(self.names) - 1)
+        elif len(self.names) > SCAN_SIZE:
+            postings = {}
+            for index in range(len(self.names)):
+                self._index(postings, index)
+            self.postings = postings
+
+    def _index(self, postings, index):
+        postings = postings.setdefault(self.sizes[index], {})
+        for gram in trigrams(self.names[index].lower()):
+            postings.setdefault(gram, []).append(index)
+
+    def candidates(self, word):
+        """Names missing at most MAX_MISSED trigrams of the word and having
+        at most MAX_MISSED the word misses, in the order they were added."""
+        grams = trigrams(word.lower())
+        size = len(grams)
+        if self.postings is None:
+            indexes = range(len(self.names))
+        else:
+            # the posting lists are split by the number of trigrams of the
+            # names; a name sharing all but MAX_MISSED trigrams of the word is
+            # in at least two of the MAX_MISSED + 2 shortest lists of its
+            # split (in one if the word has less trigrams)
+            needed = min(2, max(1, size - MAX_MISSED))
+            found = Counter()
+            for name_size in range(size - MAX_MISSED, size + MAX_MISSED + 1):
+                postings = self.postings.get(name_size)
+                if postings is None:
+                    continue
+                lists = sorted((postings.get(gram, ()) for gram in grams), key=len)
+                for indexes in lists[: MAX_MISSED + 2]:
+                    found.update(indexes)
+            indexes = sorted(index for index, n in found.items() if n >= needed)
+        names = []
+        for index in indexes:
+            if abs(self.sizes[index] - size) > MAX_MISSED:
+                continue
+            name = self.names[index]
+            shared = len(grams & trigrams(name.lower()))
+            if shared and shared >= max(size, self.sizes[index]) - MAX_MISSED:
+                names.append(name)
+        return names
+
+
+class Vocabulary:
+    """Names of one kind, see the module docstring for the lookup."""
+
+    def __init__(self, names=(), similarity=0.9):
+        self.similarity = similarity
+        self.exact = {}
+        self.groups = {}
+        self.add(names)
+
+    def __len__(self):
+        return len(self.exact)
+
+    def add(self, names):
+        """Add the names, return the number of new ones."""
+        added = 0
+        for name in names:
+            key = name.lower()
+            if key in self.exact:
+                continue
+            self.exact[key] = name
+            numbers = " ".join(NUMBERS.findall(key))
+            group = self.groups.get(numbers)
+            if group is None:
+                group = self.groups[numbers] = TrigramIndex()
+            group.add(name)
+            added += 1
+        return added
+
+    def lookup(self, word):
+        """Return the name of the word or None."""
+        key = word.lower()
+        name = self.exact.get(key)
+        if name is not None:
+            return name
+        group = self.groups.get(" ".join(NUMBERS.findall(key)))
+        if group is None:
+            return None
+        best, best_sim = None, self.similarity
+        for candidate in group.candidates(key):
+            sim = cosine_sim(key, candidate)
+            if sim > best_sim or (best is None and sim >= best_sim):
+                best, best_sim = candidate, sim
+        return best
+
+
+class NameLoader:
+    """Reads the sensor and metric names of the database.
+
+    `on_names(sensors, metrics)` is called with the names. `sync` reads the
+    names again when the tables grew, names are never renamed or deleted;
+    the row counts are read at most every `sync_ms` milliseconds, never if
+    it is None.
+    """
+
+    def __init__(self, on_names, sync_ms=0):
+        self.on_names = on_names
+        self.sync_s = None if sync_ms is None else sync_ms / 1000
+        self.counts = None
+        self.synced = None
+        self.syncs = 0
+        self.loads = 0
+
+    async def _counts(self, session):
+        # pylint: disable=not-callable
+        return (
+            await session.scalar(select(func.count()).select_from(Sensor)),
+            await session.scalar(select(func.count()).select_from(SensorMetric)),
+        )
+
+    async def load(self, session):
+        """Read all names, return the number of names new to `on_names`."""
+        counts = await self._counts(session)
+        sensors = (await session.scalars(select(Sensor.name))).all()
+        metrics = (await session.scalars(select(SensorMetric.name))).all()
+        self.counts = counts
+        self.loads += 1
+        return self.on_names(sensors, metrics)
+
+    async def sync(self, session):
+        """Read the names if the tables grew since the last read, unless the
+        counts were read in the last `sync_ms`."""
+        if self.sync_s is None:
+            return 0
+        now = time.monotonic()
+        if self.synced is not None and now - self.synced < self.sync_s:
+            return 0
+        self.synced = now
+        self.syncs += 1
+        if await self._counts(session) == self.counts:
+            return 0
+        return await self.load(session)
+
+    def stats(self):
+        return {"syncs": self.syncs, "loads": self.loads}
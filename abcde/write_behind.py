@@ -0,0 +1,157 @@
+"""Write-behind buffer for sensor values"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    """The buffer did not accept the row in time."""
+
+
+# pylint: disable=too-many-instance-attributes
+class WriteBehindBuffer:
+    """Collect sensor values in memory and write them in batches.
+
+    A background task flushes the queued rows when `batch_size` rows are
+    collected or `flush_ms` milliseconds passed since the first queued row.
+    `put` blocks while the queue is full (backpressure) and raises BufferFull
+    after `put_timeout_ms`. A failed flush (a transaction which was rolled
+    back) is retried up to `retries` times, after `retry_ms` milliseconds
+    doubled on every attempt; the rows are dropped when the last attempt
+    fails. `stop` writes every accepted row before returning.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        flush,
+        *,
+        batch_size,
+        flush_ms,
+        queue_size,
+        put_timeout_ms,
+        retries=3,
+        retry_ms=100,
+    ):
+        self.flush = flush
+        self.batch_size = batch_size
+        self.flush_s = flush_ms / 1000
+        self.put_timeout_s = put_timeout_ms / 1000
+        self.retries = retries
+        self.retry_s = retry_ms / 1000
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+        self.closed = False
+        self.wakeup = asyncio.Event()
+
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.retried = 0
+        self.errors = 0
+        self.rows_dropped = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.closed = True
+        self.wakeup.set()
+        await self.queue.join()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def put(self, row):
+        if self.closed:
+            raise BufferFull("Write-behind buffer is shutting down")
+        try:
+            await asyncio.wait_for(
+                self.queue.put((row, datetime.now())), self.put_timeout_s
+            )
+        except TimeoutError as e:
+            raise BufferFull("Write-behind buffer is full") from e
+        self.wakeup.set()
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_s
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if self.closed or timeout <= 0:
+                break
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch):
+        """Flush the batch, retried after a failure. Return whether it was
+        written."""
+        rows = [row for row, _ in batch]
+        timestamps = [timestamp for _, timestamp in batch]
+        for attempt in range(self.retries + 1):
+            try:
+                await self.flush(rows, timestamps)
+                return True
+            except Exception:  # pylint: disable=broad-exception-caught
+                if attempt == self.retries:
+                    logger.exception("Failed to write %d sensor values", len(batch))
+                    return False
+                logger.warning(
+                    "Failed to write %d sensor values, retrying",
+                    len(batch),
+                    exc_info=True,
+                )
+                self.retried += 1
+                await asyncio.sleep(self.retry_s * 2**attempt)
+        return False
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            start = time.perf_counter()
+            try:
+                if await self._write(batch):
+                    self.rows_flushed += len(batch)
+                else:
+                    self.errors += 1
+                    self.rows_dropped += len(batch)
+            finally:
+                elapsed = (time.perf_counter() - start) * 1000
+                self.flushes += 1
+                self.last_flush_ms = elapsed
+                self.max_flush_ms = max(self.max_flush_ms, elapsed)
+                self.total_flush_ms += elapsed
+                for _ in batch:
+                    self.queue.task_done()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "retries": self.retried,
+            "errors": self.errors,
+            "rows_dropped": self.rows_dropped,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+        }
@@ -0,0 +1 @@
+"""abcde benchmarks"""
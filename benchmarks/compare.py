@@ -0,0 +1,65 @@
+"""Compare two JSON results of a benchmark (--json of benchmarks.load / micro).
+
+Prints the change of every metric of the cases in both runs and exits with
+1 if a latency / time grew, or a throughput dropped, by more than the
+tolerance.
+
+Usage:
+    python -m benchmarks.compare baseline.json current.json --tolerance 0.1
+"""
+
+import argparse
+import json
+import sys
+
+# metrics where a larger value is better, the others are times
+HIGHER_IS_BETTER = {"throughput"}
+# not compared
+COUNTS = {"requests"}
+
+
+def compare(baseline, current, tolerance):
+    """Return (case, metric, baseline, current, change, regressed) rows."""
+    rows = []
+    for case, metrics in current["results"].items():
+        base_metrics = baseline["results"].get(case)
+        if base_metrics is None:
+            continue
+        for metric, value in metrics.items():
+            base = base_metrics.get(metric)
+            if metric in COUNTS or not base or value is None:
+                continue
+            change = value / base - 1
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            rows.append((case, metric, base, value, change, worse > tolerance))
+    return rows
+
+
+def load(path):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("baseline")
+    arg_parser.add_argument("current")
+    arg_parser.add_argument("--tolerance", type=float, default=0.1)
+    args = arg_parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    if baseline["benchmark"] != current["benchmark"]:
+        sys.exit(
+            f"Different benchmarks: {baseline['benchmark']}, {current['benchmark']}"
+        )
+
+    rows = compare(baseline, current, args.tolerance)
+    for case, metric, base, value, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{case:20} {metric:12} {base:12.2f} {value:12.2f} {change:+8.1%} {flag}")
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
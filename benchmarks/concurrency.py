@@ -0,0 +1,108 @@
+"""Mixed load benchmark: /query latency while /sensor writes are running.
+
+Runs the same load against the default SQLite setup and the tuned one
+(ABCDE_SQLITE_TUNED: WAL, PRAGMAs, single writer + read-only pool).
+
+Usage:
+    python -m benchmarks.concurrency --seconds 10 --readers 8 --writers 4 --batch-size 500
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.ingest import make_rows
+from benchmarks.report import percentile
+
+QUERIES = (
+    "min temperature sensor1",
+    "average temperature, humidity all sensors last 2 hours",
+    "max rain sensor2 sensor3 last 10 minutes",
+    "sum humidity sensor4 hourly last day",
+)
+
+
+async def reader(client, deadline, latencies, index):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        resp = await client.get(
+            "/query", params={"query": QUERIES[index % len(QUERIES)]}
+        )
+        resp.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        index += 1
+
+
+async def writer(client, deadline, rows, batch_size):
+    written = 0
+    while time.perf_counter() < deadline:
+        if batch_size == 1:
+            resp = await client.post("/sensor", json=rows[written % len(rows)])
+        else:
+            resp = await client.post("/sensor/batch", json=rows[:batch_size])
+        resp.raise_for_status()
+        written += batch_size
+    return written
+
+
+async def run(seconds, readers, writers, batch_size):
+    # pylint: disable=import-outside-toplevel
+    from abcde.main import app
+    from abcde.seed import get_engine
+    from abcde.utils import get_async_engine
+
+    get_engine.cache_clear()
+    get_async_engine.cache_clear()
+    rows = make_rows(max(1000, batch_size))
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=60
+        ) as client:
+            for _ in range(20):
+                resp = await client.post("/sensor/batch", json=rows)
+                resp.raise_for_status()
+
+            latencies = []
+            deadline = time.perf_counter() + seconds
+            results = await asyncio.gather(
+                *(reader(client, deadline, latencies, i) for i in range(readers)),
+                *(writer(client, deadline, rows, batch_size) for _ in range(writers)),
+            )
+    written = sum(result for result in results if result is not None)
+    return latencies, written / seconds
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--seconds", type=float, default=10)
+    arg_parser.add_argument("--readers", type=int, default=8)
+    arg_parser.add_argument("--writers", type=int, default=4)
+    # rows per write request, 1 posts to /sensor, more to /sensor/batch
+    arg_parser.add_argument("--batch-size", type=int, default=1)
+    args = arg_parser.parse_args()
+
+    print(
+        f"{'mode':8} {'reads/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        f" {'rows/s':>9}"
+    )
+    for mode, tuned in (("default", "false"), ("tuned", "true")):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ["ABCDE_DB_URL"] = f"sqlite:///{tmp}/bench.db"
+            os.environ["ABCDE_SQLITE_TUNED"] = tuned
+            latencies, writes = asyncio.run(
+                run(args.seconds, args.readers, args.writers, args.batch_size)
+            )
+        print(
+            f"{mode:8} {len(latencies) / args.seconds:9.0f}"
+            f" {percentile(latencies, 50):8.1f} {percentile(latencies, 95):8.1f}"
+            f" {percentile(latencies, 99):8.1f} {writes:9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Synthetic sensor data: N sensors x M metrics x T readings.
+
+The readings are `interval` seconds apart and end now, they are written with
+the batch ingestion of abcde.ingest (executemany INSERT, rollup upserts) to
+the database of ABCDE_DB_URL.
+
+Usage:
+    python -m benchmarks.data --sensors 10 --metrics 4 --readings 1000 --interval 900
+"""
+
+import argparse
+import asyncio
+import datetime
+import math
+import random
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from abcde.ingest import insert_values
+from abcde.models import SensorInput
+from abcde.utils import create_db_and_tables, get_async_engine
+
+# the metrics of the query language first, the others can not be queried
+METRICS = (("temperature", "C"), ("humidity", "%"), ("rain", "mm"), ("wind", "m/s"))
+
+
+def metric_names(metrics):
+    return [
+        METRICS[i] if i < len(METRICS) else (f"metric{i + 1}", "x")
+        for i in range(metrics)
+    ]
+
+
+def readings(sensors, metrics, count, interval, seed=0):
+    """Yield (SensorInput, timestamp) in timestamp order, `sensorN` from 1."""
+    rnd = random.Random(seed)
+    end = datetime.datetime.now()
+    names = metric_names(metrics)
+    for step in range(count):
+        timestamp = end - datetime.timedelta(seconds=interval * (count - 1 - step))
+        for sensor in range(1, sensors + 1):
+            # a daily cycle with noise, per sensor and metric
+            cycle = 5 * math.sin(2 * math.pi * timestamp.hour / 24 + sensor)
+            for index, (metric, unit) in enumerate(names):
+                row = SensorInput.model_construct(
+                    sensor=f"sensor{sensor}",
+                    metric=metric,
+                    unit=unit,
+                    value=10 * (index + 1) + cycle + rnd.gauss(0, 1),
+                )
+                yield row, timestamp
+
+
+async def generate(sensors, metrics, count, interval=900, batch_size=10000):
+    """Write the readings in batches, return the number of rows."""
+    await create_db_and_tables()
+    written = 0
+    batch = []
+    async with AsyncSession(get_async_engine()) as session:
+        for reading in readings(sensors, metrics, count, interval):
+            batch.append(reading)
+            if len(batch) == batch_size:
+                written += await insert_batch(session, batch)
+                batch = []
+        written += await insert_batch(session, batch)
+    return written
+
+
+async def insert_batch(session, batch):
+    rows = [row for row, _ in batch]
+    timestamps = [timestamp for _, timestamp in batch]
+    return await insert_values(session, rows, timestamps)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--sensors", type=int, default=10)
+    arg_parser.add_argument("--metrics", type=int, default=4)
+    arg_parser.add_argument("--readings", type=int, default=1000)
+    # seconds between two readings of a sensor
+    arg_parser.add_argument("--interval", type=float, default=900)
+    arg_parser.add_argument("--batch-size", type=int, default=10000)
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    written = asyncio.run(
+        generate(
+            args.sensors, args.metrics, args.readings, args.interval, args.batch_size
+        )
+    )
+    seconds = time.perf_counter() - start
+    print(f"{written} rows in {seconds:.1f}s, {written / seconds:.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Date recognition: dateutil.parser.parse vs the precompiled formats.
+
+Every date word is parsed with dateutil, with the precompiled expressions
+(`fast_date`) and through the date cache (`parse_date`), then date-heavy
+queries are parsed with the parse cache disabled, the "since" date read by
+dateutil and by `parse_date`.
+
+Usage:
+    python -m benchmarks.dates --repeat 20
+"""
+
+import argparse
+import timeit
+from unittest import mock
+
+from dateutil import parser
+
+from abcde.language_parser import DATE_CACHE, fast_date, parse_date
+from abcde.query_parser import PARSE_CACHE, Query
+
+DATES = (
+    "2012.01.01",
+    "2024-01-02",
+    "2024/1/2",
+    "2024-01-02T10:20:30.5",
+    "13/01/2024",
+    "20240102",
+)
+
+QUERIES = (
+    "max rain sensor2 sensor3 since 2012.01.01",
+    "average temperature, humidity all sensors since 2024-01-02T10:20:30",
+    "sum rain sensor1 per 2 hours since 13/01/2024",
+)
+
+
+def best_us(fn, args):
+    return min(timeit.repeat(fn, number=args.number, repeat=args.repeat)) / (
+        args.number / 1e6
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    arg_parser.add_argument("--number", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    print(f"{'date':<25} {'dateutil us':>11} {'fast us':>8} {'cached us':>9}")
+    for word in DATES:
+        assert fast_date(word) == parse_date(word) == parser.parse(word)
+        dateutil, fast, cached = (
+            best_us(fn, args)
+            for fn in (
+                lambda: parser.parse(word),
+                lambda: fast_date(word),
+                lambda: parse_date(word),
+            )
+        )
+        print(f"{word:<25} {dateutil:11.1f} {fast:8.2f} {cached:9.2f}")
+
+    PARSE_CACHE.resize(0)
+    print()
+    print(f"{'query':<70} {'dateutil us':>11} {'new us':>8} {'speedup':>8}")
+    for query in QUERIES:
+        with mock.patch("abcde.language_parser.parse_date", parser.parse):
+            expected = Query(query).parse()
+            dateutil = best_us(lambda: Query(query).parse(), args)
+        DATE_CACHE.clear()
+        assert Query(query).parse() == expected
+        new = best_us(lambda: Query(query).parse(), args)
+        print(f"{query:<70} {dateutil:11.1f} {new:8.1f} {dateutil / new:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""/query latency with and without the in-memory hot tier.
+
+A temporary database is seeded with benchmarks.data, every query is sent
+`--repeat` times through the app with ABCDE_HOT_TIER disabled and enabled.
+
+Usage:
+    python -m benchmarks.hot_tier --sensors 20 --metrics 4 --readings 2000 --repeat 50
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from abcde.main import app
+from abcde.seed import get_engine
+from abcde.utils import get_async_engine
+from benchmarks.data import generate
+from benchmarks.report import percentile
+
+QUERIES = (
+    "max temperature sensor1",
+    "average temperature, humidity all sensors",
+    "average temperature sensor1 last 12 hours",
+    "max temperature, humidity sensor1 sensor2 last 3 days",
+    "sum rain all sensors last week",
+)
+
+
+def clear_engines():
+    get_engine.cache_clear()
+    get_async_engine.cache_clear()
+
+
+def latencies(client, query, repeat):
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resp = client.get("/query", params={"query": query})
+        results.append(time.perf_counter() - start)
+        assert resp.status_code == 200, resp.text
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--sensors", type=int, default=20)
+    arg_parser.add_argument("--metrics", type=int, default=4)
+    arg_parser.add_argument("--readings", type=int, default=2000)
+    arg_parser.add_argument("--interval", type=float, default=300)
+    arg_parser.add_argument("--repeat", type=int, default=50)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {"ABCDE_DB_URL": f"sqlite:///{tmp}/bench.db"}
+        with mock.patch.dict(os.environ, env):
+            clear_engines()
+            asyncio.run(
+                generate(args.sensors, args.metrics, args.readings, args.interval)
+            )
+            clear_engines()
+            results = {}
+            for hot_tier in ("false", "true"):
+                with mock.patch.dict(os.environ, {"ABCDE_HOT_TIER": hot_tier}):
+                    with TestClient(app) as client:
+                        for query in QUERIES:
+                            results[query, hot_tier] = percentile(
+                                latencies(client, query, args.repeat), 50
+                            )
+            clear_engines()
+
+    print(f"{'query':<55} {'sql p50 ms':>10} {'hot p50 ms':>10} {'speedup':>8}")
+    for query in QUERIES:
+        sql, hot = results[query, "false"], results[query, "true"]
+        print(f"{query:<55} {sql:10.3f} {hot:10.3f} {sql / hot:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
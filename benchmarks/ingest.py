@@ -0,0 +1,75 @@
+"""Ingest benchmark: single row POST /sensor vs POST /sensor/batch.
+
+Usage:
+    python -m benchmarks.ingest --rows 2000 --batch-size 500
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+
+def make_rows(n, sensors=10):
+    metrics = (("temperature", "C"), ("humidity", "%"), ("rain", "mm"))
+    return [
+        {
+            "sensor": f"sensor{i % sensors}",
+            "metric": metrics[i % len(metrics)][0],
+            "unit": metrics[i % len(metrics)][1],
+            "value": float(i),
+        }
+        for i in range(n)
+    ]
+
+
+async def bench_single(client, rows):
+    start = time.perf_counter()
+    for row in rows:
+        resp = await client.post("/sensor", json=row)
+        resp.raise_for_status()
+    return len(rows) / (time.perf_counter() - start)
+
+
+async def bench_batch(client, rows, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        resp = await client.post("/sensor/batch", json=rows[i : i + batch_size])
+        resp.raise_for_status()
+    return len(rows) / (time.perf_counter() - start)
+
+
+async def run(rows, batch_size):
+    # pylint: disable=import-outside-toplevel
+    from abcde.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            single = await bench_single(client, rows)
+            batch = await bench_batch(client, rows, batch_size)
+    return single, batch
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--rows", type=int, default=2000)
+    arg_parser.add_argument("--batch-size", type=int, default=500)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["ABCDE_DB_URL"] = f"sqlite:///{tmp}/bench.db"
+        single, batch = asyncio.run(run(make_rows(args.rows), args.batch_size))
+
+    print(f"POST /sensor        {single:12.0f} rows/s")
+    print(f"POST /sensor/batch  {batch:12.0f} rows/s  (batch size {args.batch_size})")
+    print(f"speedup             {batch / single:12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""In-process load driver: latency and throughput per request shape.
+
+Seeds a temporary database with benchmarks.data and runs every shape (the
+query shapes of tests/test_api.py, /series and the writes) through the ASGI
+app for `--seconds`, with `--concurrency` concurrent clients. The app is
+configured from the ABCDE_ environment variables, except ABCDE_DB_URL.
+
+Usage:
+    python -m benchmarks.load --seconds 5 --concurrency 8 --json load.json
+    python -m benchmarks.load --shapes latest,window --readings 5000
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.data import generate
+from benchmarks.ingest import make_rows
+from benchmarks.report import latency_summary, write_json
+
+QUERIES = (
+    "min temperature sensor1",
+    "min temperature, humidity sensor1 sensor2",
+    "average temperature sensor3 last week",
+    "max temperature sensor1 since 2012.01.01",
+    "average temperature all sensors since 2012.01.01",
+    "average temperature, humidity sensor1 daily last 3 weeks",
+)
+
+WRITE_ROWS = make_rows(100)
+
+# name -> (method, url, request keyword arguments), the writes run last
+SHAPES = {
+    "latest": ("GET", "/query", {"params": {"query": QUERIES[0]}}),
+    "latest_multi": ("GET", "/query", {"params": {"query": QUERIES[1]}}),
+    "window": ("GET", "/query", {"params": {"query": QUERIES[2]}}),
+    "since": ("GET", "/query", {"params": {"query": QUERIES[3]}}),
+    "all_sensors": ("GET", "/query", {"params": {"query": QUERIES[4]}}),
+    "bucket": ("GET", "/query", {"params": {"query": QUERIES[5]}}),
+    "batch": ("POST", "/query/batch", {"json": [{"query": q} for q in QUERIES]}),
+    "series": (
+        "GET",
+        "/series",
+        {"params": {"query": "humidity sensor2 last 10 days", "format": "csv"}},
+    ),
+    "sensor": ("POST", "/sensor", {"json": WRITE_ROWS[0]}),
+    "sensor_batch": ("POST", "/sensor/batch", {"json": WRITE_ROWS}),
+}
+
+
+async def worker(client, shape, deadline, latencies):
+    method, url, kwargs = shape
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        resp = await client.request(method, url, **kwargs)
+        resp.raise_for_status()
+        await resp.aread()
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(shapes, seconds, concurrency, data):
+    # pylint: disable=import-outside-toplevel
+    from abcde.main import app
+    from abcde.seed import get_engine
+    from abcde.utils import get_async_engine
+
+    get_engine.cache_clear()
+    get_async_engine.cache_clear()
+    await generate(*data)
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=60
+        ) as client:
+            for name in shapes:
+                latencies = []
+                deadline = time.perf_counter() + seconds
+                await asyncio.gather(
+                    *(
+                        worker(client, SHAPES[name], deadline, latencies)
+                        for _ in range(concurrency)
+                    )
+                )
+                results[name] = latency_summary(latencies, seconds)
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--seconds", type=float, default=5)
+    arg_parser.add_argument("--concurrency", type=int, default=8)
+    arg_parser.add_argument("--shapes", default=",".join(SHAPES))
+    arg_parser.add_argument("--sensors", type=int, default=10)
+    arg_parser.add_argument("--metrics", type=int, default=4)
+    arg_parser.add_argument("--readings", type=int, default=1000)
+    arg_parser.add_argument("--interval", type=float, default=900)
+    arg_parser.add_argument("--json", help="write the results to this file")
+    args = arg_parser.parse_args()
+
+    shapes = args.shapes.split(",")
+    data = (args.sensors, args.metrics, args.readings, args.interval)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["ABCDE_DB_URL"] = f"sqlite:///{tmp}/bench.db"
+        results = asyncio.run(run(shapes, args.seconds, args.concurrency, data))
+
+    print(f"{'shape':14} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:14} {result['throughput']:8.0f} {result['p50_ms']:8.2f}"
+            f" {result['p95_ms']:8.2f} {result['p99_ms']:8.2f}"
+        )
+
+    if args.json:
+        write_json(args.json, "load", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
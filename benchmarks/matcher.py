@@ -0,0 +1,128 @@
+"""SimilarityMatcher microbenchmark: per-pair Counter cosine vs vectorized.
+
+Scores every word of a long query against every SimilarityTag of the query
+language, like Query.parse does.
+
+Usage:
+    python -m benchmarks.matcher --words 200 --repeat 20
+"""
+
+import argparse
+import random
+import timeit
+
+from abcde.language_parser import SimilarityMatcher, SimilarityTag
+from abcde.query_parser import EXTRACT_PIPES
+
+PHRASES = [
+    "give me the average temperature and humidity for sensor 1 in the last week",
+    "min tempreature for all sensro previosu 7 dyas",
+    "max rain sensor2 sensor3 since 2012.01.01",
+]
+
+
+def similarity_words():
+    def walk(tags):
+        for tag in tags:
+            if isinstance(tag, SimilarityTag):
+                yield (tuple(tag.matcher.words), tag.matcher.similarity)
+            elif hasattr(tag, "parts"):
+                yield from walk(tag.parts)
+
+    vocabularies = set()
+    for pipes in EXTRACT_PIPES.values():
+        for pipe in pipes:
+            vocabularies.update(walk(pipe[0]))
+    return sorted(vocabularies)
+
+
+def counter_match(matcher, word):
+    """The per-pair implementation the matcher replaced."""
+    for w in matcher.words:
+        if matcher.get_cosine_sim(w, word) >= matcher.similarity:
+            return word
+    return False
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--words", type=int, default=200)
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    arg_parser.add_argument("--vocabulary", type=int, default=1000)
+    args = arg_parser.parse_args()
+
+    rnd = random.Random(0)
+    vocabulary = " ".join(PHRASES).split()
+    words = [rnd.choice(vocabulary) for _ in range(args.words)]
+    matchers = [SimilarityMatcher(list(w), s) for w, s in similarity_words()]
+
+    def run_counter():
+        for matcher in matchers:
+            for word in words:
+                counter_match(matcher, word)
+
+    def run_vectorized_uncached():
+        for matcher in matchers:
+            for word in words:
+                (matcher.get_cosine_sims(word) >= matcher.similarity).any()
+
+    def run_vectorized_cold():
+        for matcher in matchers:
+            matcher.cache.clear()
+            for word in words:
+                matcher.word_match(word)
+
+    def run_vectorized():
+        for matcher in matchers:
+            for word in words:
+                matcher.word_match(word)
+
+    results = {
+        "counter": min(timeit.repeat(run_counter, number=1, repeat=args.repeat)),
+        "vectorized (no cache)": min(
+            timeit.repeat(run_vectorized_uncached, number=1, repeat=args.repeat)
+        ),
+        "vectorized (cold cache)": min(
+            timeit.repeat(run_vectorized_cold, number=1, repeat=args.repeat)
+        ),
+        "vectorized (warm cache)": min(
+            timeit.repeat(run_vectorized, number=1, repeat=args.repeat)
+        ),
+    }
+
+    print(f"{len(words)} words x {len(matchers)} matchers")
+    report(results)
+
+    # one matcher with a large vocabulary, the case the matrix product is for
+    large = SimilarityMatcher(
+        [f"{rnd.choice(vocabulary)}{i}" for i in range(args.vocabulary)]
+    )
+    distinct = sorted(set(words))
+    results = {
+        "counter": min(
+            timeit.repeat(
+                lambda: [counter_match(large, w) for w in distinct],
+                number=1,
+                repeat=args.repeat,
+            )
+        ),
+        "vectorized (no cache)": min(
+            timeit.repeat(
+                lambda: [large.get_cosine_sims(w) for w in distinct],
+                number=1,
+                repeat=args.repeat,
+            )
+        ),
+    }
+    print(f"\n{len(distinct)} words x 1 matcher of {args.vocabulary} words")
+    report(results)
+
+
+def report(results):
+    for name, seconds in results.items():
+        speedup = results["counter"] / seconds
+        print(f"{name:25} {seconds * 1000:9.2f} ms  {speedup:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Microbenchmarks: Query.parse, SimilarityMatcher and statement compilation.
+
+Every case runs over the query shapes of benchmarks.load, the time is per
+operation (one query or one word).
+
+Usage:
+    python -m benchmarks.micro --number 100 --repeat 5 --json micro.json
+"""
+
+import argparse
+import statistics
+import timeit
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from abcde.language_parser import SimilarityMatcher
+from abcde.query_parser import PARSE_CACHE, Query
+from benchmarks.load import QUERIES
+from benchmarks.matcher import similarity_words
+from benchmarks.report import write_json
+
+
+def cases():
+    """name -> (function, operations per call)"""
+    parsers = [Query(query) for query in QUERIES]
+    stmts = [parser.get_stmt() for parser in parsers]
+    words = sorted({word for query in QUERIES for word in query.split()})
+    matchers = [SimilarityMatcher(list(w), s) for w, s in similarity_words()]
+
+    def parse():
+        for query in QUERIES:
+            Query(query).parse()
+
+    def parse_miss():
+        PARSE_CACHE.clear()
+        parse()
+
+    def match(clear):
+        for matcher in matchers:
+            if clear:
+                matcher.cache.clear()
+            for word in words:
+                matcher.word_match(word)
+
+    def build():
+        for parser in parsers:
+            parser.build_stmt(parser.parsed)
+
+    def compile_(dialect):
+        for stmt in stmts:
+            stmt.compile(dialect=dialect)
+
+    match_ops = len(matchers) * len(words)
+    return {
+        "parse (cache miss)": (parse_miss, len(QUERIES)),
+        "parse (cached)": (parse, len(QUERIES)),
+        "matcher (cold)": (lambda: match(True), match_ops),
+        "matcher (warm)": (lambda: match(False), match_ops),
+        "build statement": (build, len(QUERIES)),
+        "compile sqlite": (lambda: compile_(sqlite.dialect()), len(QUERIES)),
+        "compile postgresql": (
+            lambda: compile_(postgresql.dialect()),
+            len(QUERIES),
+        ),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--number", type=int, default=100)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--json", help="write the results to this file")
+    args = arg_parser.parse_args()
+
+    results = {}
+    print(f"{'case':20} {'min us':>10} {'median us':>10}")
+    for name, (function, operations) in cases().items():
+        function()
+        times = [
+            seconds / args.number / operations * 1e6
+            for seconds in timeit.repeat(
+                function, number=args.number, repeat=args.repeat
+            )
+        ]
+        results[name] = {"min_us": min(times), "median_us": statistics.median(times)}
+        print(f"{name:20} {min(times):10.2f} {statistics.median(times):10.2f}")
+
+    if args.json:
+        write_json(args.json, "micro", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
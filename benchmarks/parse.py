@@ -0,0 +1,77 @@
+"""Query.parse benchmark: pipe by pipe scan vs single pass tag lattice.
+
+The parse cache is disabled, the word caches of the matchers are warm in
+both cases.
+
+Usage:
+    python -m benchmarks.parse --repeat 20
+"""
+
+import argparse
+import timeit
+
+from abcde.query_parser import EXTRACT_PIPES, PARSE_CACHE, Query
+
+QUERIES = [
+    "min temperature sensor1",
+    "Give me the average temperature and humidity for sensor 1 in the last week.",
+    "min tempreature for all sensro previosu 7 dyas",
+    "max rain sensor2 sensor3 since 2012.01.01",
+    " ".join(
+        ["what was the sum of rain and wind for sensor 4 and sensor 5"] * 4
+        + ["in the last 3 months"]
+    ),
+]
+
+
+def scan_parse(text):
+    """The pipe by pipe scan Query.parse used before the tag lattice."""
+
+    def check_match(pipe, words, index):
+        tags = []
+        for i, p in enumerate(pipe):
+            idx = index + i
+            if idx >= len(words):
+                return False, []
+            word = words[idx].strip(".,")
+            if m := p.matches(word):
+                tags.append((p.tag_name(), m))
+            else:
+                return False, []
+        return True, tags
+
+    matches = {key: [] for key in EXTRACT_PIPES}
+    words = text.split()
+    for index in range(len(words)):
+        for type_, pipes in EXTRACT_PIPES.items():
+            for pipe in pipes:
+                m, tags = check_match(pipe[0], words, index)
+                if m:
+                    matches[type_].append(pipe[1](*tags))
+                    break
+    return matches
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    arg_parser.add_argument("--number", type=int, default=100)
+    args = arg_parser.parse_args()
+
+    PARSE_CACHE.resize(0)
+    print(f"{'words':>5} {'scan us':>10} {'lattice us':>10} {'speedup':>8}")
+    for query in QUERIES:
+        assert {**scan_parse(query), "date": []} == {**Query(query).parse(), "date": []}
+        scan, lattice = (
+            min(timeit.repeat(fn, number=args.number, repeat=args.repeat))
+            / args.number
+            * 1e6
+            for fn in (lambda: scan_parse(query), lambda: Query(query).parse())
+        )
+        print(
+            f"{len(query.split()):5} {scan:10.1f} {lattice:10.1f} {scan / lattice:7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Tail latency of light requests next to long queries, parsed on the event
+loop vs in the parse threads.
+
+A temporary database is seeded with benchmarks.data. `--heavy` clients
+send queries of `--words` new random words (no word is in the tagger
+cache), `--light` clients send a latest query and a single value write,
+for `--seconds` with ABCDE_PARSE_THREADS 0 and `--threads`. The parse
+cache is disabled.
+
+Usage:
+    python -m benchmarks.parse_threads --seconds 5 --heavy 2 --light 4
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import string
+import tempfile
+import time
+from unittest import mock
+
+import httpx
+
+from benchmarks.data import generate
+from benchmarks.ingest import make_rows
+from benchmarks.report import latency_summary, write_json
+
+LIGHT = {
+    "latest": ("GET", "/query", {"params": {"query": "min temperature sensor1"}}),
+    "sensor": ("POST", "/sensor", {"json": make_rows(1)[0]}),
+}
+
+
+def heavy_query(rnd, words):
+    noise = (
+        "".join(rnd.choices(string.ascii_lowercase, k=rnd.randint(4, 10)))
+        for _ in range(words - 3)
+    )
+    return " ".join(["max", "temperature", "sensor1", *noise])
+
+
+async def light_client(client, shape, deadline, latencies):
+    method, url, kwargs = shape
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        resp = await client.request(method, url, **kwargs)
+        resp.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+async def heavy_client(client, rnd, words, deadline, latencies):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        resp = await client.get("/query", params={"query": heavy_query(rnd, words)})
+        # a random word may need a date ("per", "hourly")
+        assert resp.status_code in (200, 400), resp.text
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(args):
+    # pylint: disable=import-outside-toplevel
+    from abcde.main import app
+
+    rnd = random.Random(1)
+    results = {}
+    for threads in (0, args.threads):
+        latencies = {"heavy": [], **{name: [] for name in LIGHT}}
+        env = {"ABCDE_PARSE_THREADS": str(threads)}
+        with mock.patch.dict(os.environ, env):
+            transport = httpx.ASGITransport(app=app)
+            async with app.router.lifespan_context(app):
+                async with httpx.AsyncClient(
+                    transport=transport, base_url="http://bench", timeout=60
+                ) as client:
+                    deadline = time.perf_counter() + args.seconds
+                    await asyncio.gather(
+                        *(
+                            heavy_client(
+                                client, rnd, args.words, deadline, latencies["heavy"]
+                            )
+                            for _ in range(args.heavy)
+                        ),
+                        *(
+                            light_client(client, shape, deadline, latencies[name])
+                            for name, shape in LIGHT.items()
+                            for _ in range(args.light)
+                        ),
+                    )
+        for name, values in latencies.items():
+            results[f"{name}_threads_{threads}"] = latency_summary(values, args.seconds)
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--seconds", type=float, default=5)
+    arg_parser.add_argument("--heavy", type=int, default=2)
+    arg_parser.add_argument("--light", type=int, default=4)
+    arg_parser.add_argument("--words", type=int, default=100)
+    arg_parser.add_argument("--threads", type=int, default=2)
+    arg_parser.add_argument("--json", help="write the results to this file")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["ABCDE_DB_URL"] = f"sqlite:///{tmp}/bench.db"
+        asyncio.run(generate(10, 4, 1000, 900))
+        results = asyncio.run(run(args))
+
+    print(f"{'shape':20} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:20} {result['throughput']:8.0f} {result['p50_ms']:8.2f}"
+            f" {result['p95_ms']:8.2f} {result['p99_ms']:8.2f}"
+        )
+
+    if args.json:
+        write_json(args.json, "parse_threads", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Result summaries and the JSON output of the benchmarks"""
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+
+
+def percentile(values, q):
+    """The q-th percentile of latencies in seconds, in milliseconds."""
+    if len(values) < 2:
+        return values[0] * 1000 if values else None
+    return statistics.quantiles(values, n=100)[q - 1] * 1000
+
+
+def latency_summary(latencies, seconds):
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / seconds,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_json(path, benchmark, params, results):
+    """Write the results with the parameters and the environment of the run.
+
+    `results` maps a case name to its metrics, see benchmarks.compare.
+    """
+    document = {
+        "benchmark": benchmark,
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(document, file, indent=2)
@@ -0,0 +1,84 @@
+"""/query response serialization: per row models vs plain dicts + pydantic-core.
+
+The model path is what /query did before: a SensorMetric per row, the
+SensorMetricResult dumped, validated against the response_model and encoded
+with json.dumps by FastAPI.
+
+Usage:
+    python -m benchmarks.serialize --rows 100,1000,10000 --repeat 5
+"""
+
+import argparse
+import json
+import timeit
+
+from pydantic import TypeAdapter
+
+from abcde import models
+from abcde.query_parser import Query
+from abcde.responses import FastJSONResponse, query_payload
+
+RESULT = TypeAdapter(models.SensorMetricResult | models.SensorMetricSeriesResult)
+
+
+def model_response(parser, rows):
+    result = models.SensorMetricResult(
+        data=[models.SensorMetric(**row) for row in rows],
+        meta=models.QueryMeta(
+            sensor=parser.parsed["sensor"],
+            metric=parser.parsed["metric"],
+            aggregation=parser.parsed["aggregation"][0],
+            date=parser.parsed["date"][0] if parser.parsed["date"] else None,
+        ),
+    )
+    # fastapi.routing.serialize_response
+    content = result.model_dump(exclude_unset=True)
+    value = RESULT.validate_python(content)
+    content = RESULT.dump_python(value, mode="json", exclude_unset=True)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode()
+
+
+def fast_response(parser, rows):
+    return FastJSONResponse(query_payload(parser, rows)).body
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--rows", default="100,1000,10000")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    parser = Query("average temperature, humidity all sensors last week")
+    parser.parse()
+    print(f"{'rows':>6} {'models ms':>10} {'fast ms':>10} {'speedup':>8}")
+    for count in (int(value) for value in args.rows.split(",")):
+        rows = [
+            {
+                "sensor": f"sensor{i // 2}",
+                "metric": ("temperature", "humidity")[i % 2],
+                "unit": ("C", "%")[i % 2],
+                "value": i * 0.5,
+            }
+            for i in range(count)
+        ]
+        assert json.loads(model_response(parser, rows)) == json.loads(
+            fast_response(parser, rows)
+        )
+        number = max(1, 10000 // count)
+        slow, fast = (
+            min(
+                timeit.repeat(
+                    lambda fn=fn: fn(parser, rows), number=number, repeat=args.repeat
+                )
+            )
+            / number
+            * 1000
+            for fn in (model_response, fast_response)
+        )
+        print(f"{count:6} {slow:10.3f} {fast:10.3f} {slow / fast:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
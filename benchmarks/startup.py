@@ -0,0 +1,143 @@
+"""Cold start: import time of abcde.main and time to the first response.
+
+The import time is the cumulative time of abcde.main reported by
+`python -X importtime`, the first response is timed from starting uvicorn
+on an empty SQLite database until a /query is answered. The medians of
+`--runs` fresh interpreters are reported, the largest imports of the last
+run are listed. With `--max-import-ms` / `--max-first-response-ms` the exit
+code is 1 when a median is above the threshold.
+
+Usage:
+    python -m benchmarks.startup --runs 5 --max-import-ms 1500 --json startup.json
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.report import write_json
+from benchmarks.workers import free_port
+
+
+def import_times():
+    """(module, depth, cumulative ms) of the imports of abcde.main."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import abcde.main"],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), depth, int(cumulative) / 1000))
+    return times
+
+
+def first_response(env):
+    """Milliseconds from starting the server until a /query is answered."""
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "abcde.main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    try:
+        # a failed connect is cheap, the client is only used once the port
+        # is open (the poll would take CPU time from the server otherwise)
+        while time.perf_counter() - start < 60:
+            try:
+                socket.create_connection(("127.0.0.1", port)).close()
+            except OSError:
+                time.sleep(0.005)
+                continue
+            resp = httpx.get(
+                f"http://127.0.0.1:{port}/query",
+                params={"query": "min temperature sensor1"},
+            )
+            resp.raise_for_status()
+            return (time.perf_counter() - start) * 1000
+        raise RuntimeError("the server did not start")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def check(name, value, threshold):
+    if threshold is not None and value > threshold:
+        print(f"{name} {value:.1f} ms is above {threshold} ms")
+        return False
+    return True
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--top", type=int, default=10)
+    arg_parser.add_argument("--max-import-ms", type=float)
+    arg_parser.add_argument("--max-first-response-ms", type=float)
+    arg_parser.add_argument("--json", help="write the results to this file")
+    args = arg_parser.parse_args()
+
+    imports = []
+    for _ in range(args.runs):
+        times = import_times()
+        imports.append(next(ms for name, _, ms in times if name == "abcde.main"))
+    responses = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "ABCDE_DB_URL": f"sqlite:///{tmp}/startup.db"}
+        for _ in range(args.runs):
+            responses.append(first_response(env))
+
+    import_ms = statistics.median(imports)
+    first_response_ms = statistics.median(responses)
+    print(f"import abcde.main: {import_ms:8.1f} ms")
+    print(f"first response:    {first_response_ms:8.1f} ms")
+    print("largest imports of abcde.main:")
+    direct = sorted(
+        ((ms, name) for name, depth, ms in times if depth == 1), reverse=True
+    )
+    for ms, name in direct[: args.top]:
+        print(f"  {name:<30} {ms:8.1f} ms")
+
+    if args.json:
+        write_json(
+            args.json,
+            "startup",
+            {"runs": args.runs},
+            {
+                "import": {"import_ms": import_ms},
+                "first_response": {"first_response_ms": first_response_ms},
+            },
+        )
+    passed = check("import", import_ms, args.max_import_ms)
+    passed = (
+        check("first response", first_response_ms, args.max_first_response_ms)
+        and passed
+    )
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Statement building and execution: bound copies vs the shared statements.
+
+Every query shape of benchmarks.load is built from scratch (`build_stmt`),
+executed as a bound copy (`get_stmt`, the statement copied with the names
+and the date window as values, the endpoints copied the statements of the
+date queries before) and executed as the shared statement of its shape with
+the parameters (`statement`, what the endpoints do), on an empty in-memory
+SQLite database. The copies get a new SQLAlchemy cache key on every
+execution, the shared statement computes it once. The lookups of the
+statement and the compiled caches are listed.
+
+Usage:
+    python -m benchmarks.statements --repeat 5 --number 200
+"""
+
+import argparse
+import timeit
+
+from sqlalchemy import create_engine
+
+from abcde.metrics import COMPILED_CACHE
+from abcde.query_parser import STMT_CACHE, Query
+from abcde.sql_models import Base
+from benchmarks.load import QUERIES
+
+
+def best_us(fn, args):
+    return min(timeit.repeat(fn, number=args.number, repeat=args.repeat)) / (
+        args.number / 1e6
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--number", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    COMPILED_CACHE.listen()
+    print(f"{'query':<60} {'build us':>9} {'copy us':>9} {'shared us':>9}")
+    with engine.connect() as conn:
+        for query in QUERIES:
+            parser = Query(query)
+            parsed = parser.parse()
+            assert conn.execute(parser.get_stmt()).all() == []
+            assert conn.execute(*parser.statement()).all() == []
+            build = best_us(lambda: parser.build_stmt(parsed), args)
+            copy = best_us(lambda: conn.execute(parser.get_stmt()).all(), args)
+            shared = best_us(lambda: conn.execute(*parser.statement()).all(), args)
+            print(f"{query:<60} {build:9.1f} {copy:9.1f} {shared:9.1f}")
+    COMPILED_CACHE.remove()
+
+    print()
+    stats = STMT_CACHE.stats()
+    print(f"statements: {stats['size']} shapes, {stats['hits']} hits")
+    stats = COMPILED_CACHE.stats()
+    print(f"compiled:   {stats['hits']} hits, {stats['misses']} misses")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Name lookup: trigram indexed Vocabulary vs a SimilarityMatcher scan.
+
+`--names` sensor names are generated, half of them sensorN, half made of a
+site name and places. Exact names, names with a typo and words which are no names
+(the other words of a query) are looked up in the Vocabulary and scored
+against every name by a SimilarityMatcher (numpy, word cache disabled).
+Last a query is parsed with the names added to the parser vocabulary.
+
+Usage:
+    python -m benchmarks.vocabulary --names 100000
+"""
+
+import argparse
+import random
+import time
+import timeit
+
+from abcde.language_parser import SimilarityMatcher
+from abcde.query_parser import PARSE_CACHE, Query, add_names
+from abcde.vocabulary import Vocabulary
+
+PLACES = (
+    "green",
+    "house",
+    "north",
+    "south",
+    "east",
+    "west",
+    "barn",
+    "field",
+    "roof",
+    "tank",
+    "silo",
+    "pond",
+    "gate",
+    "yard",
+    "shed",
+    "hill",
+    "creek",
+    "mill",
+)
+SYLLABLES = ("ka", "lo", "mi", "ter", "van", "dor", "bel", "ru", "sen", "tos")
+
+
+def generate_names(count, rnd):
+    names = {f"sensor{n}" for n in range(count // 2)}
+    while len(names) < count:
+        site = "".join(rnd.choices(SYLLABLES, k=rnd.randint(2, 3)))
+        parts = [site, *rnd.sample(PLACES, rnd.randint(1, 2))]
+        names.add("-".join(parts) + str(rnd.randint(0, 99)) * rnd.randint(0, 1))
+    return sorted(names)
+
+
+def typo(word, rnd):
+    index = rnd.randrange(len(word) - 1)
+    return word[:index] + word[index + 1] + word[index] + word[index + 2 :]
+
+
+def best_us(fn, words, repeat):
+    runs = timeit.repeat(lambda: [fn(word) for word in words], number=1, repeat=repeat)
+    return min(runs) / len(words) * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--names", type=int, default=100000)
+    arg_parser.add_argument("--words", type=int, default=50)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    rnd = random.Random(1)
+    names = generate_names(args.names, rnd)
+    start = time.perf_counter()
+    vocabulary = Vocabulary(names)
+    print(f"{len(names)} names indexed in {time.perf_counter() - start:.2f} s")
+    matcher = SimilarityMatcher(names, cache_size=0)
+
+    samples = rnd.sample(names, args.words)
+    words = {
+        "exact": samples,
+        "typo": [typo(name, rnd) for name in samples],
+        "no name": ["max", "temperature", "sensor", "all", "sensors", "the", "last"],
+    }
+    print(f"{'words':<10} {'index us':>10} {'scan us':>10} {'speedup':>8}")
+    for kind, group in words.items():
+        index = best_us(vocabulary.lookup, group, args.repeat)
+        scan = best_us(matcher.word_match, group[:5], 1)
+        print(f"{kind:<10} {index:10.1f} {scan:10.1f} {scan / index:7.0f}x")
+
+    add_names(names)
+    PARSE_CACHE.resize(0)
+    query = f"max tempreature {typo(samples[0], rnd)} {samples[1]} last 3 days"
+    parse = min(timeit.repeat(lambda: Query(query).parse(), number=10, repeat=5)) / 10
+    print(f"Query.parse with {len(names)} sensor names: {parse * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Multi-worker benchmark: /query throughput of 1..N uvicorn worker processes.
+
+Starts the app with uvicorn (as startup.sh does with `fastapi run`) on a
+tuned SQLite database for every worker count, and drives it over HTTP from
+client processes. Needs uvicorn and at least as many cores as workers plus
+clients for the throughput to scale.
+
+Usage:
+    python -m benchmarks.workers --workers 1,2,4 --clients 4 --seconds 10
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.concurrency import QUERIES
+from benchmarks.ingest import make_rows
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, port, env):
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "abcde.main:app",
+            "--workers",
+            str(workers),
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            httpx.get(f"{base_url}/stats").raise_for_status()
+            return server, base_url
+        except httpx.TransportError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("the server did not start")
+
+
+async def drive(base_url, seconds, concurrency):
+    count = 0
+    pids = set()
+
+    async def reader(client, index):
+        nonlocal count
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            resp = await client.get(
+                "/query", params={"query": QUERIES[index % len(QUERIES)]}
+            )
+            resp.raise_for_status()
+            count += 1
+            index += 1
+        pids.add((await client.get("/stats")).json()["pid"])
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await asyncio.gather(*(reader(client, i) for i in range(concurrency)))
+    return count, pids
+
+
+def client_process(args):
+    return asyncio.run(drive(*args))
+
+
+def run(workers, clients, seconds, concurrency):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "ABCDE_DB_URL": f"sqlite:///{tmp}/bench.db",
+            "ABCDE_SQLITE_TUNED": "true",
+            "ABCDE_WORKERS": str(workers),
+        }
+        server, base_url = start_server(workers, free_port(), env)
+        try:
+            rows = make_rows(1000)
+            for _ in range(20):
+                httpx.post(
+                    f"{base_url}/sensor/batch", json=rows, timeout=60
+                ).raise_for_status()
+            with multiprocessing.Pool(clients) as pool:
+                results = pool.map(
+                    client_process, [(base_url, seconds, concurrency)] * clients
+                )
+        finally:
+            server.terminate()
+            server.wait()
+    count = sum(result[0] for result in results)
+    pids = set().union(*(result[1] for result in results))
+    return count / seconds, len(pids)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--workers", default="1,2,4")
+    arg_parser.add_argument("--clients", type=int, default=4)
+    arg_parser.add_argument("--concurrency", type=int, default=8)
+    arg_parser.add_argument("--seconds", type=float, default=10)
+    args = arg_parser.parse_args()
+
+    print(f"{os.cpu_count()} cores")
+    print(f"{'workers':>8} {'reads/s':>9} {'answering':>10}")
+    for workers in (int(value) for value in args.workers.split(",")):
+        reads, answering = run(workers, args.clients, args.seconds, args.concurrency)
+        print(f"{workers:8} {reads:9.0f} {answering:10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+Databases created before the migrations were introduced already have this
+schema, the app marks them with 0001 on startup. On PostgreSQL sensor_values
+is range partitioned by month on timestamp, the primary key of a partitioned
+table has to contain the partition key.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "sensors",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=30), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name"),
+    )
+    op.create_index(op.f("ix_sensors_id"), "sensors", ["id"], unique=False)
+    op.create_table(
+        "sensor_metrics",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=30), nullable=False),
+        sa.Column("unit", sa.String(length=30), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_sensor_metrics_id"), "sensor_metrics", ["id"], unique=False
+    )
+    op.create_index(
+        op.f("ix_sensor_metrics_name"), "sensor_metrics", ["name"], unique=True
+    )
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            """
+            CREATE TABLE sensor_values (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+                timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                value FLOAT NOT NULL,
+                sensor_id INTEGER NOT NULL REFERENCES sensors (id),
+                metric_id INTEGER NOT NULL REFERENCES sensor_metrics (id),
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+            """
+        )
+        return
+    op.create_table(
+        "sensor_values",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=False),
+        sa.Column("value", sa.Float(), nullable=False),
+        sa.Column("sensor_id", sa.Integer(), nullable=False),
+        sa.Column("metric_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["metric_id"], ["sensor_metrics.id"]),
+        sa.ForeignKeyConstraint(["sensor_id"], ["sensors.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_sensor_values_id"), "sensor_values", ["id"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == "postgresql":
+        # drops the partitions too
+        op.execute("DROP TABLE sensor_values CASCADE")
+    else:
+        op.drop_index(op.f("ix_sensor_values_id"), table_name="sensor_values")
+        op.drop_table("sensor_values")
+    op.drop_index(op.f("ix_sensor_metrics_name"), table_name="sensor_metrics")
+    op.drop_index(op.f("ix_sensor_metrics_id"), table_name="sensor_metrics")
+    op.drop_table("sensor_metrics")
+    op.drop_index(op.f("ix_sensors_id"), table_name="sensors")
+    op.drop_table("sensors")
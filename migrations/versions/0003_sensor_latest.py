@@ -0,0 +1,55 @@
+"""sensor_latest table
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "sensor_latest",
+        sa.Column("sensor_id", sa.Integer(), nullable=False),
+        sa.Column("metric_id", sa.Integer(), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=False),
+        sa.Column("value", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["metric_id"], ["sensor_metrics.id"]),
+        sa.ForeignKeyConstraint(["sensor_id"], ["sensors.id"]),
+        sa.PrimaryKeyConstraint("sensor_id", "metric_id"),
+    )
+    op.execute(
+        """
+        INSERT INTO sensor_latest (sensor_id, metric_id, timestamp, value)
+        SELECT sensor_id, metric_id, timestamp, value FROM (
+            SELECT
+                sensor_id,
+                metric_id,
+                timestamp,
+                value,
+                row_number() OVER (
+                    PARTITION BY sensor_id, metric_id ORDER BY timestamp DESC
+                ) AS rn
+            FROM sensor_values
+        ) AS ranked
+        WHERE rn = 1
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("sensor_latest")
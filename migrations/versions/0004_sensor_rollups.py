@@ -0,0 +1,74 @@
+"""sensor_rollups table
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# dialect -> bucket start expressions, the SQLite ones follow the storage
+# format of sqlalchemy's DateTime
+BUCKETS = {
+    "sqlite": {
+        "minute": "strftime('%Y-%m-%d %H:%M:00.000000', timestamp)",
+        "hour": "strftime('%Y-%m-%d %H:00:00.000000', timestamp)",
+        "day": "strftime('%Y-%m-%d 00:00:00.000000', timestamp)",
+    },
+    "postgresql": {
+        resolution: f"date_trunc('{resolution}', timestamp)"
+        for resolution in ("minute", "hour", "day")
+    },
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "sensor_rollups",
+        sa.Column("resolution", sa.String(length=10), nullable=False),
+        sa.Column("sensor_id", sa.Integer(), nullable=False),
+        sa.Column("metric_id", sa.Integer(), nullable=False),
+        sa.Column("bucket_start", sa.DateTime(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("sum", sa.Float(), nullable=False),
+        sa.Column("min", sa.Float(), nullable=False),
+        sa.Column("max", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["metric_id"], ["sensor_metrics.id"]),
+        sa.ForeignKeyConstraint(["sensor_id"], ["sensors.id"]),
+        sa.PrimaryKeyConstraint("resolution", "sensor_id", "metric_id", "bucket_start"),
+    )
+    for resolution, bucket in BUCKETS[op.get_bind().dialect.name].items():
+        op.execute(
+            f"""
+            INSERT INTO sensor_rollups
+                (resolution, sensor_id, metric_id, bucket_start, count, sum, min, max)
+            SELECT
+                '{resolution}',
+                sensor_id,
+                metric_id,
+                {bucket},
+                count(value),
+                sum(value),
+                min(value),
+                max(value)
+            FROM sensor_values
+            GROUP BY sensor_id, metric_id, {bucket}
+            """
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("sensor_rollups")
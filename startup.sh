@@ -1,3 +1,3 @@
 #!/bin/bash
 
-fastapi run --workers 1 abcde/main.py --port 80
+fastapi run --workers "${ABCDE_WORKERS:-1}" abcde/main.py --port 80
@@ -1,12 +1,26 @@
-"""conftest"""
+"""conftest
+
+The PostgreSQL tests run against the (throwaway) database of
+ABCDE_TEST_PG_URL, e.g. postgresql://postgres@localhost/abcde_test
+"""
+
+import os
+import tempfile
+from unittest import mock
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import text
 from sqlmodel import Session, create_engine
 import datetime
 
 from abcde.main import app
+from abcde.seed import add_data, get_engine
 from abcde.sql_models import Sensor, SensorMetric, SensorValue, Base
+from abcde.storage import get_url_storage
+from abcde.utils import get_async_engine
+
+PG_URL = os.environ.get("ABCDE_TEST_PG_URL")
 
 
 @pytest.fixture(scope="function")
@@ -22,6 +36,51 @@ def engine():
     db.dispose()
 
 
+@pytest.fixture
+def env():
+    with tempfile.NamedTemporaryFile(delete=True) as tmp:
+        env_vars = {"ABCDE_DB_URL": f"sqlite:///{tmp.name}"}
+        with mock.patch.dict(os.environ, env_vars):
+            get_engine.cache_clear()
+            get_async_engine.cache_clear()
+            yield env_vars
+    get_engine.cache_clear()
+    get_async_engine.cache_clear()
+
+
+@pytest.fixture
+def seeded(env):
+    add_data()
+    return env
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def db_url(request):
+    if request.param == "sqlite":
+        with tempfile.NamedTemporaryFile(delete=True) as tmp:
+            yield f"sqlite:///{tmp.name}"
+        return
+
+    if not PG_URL:
+        pytest.skip("ABCDE_TEST_PG_URL is not set")
+    engine = create_engine(PG_URL)
+    Base.metadata.drop_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+    engine.dispose()
+    yield PG_URL
+
+
+@pytest.fixture
+def backend(db_url):
+    with mock.patch.dict(os.environ, {"ABCDE_DB_URL": db_url}):
+        get_engine.cache_clear()
+        get_async_engine.cache_clear()
+        yield get_url_storage(db_url)
+    get_engine.cache_clear()
+    get_async_engine.cache_clear()
+
+
 @pytest.fixture()
 def dt_now():
     return datetime.datetime(2025, 12, 1)
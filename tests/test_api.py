@@ -1,27 +1,26 @@
 """test api"""
 
-import tempfile
+import csv
+import io
+import json
 from unittest import mock
 import os
 
 import pytest
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
 
-from abcde.utils import add_data, get_engine, get_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from abcde.cache import SharedGeneration
+from abcde.ingest import insert_values
+from abcde import models
+from abcde.main import app
+from abcde.models import SensorInput
+from abcde.utils import get_async_engine
 
-@pytest.fixture
-def env():
-    with tempfile.NamedTemporaryFile(delete=True) as tmp:
-        env_vars = {"ABCDE_DB_URL": f"sqlite:///{tmp.name}"}
-        with mock.patch.dict(os.environ, env_vars):
-            yield env_vars
-
-
-def test_api(env, client):
-    get_engine.cache_clear()
-    get_async_engine.cache_clear()
-    add_data()
 
+def test_api(seeded, client):
     q = "min temperature sensor1"
     resp = client.get("/query", params={"query": q})
     assert resp.status_code == 200
@@ -40,11 +39,21 @@ def test_api(env, client):
     ]
 
 
-def test_post(env, client):
-    get_engine.cache_clear()
-    get_async_engine.cache_clear()
-    add_data()
+def test_statement_stats(seeded):
+    with TestClient(app) as client:
+        before = client.get("/stats").json()["statements"]
+        for q in ("min rain sensor1", "min rain sensor2", "min temperature sensor2"):
+            resp = client.get("/query", params={"query": q})
+            assert resp.status_code == 200
+        after = client.get("/stats").json()["statements"]
+    assert resp.json()["data"][0]["value"] == 10.0
+    # one statement answers the three queries, it is compiled at most once
+    assert after["hits"] - before["hits"] >= 2
+    assert after["compiled"]["hits"] - before["compiled"]["hits"] >= 2
+    assert after["compiled"]["misses"] - before["compiled"]["misses"] <= 1
+
 
+def test_post(seeded, client):
     q = "min temperature sensor3"
     resp = client.get("/query", params={"query": q})
     assert resp.json()["data"] == []
@@ -92,3 +101,311 @@ def test_post(env, client):
     assert resp.json()["data"] == [
         {"sensor": "sensor3", "metric": "rain", "unit": "mm", "value": 5}
     ]
+
+
+def test_post_batch(seeded, client):
+    payload = [
+        {"sensor": "sensor3", "metric": "temperature", "unit": "C", "value": 10},
+        {"sensor": "sensor3", "metric": "temperature", "unit": "C", "value": 20},
+        {"sensor": "sensor4", "metric": "wind", "unit": "km/h", "value": 3},
+    ]
+    resp = client.post("/sensor/batch", json=payload)
+    assert resp.status_code == 200
+    assert resp.json() == {"count": 3}
+
+    resp = client.get(
+        "/query", params={"query": "average temperature sensor3 last week"}
+    )
+    assert resp.json()["data"] == [
+        {"sensor": "sensor3", "metric": "temperature", "unit": "C", "value": 15}
+    ]
+
+    resp = client.get("/query", params={"query": "min temperature sensor3"})
+    assert resp.json()["data"] == [
+        {"sensor": "sensor3", "metric": "temperature", "unit": "C", "value": 20}
+    ]
+
+    lines = [
+        '{"sensor": "sensor 4", "metric": "wind", "unit": "km/h", "value": 5}',
+        "",
+        '{"sensor": "sensor1", "metric": "temperature", "unit": "C", "value": 1}',
+    ]
+    resp = client.post(
+        "/sensor/batch",
+        content="\n".join(lines),
+        headers={"content-type": "application/x-ndjson"},
+    )
+    assert resp.status_code == 200
+    assert resp.json() == {"count": 2}
+
+    resp = client.get("/query", params={"query": "max wind sensor4 last week"})
+    assert resp.json()["data"] == [
+        {"sensor": "sensor4", "metric": "wind", "unit": "km/h", "value": 5}
+    ]
+
+    resp = client.get("/query", params={"query": "min temperature sensor1 last week"})
+    assert resp.json()["data"] == [
+        {"sensor": "sensor1", "metric": "temperature", "unit": "C", "value": 1}
+    ]
+
+    resp = client.post("/sensor/batch", json=[])
+    assert resp.json() == {"count": 0}
+
+    resp = client.post("/sensor/batch", json=[{"sensor": "sensor1"}])
+    assert resp.status_code == 422
+
+
+def test_result_cache(seeded, client):
+    queries = (
+        "min temperature, humidity sensor1 sensor2",
+        "average temperature all sensors since 2012.01.01",
+    )
+    uncached = [client.get("/query", params={"query": q}).content for q in queries]
+
+    with mock.patch.dict(os.environ, {"ABCDE_RESULT_CACHE_SIZE": "100"}):
+        with TestClient(app) as cached_client:
+            for q, content in zip(queries, uncached):
+                for _ in range(2):
+                    resp = cached_client.get("/query", params={"query": q})
+                    assert resp.content == content
+
+            stats = cached_client.get("/stats").json()["result_cache"]
+            assert stats["hits"] == 2
+            assert stats["misses"] == 2
+
+            q = "max temperature sensor1 since 2012.01.01"
+            resp = cached_client.get("/query", params={"query": q})
+            assert resp.json()["data"][0]["value"] == 9
+
+            payload = {
+                "sensor": "sensor1",
+                "metric": "temperature",
+                "unit": "C",
+                "value": 100,
+            }
+            assert cached_client.post("/sensor", json=payload).status_code == 200
+
+            resp = cached_client.get("/query", params={"query": q})
+            assert resp.json()["data"][0]["value"] == 100
+            resp = cached_client.get(
+                "/query", params={"query": "min temperature sensor1"}
+            )
+            assert resp.json()["data"][0]["value"] == 100
+
+
+def test_result_cache_workers(seeded):
+    other_worker = SharedGeneration()
+
+    async def write_other_worker(value):
+        rows = [
+            SensorInput(sensor="sensor1", metric="temperature", unit="C", value=value)
+        ]
+        async with AsyncSession(get_async_engine()) as session:
+            await insert_values(session, rows, generation=other_worker)
+
+    env_vars = {"ABCDE_RESULT_CACHE_SIZE": "100", "ABCDE_WORKERS": "2"}
+    with mock.patch.dict(os.environ, env_vars):
+        with TestClient(app) as cached_client:
+
+            def query():
+                q = "max temperature sensor1 since 2012.01.01"
+                resp = cached_client.get("/query", params={"query": q})
+                return resp.json()["data"][0]["value"]
+
+            assert query() == 9
+            assert query() == 9
+
+            payload = {"sensor": "sensor1", "metric": "temperature", "unit": "C"}
+            resp = cached_client.post("/sensor", json={**payload, "value": 50})
+            assert resp.status_code == 200
+            assert query() == 50
+
+            cached_client.portal.call(write_other_worker, 100)
+            assert query() == 100
+
+            stats = cached_client.get("/stats").json()
+            assert stats["pid"] == os.getpid()
+            assert stats["result_cache"]["hits"] == 1
+            assert stats["result_cache"]["shared"]["missed"] == 1
+            assert stats["result_cache"]["shared"]["generation"] == 2
+
+
+def test_query_batch(seeded, client):
+    queries = [
+        "min temperature sensor1",
+        "min temperature, humidity sensor1 sensor2",
+        "average temperature all sensors since 2012.01.01",
+        "average humidity sensor2 since 2012.01.01",
+        "max humidity all sensors since 2012.01.01",
+        "sum rain sensor1 last week",
+        "min humidity sensor2",
+    ]
+    expected = [client.get("/query", params={"query": q}).json() for q in queries]
+
+    resp = client.post("/query/batch", json=[{"query": q} for q in queries])
+    assert resp.status_code == 200
+    results = resp.json()
+    assert [r["data"] for r in results] == [r["data"] for r in expected]
+    assert [r["meta"]["sensor"] for r in results] == [
+        r["meta"]["sensor"] for r in expected
+    ]
+
+    with mock.patch.dict(os.environ, {"ABCDE_RESULT_CACHE_SIZE": "100"}):
+        with TestClient(app) as cached_client:
+            for _ in range(2):
+                resp = cached_client.post(
+                    "/query/batch", json=[{"query": q} for q in queries]
+                )
+                assert [r["data"] for r in resp.json()] == [r["data"] for r in expected]
+            # "last week" is a new window on every call
+            stats = cached_client.get("/stats").json()["result_cache"]
+            assert stats["hits"] == len(queries) - 1
+            assert stats["misses"] == len(queries) + 1
+
+    resp = client.post("/query/batch", json=[{"query": queries[0]}, {"query": "x"}])
+    assert resp.status_code == 400
+    assert resp.json()["detail"].startswith("Query 1:")
+
+    assert client.post("/query/batch", json=[]).json() == []
+
+
+def test_series(seeded, client, mocker):
+    with mock.patch.dict(os.environ, {"ABCDE_SERIES_CHUNK_SIZE": "2"}):
+        resp = client.get("/series", params={"query": "temperature all sensors"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert [(r["sensor"], r["value"]) for r in rows] == [
+        ("sensor1", 9),
+        ("sensor1", 8),
+        ("sensor1", 7),
+        ("sensor2", 12),
+        ("sensor2", 11),
+        ("sensor2", 10),
+    ]
+    assert {(r["metric"], r["unit"]) for r in rows} == {("temperature", "C")}
+
+    params = {"query": "humidity sensor2 last 10 days", "format": "csv"}
+    resp = client.get("/series", params=params)
+    assert resp.headers["content-type"].startswith("text/csv")
+    lines = list(csv.reader(io.StringIO(resp.text)))
+    assert lines[0] == ["sensor", "metric", "unit", "timestamp", "value"]
+    assert [line[4] for line in lines[1:]] == ["5.0", "4.0"]
+
+    resp = client.get("/series", params={"query": "sensor1 last week"})
+    assert resp.status_code == 400
+
+    mocker.patch("abcde.main.get_pyarrow", return_value=None)
+    params = {"query": "humidity sensor1", "format": "arrow"}
+    assert client.get("/series", params=params).status_code == 406
+
+
+def test_series_arrow(seeded, client):
+    pa = pytest.importorskip("pyarrow")
+
+    with mock.patch.dict(os.environ, {"ABCDE_SERIES_CHUNK_SIZE": "2"}):
+        params = {"query": "humidity, temperature sensor1", "format": "arrow"}
+        resp = client.get("/series", params=params)
+    assert resp.status_code == 200
+    table = pa.ipc.open_stream(resp.content).read_all()
+    assert table.column_names == ["sensor", "metric", "unit", "timestamp", "value"]
+    assert table.column("value").to_pylist() == [3, 2, 1, 9, 8, 7]
+
+    params = {"query": "rain sensor1", "format": "arrow"}
+    table = pa.ipc.open_stream(client.get("/series", params=params).content)
+    assert table.read_all().num_rows == 0
+
+
+def test_query_bucket(seeded, client):
+    q = "average temperature, humidity sensor1 daily last 3 weeks"
+    resp = client.get("/query", params={"query": q})
+    assert resp.status_code == 200
+    result = resp.json()
+    assert result["meta"]["bucket"] == 86400
+    assert [
+        (series["metric"], series["unit"], series["values"])
+        for series in result["data"]
+    ] == [("humidity", "%", [3, 2, 1]), ("temperature", "C", [9, 8, 7])]
+    assert len(result["data"][0]["timestamps"]) == 3
+
+    resp = client.post("/query/batch", json=[{"query": q}, {"query": q + "."}])
+    assert [r["data"] for r in resp.json()] == [result["data"]] * 2
+
+    resp = client.get("/query", params={"query": "max temperature sensor1"})
+    assert "bucket" not in resp.json()["meta"]
+
+    resp = client.get("/query", params={"query": "max temperature sensor1 hourly"})
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "date",
+    ["foo", "2012.13.01", "2024-02-30", "99999999999999999999", "9999-12-31T23:59:30"],
+)
+def test_query_invalid_date(env, client, date):
+    q = f"max temperature sensor1 since {date}"
+    resp = client.get("/query", params={"query": q})
+    assert resp.status_code == 400
+    assert resp.json()["detail"] == f"Invalid date: {date}"
+
+    resp = client.post("/query/batch", json=[{"query": q}])
+    assert resp.status_code == 400
+    resp = client.get("/series", params={"query": f"temperature sensor1 since {date}"})
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("parse_threads", ["0", "2"])
+def test_query_limits(seeded, parse_threads):
+    env_vars = {
+        "ABCDE_PARSE_THREADS": parse_threads,
+        "ABCDE_MAX_QUERY_TOKENS": "20",
+        "ABCDE_MAX_BATCH_QUERIES": "3",
+    }
+    with mock.patch.dict(os.environ, env_vars), TestClient(app) as client:
+        q = "max temperature sensor1"
+        assert client.get("/query", params={"query": q}).status_code == 200
+        resp = client.post("/query/batch", json=[{"query": q}])
+        assert resp.json()[0]["data"][0]["sensor"] == "sensor1"
+
+        long_query = " ".join([q] * 7)
+        resp = client.get("/query", params={"query": long_query})
+        assert resp.status_code == 400
+        assert resp.json()["detail"] == "The query has more than 20 words"
+        resp = client.get("/query", params={"query": "x" * 1001})
+        assert resp.status_code == 400
+        resp = client.post("/query/batch", json=[{"query": q}, {"query": long_query}])
+        assert resp.status_code == 400
+        resp = client.get("/series", params={"query": long_query})
+        assert resp.status_code == 400
+
+        resp = client.post("/query/batch", json=[{"query": q}] * 3)
+        assert resp.status_code == 200
+        resp = client.post("/query/batch", json=[{"query": q}] * 4)
+        assert resp.status_code == 400
+        assert resp.json()["detail"] == "The batch has more than 3 queries"
+
+
+def test_query_response_models(seeded, client):
+    # the responses are serialized without the models, they have to be the
+    # same as the serialized models
+    result = TypeAdapter(models.SensorMetricResult | models.SensorMetricSeriesResult)
+    queries = [
+        "min temperature sensor1",
+        "average temperature, humidity all sensors since 2012.01.01",
+        "max humidity sensor2 daily last 3 weeks",
+    ]
+    for q in queries:
+        resp = client.get("/query", params={"query": q})
+        model = result.validate_json(resp.content)
+        assert resp.content == result.dump_json(model, exclude_unset=True)
+
+    batch = TypeAdapter(
+        list[models.SensorMetricResult | models.SensorMetricSeriesResult]
+    )
+    resp = client.post("/query/batch", json=[{"query": q} for q in queries])
+    model = batch.validate_json(resp.content)
+    assert resp.content == batch.dump_json(model, exclude_unset=True)
+
+    schema = client.get("/openapi.json").json()["paths"]["/query"]["get"]
+    refs = schema["responses"]["200"]["content"]["application/json"]["schema"]
+    assert {"$ref": "#/components/schemas/SensorMetricResult"} in refs["anyOf"]
@@ -0,0 +1,296 @@
+"""test caches"""
+
+import asyncio
+import datetime
+import threading
+
+import pytest
+
+from abcde.cache import LRUCache, ResultCache, SharedGeneration
+from abcde.language_parser import ReTag, Tagger
+from abcde.query_parser import (
+    PARSE_CACHE,
+    QUERY_LIMITS,
+    STMT_CACHE,
+    TAGGER,
+    Query,
+    QueryBatch,
+    SeriesQuery,
+    add_names,
+)
+
+
+@pytest.fixture
+def parse_cache():
+    PARSE_CACHE.clear()
+    PARSE_CACHE.hits = PARSE_CACHE.misses = 0
+    yield PARSE_CACHE
+    PARSE_CACHE.clear()
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats() == {
+        "size": 2,
+        "maxsize": 2,
+        "hits": 2,
+        "misses": 2,
+        "hit_rate": 0.5,
+    }
+
+    assert cache.pop("c") == 3
+    cache.resize(0)
+    assert cache.stats()["size"] == 0
+    cache.put("d", 4)
+    assert cache.get("d") is None
+
+
+def test_lru_cache_threads():
+    cache = LRUCache(maxsize=8)
+    errors = []
+
+    def run(seed):
+        try:
+            for i in range(20000):
+                key = (i * seed) % 13
+                if cache.get(key) is None:
+                    cache.put(key, i)
+                if i % 97 == 0:
+                    cache.pop(key)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(seed,)) for seed in (1, 3, 5, 7)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(cache.data) <= 8
+
+
+def test_tagger_clear():
+    tagger = Tagger([ReTag("n", r"\d+")])
+    assert tagger.tag("1") == {tagger.eager[0][0]: ("n", "1")}
+    assert "1" in tagger.cache.data
+
+    # cleared by another thread while the word was tagged
+    tag = tagger.eager[0][1]
+    match = tag.match
+
+    def clearing_match(word):
+        tagger.clear()
+        return match(word)
+
+    tag.match = clearing_match
+    tagger.tag("2")
+    assert "2" not in tagger.cache.data
+
+
+def test_parse_cache_names_added(mocker, parse_cache):
+    extract = Query._extract
+
+    def extract_adding_names(self, words):
+        entry = extract(self, words)
+        add_names(["sensor-added-while-parsing"])
+        return entry
+
+    mocker.patch.object(Query, "_extract", extract_adding_names)
+    Query("max rain sensor1").parse()
+    assert parse_cache.stats()["size"] == 0
+    assert TAGGER.generation > 0
+
+
+def test_query_limits():
+    QUERY_LIMITS.configure(length=30, tokens=4, batch=2)
+    try:
+        assert Query("max rain sensor1 sensor2").parse()
+        assert len(QueryBatch(["max rain sensor1"] * 2).queries) == 2
+        with pytest.raises(ValueError, match="more than 2 queries"):
+            QueryBatch(["max rain sensor1"] * 3)
+        with pytest.raises(ValueError, match="longer than 30 characters"):
+            Query("max rain sensor1 since 2012.01.01").parse()
+        with pytest.raises(ValueError, match="more than 4 words"):
+            Query("max rain sensor1 sensor2 all").parse()
+        assert Query(" max  rain   sensor1  sensor2 ").parse()
+    finally:
+        QUERY_LIMITS.configure()
+
+
+def test_parse_cache(mocker, parse_cache):
+    dt_mock = mocker.patch("abcde.query_parser.datetime")
+    dt_mock.now.return_value = datetime.datetime(2025, 12, 1)
+
+    assert Query("min temperature sensor1 last 7 days").parse()["date"] == [
+        datetime.datetime(2025, 11, 24)
+    ]
+    assert parse_cache.stats()["misses"] == 1
+
+    # same words, relative date resolved against the current time
+    dt_mock.now.return_value = datetime.datetime(2025, 12, 2)
+    parser = Query("  min  temperature sensor1\tlast 7 days ")
+    assert parser.parse() == {
+        "date": [datetime.datetime(2025, 11, 25)],
+        "bucket": [],
+        "sensor": ["sensor1"],
+        "aggregation": ["min"],
+        "metric": ["temperature"],
+    }
+    assert parse_cache.stats()["hits"] == 1
+
+    # the statement template is shared, the window is bound per query
+    first = Query("min temperature sensor1 last 7 days").get_stmt()
+    dt_mock.now.return_value = datetime.datetime(2025, 12, 3)
+    second = Query("min temperature sensor1 last 7 days").get_stmt()
+    assert first.compile().params["since"] == datetime.datetime(2025, 11, 25)
+    assert second.compile().params["since"] == datetime.datetime(2025, 11, 26)
+    assert parse_cache.stats()["size"] == 1
+
+    with pytest.raises(ValueError):
+        Query("min for all sensro previos").parse()
+    assert parse_cache.stats()["size"] == 1
+
+
+def test_stmt_cache(mocker):
+    dt_mock = mocker.patch("abcde.query_parser.datetime")
+    dt_mock.now.return_value = datetime.datetime(2025, 12, 2)
+    STMT_CACHE.clear()
+
+    # the shape of the statement is shared, the names are parameters
+    first, params = Query("min temperature sensor1 last 7 days").statement()
+    second, other = Query("min humidity, rain sensor2 sensor3 last day").statement()
+    assert first is second
+    assert params["sensors"] == ["sensor1"]
+    assert other["sensors"] == ["sensor2", "sensor3"]
+    assert other["metrics"] == ["humidity", "rain"]
+    assert other["since"] == datetime.datetime(2025, 12, 1)
+
+    for text in (
+        "max temperature sensor1 last 7 days",
+        "min temperature all sensors last 7 days",
+        "min temperature sensor1 last 7 days hourly",
+        "min temperature sensor1",
+    ):
+        assert Query(text).statement()[0] is not first
+    stmt, params = Query("min temperature all sensors").statement()
+    assert "sensors" not in params
+    assert Query("min rain all sensors").statement()[0] is stmt
+
+    series, params = SeriesQuery("temperature sensor1 last 7 days").statement()
+    assert params["since"] == datetime.datetime(2025, 11, 25)
+    assert SeriesQuery("rain sensor2 last 3 days").statement()[0] is series
+    assert STMT_CACHE.stats()["size"] == 7
+
+
+def test_result_cache():
+    cache = ResultCache(maxsize=10)
+    parsed = {
+        "date": [],
+        "sensor": ["sensor2", "sensor1"],
+        "aggregation": ["min"],
+        "metric": ["temperature"],
+    }
+    key = cache.key(parsed)
+    assert key == (("sensor1", "sensor2"), ("temperature",), None, None, ())
+    assert cache.get(key) is None
+
+    cache.put(key, [{"value": 1}], cache.generation)
+    assert cache.get(key) == [{"value": 1}]
+
+    cache.invalidate({("sensor3", "temperature"), ("sensor1", "humidity")})
+    assert cache.get(key) == [{"value": 1}]
+    cache.invalidate({("sensor1", "temperature")})
+    assert cache.get(key) is None
+
+    all_key = cache.key({**parsed, "sensor": ["_all_"]})
+    cache.put(all_key, [], cache.generation)
+    cache.invalidate({("sensor9", "temperature")})
+    assert cache.get(all_key) is None
+    assert cache.stats()["invalidations"] == 2
+
+    # read before an invalidation, must not be stored
+    generation = cache.generation
+    cache.invalidate({("sensor1", "temperature")})
+    cache.put(key, [{"value": 1}], generation)
+    assert cache.get(key) is None
+
+    cache.put(key, [{"value": 1}], cache.generation)
+    cache.clear()
+    assert cache.get(key) is None
+    assert not cache.by_metric
+
+
+def test_result_cache_eviction():
+    cache = ResultCache(maxsize=1)
+    parsed = {"date": [], "sensor": ["sensor1"], "aggregation": ["min"]}
+    first = cache.key({**parsed, "metric": ["temperature"]})
+    second = cache.key({**parsed, "metric": ["humidity"]})
+    cache.put(first, [], cache.generation)
+    cache.put(second, [], cache.generation)
+    assert cache.get(first) is None
+    assert set(cache.by_metric) == {"humidity"}
+
+
+def test_result_cache_staleness(mocker):
+    cache = ResultCache(maxsize=10, max_staleness=60)
+    parsed = {
+        "date": [datetime.datetime(2025, 12, 1, 10, 0, 5)],
+        "sensor": ["sensor1"],
+        "aggregation": ["min"],
+        "metric": ["temperature"],
+    }
+    key = cache.key(parsed)
+    later = {**parsed, "date": [datetime.datetime(2025, 12, 1, 10, 0, 55)]}
+    assert cache.key(later) == key
+
+    monotonic = mocker.patch("abcde.cache.time.monotonic")
+    monotonic.return_value = 100
+    cache.put(key, [], cache.generation)
+    monotonic.return_value = 150
+    assert cache.get(key) == []
+    monotonic.return_value = 161
+    assert cache.get(key) is None
+    assert not cache.by_metric
+
+
+def test_parse_cache_required(parse_cache):
+    SeriesQuery("temperature sensor1").parse()
+    assert parse_cache.stats()["size"] == 1
+    with pytest.raises(ValueError, match="Missing: aggregation"):
+        Query("temperature sensor1").parse()
+
+
+def test_shared_generation(mocker):
+    missed = []
+    generation = SharedGeneration(sync_ms=1000, on_missed=lambda: missed.append(1))
+    session = mocker.AsyncMock()
+    session.scalar.return_value = None
+
+    asyncio.run(generation.sync(session))
+    assert generation.value == 0
+    generation.observe(1, own=1)
+    generation.observe(1)
+    assert not missed
+
+    # a write of another process
+    generation.observe(3, own=1)
+    assert missed == [1]
+    assert generation.value == 3
+
+    # the counter is read once per sync_ms
+    session.scalar.return_value = 5
+    asyncio.run(generation.sync(session))
+    assert generation.stats() == {"generation": 3, "syncs": 1, "missed": 1}
+
+    cache = ResultCache(10, shared=generation)
+    cache.put("key", [], cache.generation)
+    generation.observe(7)
+    assert cache.get("key") is None
+    assert cache.stats()["shared"]["missed"] == 2
@@ -0,0 +1,139 @@
+"""test hot tier"""
+
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from abcde.hot_tier import HotTier, Series, to_us
+from abcde.main import app
+from abcde.models import SensorInput
+from abcde.query_parser import Query
+
+QUERIES = [
+    "min temperature sensor1",
+    "max temperature, humidity all sensors",
+    "average humidity all sensors last 10 days",
+    "sum temperature, humidity sensor1 sensor2 last 10 days",
+    "min temperature sensor2 sensor3 last 3 days",
+    "max temperature sensor1 since 2012.01.01",
+    "average temperature sensor1 daily last 3 days",
+]
+
+
+def parsed(text):
+    query = Query(text)
+    query.parse()
+    return query.parsed
+
+
+def test_series():
+    series = Series((1, 1), "C", capacity=4, covered_since=10)
+    series.extend(np.array([5, 10, 11]), np.array([1.0, 2.0, 3.0]))
+    assert series.size == 2
+    assert series.covered_since == 10
+    assert series.latest == (11, 3.0)
+    assert list(series.window(11)) == [3.0]
+
+    # 8 is not covered, the oldest value is overwritten
+    series.extend(np.array([12, 14, 13, 8]), np.array([4.0, 5.0, 6.0, 7.0]))
+    assert series.size == 4
+    assert series.covered_since == 11
+    assert series.latest == (14, 5.0)
+    assert sorted(series.window(12)) == [4.0, 5.0, 6.0]
+
+    # more values than the capacity
+    series.extend(np.arange(20, 26), np.arange(20, 26, dtype=np.float64))
+    assert series.covered_since == 22
+    assert sorted(series.window(0)) == [22.0, 23.0, 24.0, 25.0]
+
+
+def test_hot_tier_limits():
+    now = datetime(2025, 12, 1)
+    ids = SimpleNamespace(
+        sensors={"sensor1": 1, "sensor2": 2}, metrics={"rain": 1}, units={"rain": "mm"}
+    )
+    hot_tier = HotTier(points=2, max_series=1, window=3600)
+    rows = [
+        SensorInput(sensor=sensor, metric="rain", unit="mm", value=value)
+        for sensor, value in (("sensor1", 1), ("sensor2", 2), ("sensor1", 3))
+    ]
+    rows_at = now - timedelta(minutes=10)
+    hot_tier.add(rows, [rows_at, now, now], ids)
+    assert list(hot_tier.series) == [("sensor1", "rain")]
+    assert not hot_tier.complete
+
+    assert hot_tier.rows(parsed("sum rain sensor1 since 2012.01.01")) == [
+        {"sensor": "sensor1", "metric": "rain", "unit": "mm", "value": 4.0}
+    ]
+    assert hot_tier.rows(parsed("sum rain all sensors")) is None
+    assert hot_tier.rows(parsed("sum rain sensor2")) is None
+
+    hot_tier.add(rows[2:], [now + timedelta(minutes=1)], ids)
+    assert hot_tier.series["sensor1", "rain"].covered_since == to_us(rows_at) + 1
+    assert hot_tier.rows(parsed("sum rain sensor1 since 2012.01.01")) is None
+    assert hot_tier.stats() == {
+        "series": 1,
+        "max_series": 1,
+        "points": 2,
+        "bytes": 32,
+        "complete": False,
+        "hits": 1,
+        "misses": 3,
+        "hit_rate": 0.25,
+    }
+
+
+@pytest.mark.usefixtures("seeded")
+def test_hot_tier_api():
+    payload = {"sensor": "sensor3", "metric": "temperature", "unit": "C", "value": 2}
+
+    def answers(client):
+        assert client.post("/sensor", json=payload).status_code == 200
+        batch = client.post("/query/batch", json=[{"query": q} for q in QUERIES])
+        single = [client.get("/query", params={"query": q}).json() for q in QUERIES]
+        # the relative dates of meta differ
+        data = [result["data"] for result in single]
+        assert [result["data"] for result in batch.json()] == data
+        return data
+
+    # the second write of the same value does not change the answers
+    with TestClient(app) as client:
+        expected = answers(client)
+        assert client.get("/stats").json()["hot_tier"] is None
+
+    env_vars = {"ABCDE_HOT_TIER": "true", "ABCDE_HOT_TIER_WINDOW": "864000"}
+    with mock.patch.dict(os.environ, env_vars):
+        with TestClient(app) as client:
+            result = answers(client)
+            stats = client.get("/stats").json()["hot_tier"]
+
+    assert result == expected
+    assert stats["series"] == 5
+    assert stats["complete"]
+    # since 2012 and the bucketed query are read by SQL
+    assert stats["hits"] == 2 * 5
+    assert stats["misses"] == 2 * 2
+
+    env_vars = {"ABCDE_HOT_TIER": "true", "ABCDE_WORKERS": "2"}
+    with mock.patch.dict(os.environ, env_vars):
+        with TestClient(app) as client:
+            assert client.get("/stats").json()["hot_tier"] is None
+
+
+@pytest.mark.usefixtures("seeded")
+def test_hot_tier_unit():
+    # the unit of an existing metric is kept, the hot tier answers with it
+    payload = {"sensor": "sensor7", "metric": "temperature", "unit": "F", "value": 3}
+    with mock.patch.dict(os.environ, {"ABCDE_HOT_TIER": "true"}):
+        with TestClient(app) as client:
+            assert client.post("/sensor", json=payload).status_code == 200
+            resp = client.get("/query", params={"query": "min temperature sensor7"})
+            assert client.get("/stats").json()["hot_tier"]["hits"] == 1
+    assert resp.json()["data"] == [
+        {"sensor": "sensor7", "metric": "temperature", "unit": "C", "value": 3.0}
+    ]
@@ -0,0 +1,135 @@
+"""test language parser"""
+
+import random
+import string
+from datetime import datetime
+
+import pytest
+from dateutil import parser
+
+from abcde.language_parser import (
+    DATE_CACHE,
+    SimilarityMatcher,
+    SimilarityTag,
+    fast_date,
+    parse_date,
+)
+from abcde.query_parser import EXTRACT_PIPES
+
+
+def similarity_tags():
+    def walk(tags):
+        for tag in tags:
+            if isinstance(tag, SimilarityTag):
+                yield tag
+            elif hasattr(tag, "parts"):
+                yield from walk(tag.parts)
+
+    for pipes in EXTRACT_PIPES.values():
+        for pipe in pipes:
+            yield from walk(pipe[0])
+
+
+def reference_match(matcher, word):
+    for w in matcher.words:
+        if matcher.get_cosine_sim(w, word) >= matcher.similarity:
+            return word
+    return False
+
+
+def test_similarity_matches_reference():
+    rnd = random.Random(1)
+    words = ["", ".", "Temperature", "tempreature", "sensro", "dyas", "7", "ALL"]
+    for tag in similarity_tags():
+        for w in tag.matcher.words:
+            chars = list(w)
+            rnd.shuffle(chars)
+            words.extend([w, w.upper(), "".join(chars), w[:-1], w + "s"])
+    words.extend(
+        "".join(
+            rnd.choices(string.ascii_lowercase + "0123456789", k=rnd.randint(1, 12))
+        )
+        for _ in range(100)
+    )
+
+    for tag in similarity_tags():
+        matcher = SimilarityMatcher(tag.matcher.words, tag.matcher.similarity)
+        for word in words:
+            sims = matcher.get_cosine_sims(word)
+            assert list(sims) == [
+                matcher.get_cosine_sim(w, word) for w in matcher.words
+            ]
+            assert matcher.word_match(word) == reference_match(matcher, word)
+            # cached
+            assert matcher.word_match(word) == reference_match(matcher, word)
+
+
+@pytest.mark.parametrize(
+    "word,expected",
+    [("tempreature", "tempreature"), ("Temperature", "Temperature"), ("humid", False)],
+)
+def test_similarity_tag(word, expected):
+    tag = SimilarityTag("temperature", ["temperature"])
+    assert tag.matches(word) == expected
+    assert tag.matcher.cache.stats()["misses"] == 1
+
+
+@pytest.mark.parametrize(
+    "word",
+    [
+        "2012.01.01",
+        "2024-1-2",
+        "2024/01/02",
+        "2024-01-02T10:20",
+        "2024-01-02t10:20:30.5",
+        "02/01/2024",
+        "13.01.2024",
+        "1-2-2024",
+        "20240102",
+    ],
+)
+def test_fast_date(word):
+    assert fast_date(word) == parser.parse(word)
+
+
+def test_fast_date_matches_dateutil():
+    rnd = random.Random(3)
+    for _ in range(2000):
+        a, b = (str(rnd.randint(0, 35)).zfill(rnd.randint(1, 2)) for _ in "ab")
+        sep = rnd.choice("-./")
+        for word in (f"2024{sep}{a}{sep}{b}", f"{a}{sep}{b}{sep}1999"):
+            try:
+                expected = parser.parse(word)
+            except ValueError:
+                expected = None
+            assert fast_date(word) == expected, word
+
+
+def test_parse_date():
+    DATE_CACHE.clear()
+    hits = DATE_CACHE.hits
+    assert parse_date("2012.01.01") == parse_date("2012.01.01")
+    assert DATE_CACHE.hits == hits + 1
+    # dateutil fills the missing fields from the current date, not cached
+    assert parse_date("Jan 2012").year == 2012
+    assert "Jan 2012" not in DATE_CACHE.data
+
+    # dates with a timezone are naive UTC
+    assert parse_date("2024-01-02T10:20:30+02:00") == datetime(2024, 1, 2, 8, 20, 30)
+    assert parse_date("2024-01-02T10:20:30Z") == datetime(2024, 1, 2, 10, 20, 30)
+
+    # the window of the last day would end after datetime.max
+    assert parse_date("9999-12-30")
+    for word in (
+        "foo",
+        "2012.13.01",
+        "2024-02-30",
+        "9" * 20,
+        "since",
+        "9999-12-31",
+        "9999-12-31T23:59:30",
+        "Dec 31 9999",
+        "0001-01-01T00:00:00+01:00",
+    ):
+        with pytest.raises(ValueError, match="Invalid date"):
+            parse_date(word)
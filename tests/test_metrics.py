@@ -0,0 +1,115 @@
+"""test metrics"""
+
+import logging
+import os
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from abcde.main import app
+from abcde.metrics import TIMINGS, Histogram, span
+from abcde.query_parser import PARSE_CACHE
+
+
+def samples(text):
+    """metric line without the value -> value"""
+    lines = (line.rsplit(" ", 1) for line in text.splitlines() if line[0] != "#")
+    return {name: float(value) for name, value in lines}
+
+
+def test_histogram():
+    histogram = Histogram("h", "help", ("a",), buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.1, 0.5, 2):
+        histogram.observe(("x",), seconds)
+    assert histogram.render() == [
+        "# HELP h help",
+        "# TYPE h histogram",
+        'h_bucket{a="x",le="0.1"} 2',
+        'h_bucket{a="x",le="1.0"} 3',
+        'h_bucket{a="x",le="+Inf"} 4',
+        'h_sum{a="x"} 2.65',
+        'h_count{a="x"} 4',
+    ]
+
+
+def test_span():
+    with span("parse"):
+        pass
+    assert TIMINGS.get() is None
+
+    timings = {}
+    token = TIMINGS.set(timings)
+    for _ in range(2):
+        with span("parse"):
+            pass
+    TIMINGS.reset(token)
+    assert set(timings) == {"parse", "_last"}
+
+
+@pytest.mark.usefixtures("seeded")
+def test_metrics():
+    assert TestClient(app).get("/metrics").status_code == 404
+
+    env_vars = {"ABCDE_METRICS": "true", "ABCDE_RESULT_CACHE_SIZE": "10"}
+    with mock.patch.dict(os.environ, env_vars):
+        with TestClient(app) as client:
+            for _ in range(3):
+                resp = client.get("/query", params={"query": "min temperature sensor1"})
+                assert resp.status_code == 200
+            q = "max humidity sensor1 last 3 weeks"
+            assert client.get("/query", params={"query": q}).status_code == 200
+            assert client.get("/query", params={"query": "x"}).status_code == 400
+            payload = {"sensor": "sensor1", "metric": "rain", "unit": "mm", "value": 1}
+            assert client.post("/sensor", json=payload).status_code == 200
+            assert client.get("/unknown").status_code == 404
+
+            resp = client.get("/metrics")
+            assert resp.status_code == 200
+            assert resp.headers["content-type"].startswith("text/plain")
+            metrics = samples(resp.text)
+
+    requests = "abcde_request_duration_seconds_count"
+    assert metrics[f'{requests}{{route="/query",method="GET",status="200"}}'] == 4
+    assert metrics[f'{requests}{{route="/query",method="GET",status="400"}}'] == 1
+    assert metrics[f'{requests}{{route="/sensor",method="POST",status="200"}}'] == 1
+    assert metrics[f'{requests}{{route="unmatched",method="GET",status="404"}}'] == 1
+
+    stages = "abcde_stage_duration_seconds_count"
+    # the failed query is parsed and its error response serialized
+    for stage in ("parse", "serialize"):
+        assert metrics[f'{stages}{{route="/query",stage="{stage}"}}'] == 5
+    for stage in ("cache", "build"):
+        assert metrics[f'{stages}{{route="/query",stage="{stage}"}}'] == 4
+    # the cache hits do not reach the database
+    for stage in ("compile", "db", "fetch"):
+        assert metrics[f'{stages}{{route="/query",stage="{stage}"}}'] == 2
+    for stage in ("write", "db"):
+        assert metrics[f'{stages}{{route="/sensor",stage="{stage}"}}'] == 1
+
+    pool = "abcde_db_pool_connections"
+    assert metrics[f'{pool}{{engine="write",state="checked_out"}}'] == 0
+    assert metrics["abcde_parse_cache_hits_total"] == PARSE_CACHE.hits
+    assert metrics["abcde_result_cache_hits_total"] == 2
+    assert metrics["abcde_result_cache_size"] == 2
+
+
+@pytest.mark.usefixtures("seeded")
+def test_slow_query_log(caplog):
+    q = "average temperature sensor1 last 3 weeks"
+    with mock.patch.dict(os.environ, {"ABCDE_SLOW_QUERY_MS": "100000"}):
+        with TestClient(app) as client:
+            with caplog.at_level(logging.WARNING, logger="abcde.slow_query"):
+                client.get("/query", params={"query": q})
+            assert not caplog.records
+
+    with mock.patch.dict(os.environ, {"ABCDE_SLOW_QUERY_MS": "0.001"}):
+        with TestClient(app) as client:
+            with caplog.at_level(logging.WARNING, logger="abcde.slow_query"):
+                client.get("/query", params={"query": q})
+    (record,) = caplog.records
+    message = record.getMessage()
+    assert q in message
+    assert "'metric': ['temperature']" in message
+    assert "FROM sensor_rollups" in message
+    assert "'sensors': ['sensor1']" in message
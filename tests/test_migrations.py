@@ -0,0 +1,135 @@
+"""test alembic migrations"""
+
+import datetime
+import os
+
+from alembic import command
+from alembic.config import Config as AlembicConfig
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, inspect, text
+
+from abcde.main import app
+from abcde.storage import run_migrations
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_migrations(env):
+    url = env["ABCDE_DB_URL"]
+    config = AlembicConfig(os.path.join(ROOT, "alembic.ini"))
+    command.upgrade(config, "0002")
+
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO sensors (name) VALUES ('sensor1')"))
+        conn.execute(
+            text("INSERT INTO sensor_metrics (name, unit) VALUES ('rain', 'mm')")
+        )
+        conn.execute(
+            text(
+                "INSERT INTO sensor_values "
+                "(timestamp, value, sensor_id, metric_id) VALUES "
+                "('2025-01-01 00:00:00.000000', 1, 1, 1), "
+                "('2025-01-03 00:00:00.000000', 3, 1, 1), "
+                "('2025-01-02 00:00:00.000000', 2, 1, 1)"
+            )
+        )
+
+    command.upgrade(config, "head")
+    # raises if the models and the migrations differ
+    command.check(config)
+
+    with engine.connect() as conn:
+        latest = conn.execute(text("SELECT * FROM sensor_latest")).all()
+    assert latest == [(1, 1, "2025-01-03 00:00:00.000000", 3.0)]
+
+    with engine.connect() as conn:
+        rollups = conn.execute(
+            text(
+                "SELECT resolution, bucket_start, count, sum, min, max "
+                "FROM sensor_rollups ORDER BY resolution, bucket_start"
+            )
+        ).all()
+    assert rollups == [
+        ("day", "2025-01-01 00:00:00.000000", 1, 1.0, 1.0, 1.0),
+        ("day", "2025-01-02 00:00:00.000000", 1, 2.0, 2.0, 2.0),
+        ("day", "2025-01-03 00:00:00.000000", 1, 3.0, 3.0, 3.0),
+        ("hour", "2025-01-01 00:00:00.000000", 1, 1.0, 1.0, 1.0),
+        ("hour", "2025-01-02 00:00:00.000000", 1, 2.0, 2.0, 2.0),
+        ("hour", "2025-01-03 00:00:00.000000", 1, 3.0, 3.0, 3.0),
+        ("minute", "2025-01-01 00:00:00.000000", 1, 1.0, 1.0, 1.0),
+        ("minute", "2025-01-02 00:00:00.000000", 1, 2.0, 2.0, 2.0),
+        ("minute", "2025-01-03 00:00:00.000000", 1, 3.0, 3.0, 3.0),
+    ]
+
+    indexes = [i["name"] for i in inspect(engine).get_indexes("sensor_values")]
+    assert "ix_sensor_values_sensor_metric_timestamp" in indexes
+
+    command.downgrade(config, "base")
+    assert "sensor_values" not in inspect(engine).get_table_names()
+    engine.dispose()
+
+
+def test_upgrade_on_startup(backend, db_url):
+    # a database created before the migrations, with the initial schema
+    timestamps = ["2025-01-01", "2025-01-03", "2025-01-02"]
+    engine = create_engine(db_url)
+    with engine.begin() as conn:
+        run_migrations(conn, "upgrade", "0001")
+        conn.execute(text("DROP TABLE alembic_version"))
+        conn.execute(text("INSERT INTO sensors (name) VALUES ('sensor1')"))
+        conn.execute(
+            text("INSERT INTO sensor_metrics (name, unit) VALUES ('rain', 'mm')")
+        )
+        backend.prepare_insert(
+            conn, [datetime.datetime.fromisoformat(ts) for ts in timestamps]
+        )
+        conn.execute(
+            text(
+                "INSERT INTO sensor_values "
+                "(timestamp, value, sensor_id, metric_id) VALUES "
+                + ", ".join(
+                    f"('{ts} 00:00:00.000000', {value}, 1, 1)"
+                    for value, ts in enumerate(timestamps, 1)
+                )
+            )
+        )
+
+    with TestClient(app) as client:
+        latest = client.get("/query", params={"query": "min rain sensor1"}).json()
+        q = "max rain sensor1 since 2025-01-01T12:00"
+        window = client.get("/query", params={"query": q}).json()
+    # a second start finds the schema up to date
+    with TestClient(app):
+        pass
+    assert latest["data"] == [
+        {"sensor": "sensor1", "metric": "rain", "unit": "mm", "value": 2.0}
+    ]
+    assert window["data"] == [
+        {"sensor": "sensor1", "metric": "rain", "unit": "mm", "value": 3.0}
+    ]
+
+    with engine.connect() as conn:
+        version = conn.execute(text("SELECT version_num FROM alembic_version"))
+        assert version.scalar_one() == "0005"
+        rollups = conn.execute(
+            text("SELECT count(*) FROM sensor_rollups WHERE resolution = 'day'")
+        )
+        assert rollups.scalar_one() == 3
+    indexes = [i["name"] for i in inspect(engine).get_indexes("sensor_values")]
+    assert "ix_sensor_values_sensor_metric_timestamp" in indexes
+
+    with engine.begin() as conn:
+        run_migrations(conn, "downgrade", "base")
+    assert "sensor_values" not in inspect(engine).get_table_names()
+    engine.dispose()
+
+
+def test_new_database_stamped(env):
+    with TestClient(app):
+        pass
+    engine = create_engine(env["ABCDE_DB_URL"])
+    with engine.connect() as conn:
+        version = conn.execute(text("SELECT version_num FROM alembic_version"))
+        assert version.scalar_one() == "0005"
+    engine.dispose()
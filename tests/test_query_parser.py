@@ -1,11 +1,13 @@
 """test api"""
 
 import datetime
+import random
 
 import pytest
+from sqlalchemy import text
 from sqlmodel import Session
 
-from abcde.query_parser import Query
+from abcde.query_parser import EXTRACT_PIPES, PARSE_CACHE, Query, QueryBatch
 from abcde.models import SensorMetric
 
 
@@ -19,6 +21,7 @@ def test_parse(mocker, dt_now):
     result = parser.parse()
     assert result == {
         "date": [datetime.datetime(2025, 11, 24, 0, 0)],
+        "bucket": [],
         "sensor": ["sensor1"],
         "aggregation": ["average"],
         "metric": ["temperature", "humidity"],
@@ -28,6 +31,7 @@ def test_parse(mocker, dt_now):
     result = parser.parse()
     assert result == {
         "date": [datetime.datetime(2025, 11, 24, 0, 0)],
+        "bucket": [],
         "sensor": ["sensor1", "sensor2"],
         "aggregation": ["min"],
         "metric": ["temperature"],
@@ -37,6 +41,7 @@ def test_parse(mocker, dt_now):
     result = parser.parse()
     assert result == {
         "date": [],
+        "bucket": [],
         "sensor": ["sensor1", "sensor2"],
         "aggregation": ["min"],
         "metric": ["temperature"],
@@ -46,6 +51,7 @@ def test_parse(mocker, dt_now):
     result = parser.parse()
     assert result == {
         "date": [],
+        "bucket": [],
         "sensor": ["sensor1"],
         "aggregation": ["min"],
         "metric": ["temperature"],
@@ -55,6 +61,7 @@ def test_parse(mocker, dt_now):
     result = parser.parse()
     assert result == {
         "date": [datetime.datetime(2012, 1, 1, 0, 0)],
+        "bucket": [],
         "sensor": ["sensor1"],
         "aggregation": ["min"],
         "metric": ["temperature"],
@@ -69,6 +76,7 @@ def test_parse_similar(mocker, dt_now):
     result = parser.parse()
     assert result == {
         "date": [datetime.datetime(2025, 11, 24, 0, 0)],
+        "bucket": [],
         "sensor": ["_all_"],
         "aggregation": ["min"],
         "metric": ["temperature"],
@@ -82,6 +90,9 @@ def test_parse_raise():
         parser.parse()
     assert "Missing: metric" in str(excinfo.value)
 
+    with pytest.raises(ValueError, match="Invalid date: last 99999999 days"):
+        Query("min temperature sensor1 last 99999999 days").parse()
+
 
 def test_query(mocker, engine, test_data, dt_now):
     dt_mock = mocker.patch("abcde.query_parser.datetime")
@@ -146,8 +157,123 @@ def test_query_latest(mocker, engine, test_data, dt_now):
         ]
 
 
+@pytest.mark.parametrize(
+    "query",
+    [
+        "min temperature sensor1 last 7 days",
+        "min temperature all sensors last 7 days",
+    ],
+)
+def test_query_plan(engine, query):
+    stmt = Query(query).get_stmt()
+    compiled = stmt.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        plan = [row[3] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+
+    assert "SCAN sensor_values" not in plan
+    assert not any(step.startswith("SCAN sensor_rollups") for step in plan)
+    assert any(
+        "sensor_values USING COVERING INDEX ix_sensor_values_sensor_metric_timestamp"
+        in step
+        for step in plan
+    )
+
+
+def test_query_plan_latest(engine):
+    stmt = Query("min temperature sensor1").get_stmt()
+    compiled = stmt.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        plan = [row[3] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+
+    assert not any("sensor_values" in step for step in plan)
+    assert any(step.startswith("SEARCH sensor_latest") for step in plan)
+
+
 def build_results(result):
     results = []
     for res in result.mappings().all():
         results.append(SensorMetric(**res))
     return results
+
+
+def reference_extract(text):
+    """The pipe by pipe scan Query.parse used before the tag lattice."""
+
+    def check_match(pipe, words, index):
+        tags = []
+        for i, p in enumerate(pipe):
+            idx = index + i
+            if idx >= len(words):
+                return False, []
+            word = words[idx].strip(".,")
+            if m := p.matches(word):
+                tags.append((p.tag_name(), m))
+            else:
+                return False, []
+        return True, tags
+
+    matches = {key: [] for key in EXTRACT_PIPES}
+    words = text.split()
+    for index in range(len(words)):
+        for type_, pipes in EXTRACT_PIPES.items():
+            for pipe in pipes:
+                m, tags = check_match(pipe[0], words, index)
+                if m:
+                    matches[type_].append(pipe[1](*tags))
+                    break
+    return matches
+
+
+def test_parse_matches_reference(mocker, dt_now):
+    dt_mock = mocker.patch("abcde.query_parser.datetime")
+    dt_mock.now.return_value = dt_now
+    PARSE_CACHE.clear()
+
+    vocabulary = (
+        "give me the min max sum average avrage temperature tempreature humidity "
+        "rain wind for sensor sensro sensors all sensor1 sensor12 1 2 7 in last "
+        "past previous previosu week weeks day dyas hours minute months second "
+        "since 2012.01.01 and, temperature. 3 sensor. all. last. per every hourly "
+        "daily 0"
+    ).split()
+    rnd = random.Random(7)
+    for _ in range(300):
+        text = " ".join(rnd.choices(vocabulary, k=rnd.randint(1, 25)))
+        try:
+            expected = reference_extract(text)
+        except ValueError as e:
+            # "since" followed by something which is not a date
+            with pytest.raises(type(e)):
+                Query(text).parse()
+            continue
+        missing = [k for k, v in expected.items() if v == [] and k in Query.required]
+        if missing or (expected["bucket"] and not expected["date"]):
+            with pytest.raises(ValueError):
+                Query(text).parse()
+        else:
+            assert Query(text).parse() == expected
+
+
+def test_query_batch_groups():
+    batch = QueryBatch(
+        [
+            "min temperature sensor1",
+            "max humidity sensor2 last 7 days",
+            "min humidity sensor2",
+            "max rain all sensors last 7 days",
+            "min rain sensor2 last 7 days",
+            "max rain sensor2 last week",
+        ]
+    )
+    batch.parse()
+    groups = [indexes for _, _, indexes in batch.get_stmts()]
+    assert groups == [[0, 2], [1, 3], [4], [5]]
+    assert [indexes for _, _, indexes in batch.get_stmts([2, 4])] == [[2], [4]]
+
+    rows = [
+        {"sensor": "sensor1", "metric": "humidity"},
+        {"sensor": "sensor2", "metric": "humidity"},
+        {"sensor": "sensor2", "metric": "rain"},
+    ]
+    assert batch.queries[1].select_rows(rows) == rows[1:2]
+    assert batch.queries[3].select_rows(rows) == rows[2:]
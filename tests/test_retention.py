@@ -0,0 +1,210 @@
+"""test retention and compaction"""
+
+import asyncio
+import datetime
+import os
+import time
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from abcde.hot_tier import HotTier
+from abcde.ingest import insert_values
+from abcde.main import app
+from abcde.models import SensorInput
+from abcde.query_parser import Query
+from abcde.retention import RETENTION, Compactor, RetentionPolicy
+from abcde.sql_models import SensorRollup, SensorValue, bucket_floor
+from abcde.seed import get_engine
+from abcde.utils import create_db_and_tables, get_async_engine
+
+HOUR = 3600
+
+
+@pytest.fixture(autouse=True)
+def retention():
+    yield
+    RETENTION.configure()
+
+
+def test_retention_policy():
+    with pytest.raises(ValueError):
+        RetentionPolicy(raw=60, minute=30)
+    with pytest.raises(ValueError):
+        RetentionPolicy(minute=30)
+
+    now = datetime.datetime(2025, 12, 1, 12)
+    policy = RetentionPolicy(raw=HOUR, minute=24 * HOUR)
+    assert policy.cutoff("raw", now) == datetime.datetime(2025, 12, 1, 11)
+    assert policy.cutoff("hour", now) is None
+
+    since = datetime.datetime(2025, 12, 1, 11, 30, 15)
+    assert policy.window_start(since, now) == since
+    since = datetime.datetime(2025, 12, 1, 10, 30, 15)
+    assert policy.window_start(since, now) == datetime.datetime(2025, 12, 1, 10, 30)
+    since = datetime.datetime(2025, 11, 20, 10, 30, 15)
+    assert policy.window_start(since, now) == datetime.datetime(2025, 11, 20, 10)
+
+    policy = RetentionPolicy(raw=HOUR, minute=HOUR, hour=HOUR, day=HOUR)
+    assert policy.window_start(since, now) == since
+
+
+def test_hot_tier_retention():
+    hot_tier = HotTier(points=10, max_series=10, window=HOUR)
+    query = Query("max rain sensor1 last 2 hours")
+    query.parse()
+    assert hot_tier.rows(query.parsed) == []
+    RETENTION.configure(raw=HOUR)
+    try:
+        assert hot_tier.rows(query.parsed) is None
+    finally:
+        RETENTION.configure()
+
+
+def test_compaction(backend):
+    now = datetime.datetime.now()
+    values = []
+    # 10 days of values every 7 minutes, and some of 70 days ago
+    for minutes in [*range(0, 10 * 24 * 60, 7), *range(70 * 24 * 60, 71 * 24 * 60)]:
+        for sensor in ("sensor1", "sensor2"):
+            for metric, unit in (("temperature", "C"), ("rain", "mm")):
+                values.append(
+                    (
+                        SensorInput(
+                            sensor=sensor,
+                            metric=metric,
+                            unit=unit,
+                            value=(minutes % 97) / 4,
+                        ),
+                        now - datetime.timedelta(minutes=minutes),
+                    )
+                )
+    deleted_callbacks = []
+
+    async def on_deleted(session):
+        deleted_callbacks.append(session)
+
+    compactor = Compactor(
+        RETENTION,
+        lambda: AsyncSession(get_async_engine()),
+        interval=1,
+        batch_size=50,
+        on_deleted=on_deleted,
+    )
+
+    async def run():
+        await create_db_and_tables()
+        async with AsyncSession(get_async_engine()) as session:
+            await insert_values(
+                session, [row for row, _ in values], [ts for _, ts in values]
+            )
+        RETENTION.configure(raw=48 * HOUR, minute=96 * HOUR, hour=168 * HOUR)
+        deleted = await compactor.compact(now)
+        assert await compactor.compact(now) == 0
+        return deleted
+
+    assert asyncio.run(run()) > 0
+    assert len(deleted_callbacks) == 1
+    stats = compactor.stats()
+    assert stats["runs"] == 2
+    assert stats["partitions_dropped"] == (1 if backend.partitioned else 0)
+
+    engine = get_engine()
+    with engine.connect() as connection:
+        oldest = connection.scalar(select(func.min(SensorValue.timestamp)))
+        assert oldest >= now - datetime.timedelta(hours=48)
+        for resolution, hours in (("minute", 96), ("hour", 168), ("day", None)):
+            oldest = connection.scalar(
+                select(func.min(SensorRollup.bucket_start)).where(
+                    SensorRollup.resolution == resolution
+                )
+            )
+            if hours:
+                cutoff = now - datetime.timedelta(hours=hours)
+                # a value every 7 minutes
+                assert bucket_floor(cutoff, resolution) <= oldest
+                assert oldest < cutoff + datetime.timedelta(minutes=7)
+            else:
+                assert oldest == bucket_floor(values[-1][1], "day")
+
+        # the windows start at the bucket of the finest kept tier
+        for hours in (1, 30, 60, 100, 200, 300):
+            for aggregation in ("min", "max", "sum"):
+                query = Query(f"{aggregation} rain sensor1 last {hours} hours")
+                stmt = query.get_stmt()
+                start = RETENTION.window_start(query.parsed["date"][0])
+                window = [
+                    row.value
+                    for row, timestamp in values
+                    if timestamp >= start
+                    and row.sensor == "sensor1"
+                    and row.metric == "rain"
+                ]
+                expected = {"min": min, "max": max, "sum": sum}[aggregation](window)
+                (row,) = connection.execute(stmt).mappings().all()
+                assert row["value"] == pytest.approx(expected)
+
+
+@pytest.mark.usefixtures("backend")
+def test_compaction_api():
+    async def write_old():
+        await create_db_and_tables()
+        async with AsyncSession(get_async_engine()) as session:
+            await insert_values(session, [SensorInput(**payload)], [old])
+
+    old = datetime.datetime.now() - datetime.timedelta(minutes=5)
+    payload = {"sensor": "sensor1", "metric": "rain", "unit": "mm", "value": 1}
+    asyncio.run(write_old())
+    get_async_engine.cache_clear()
+
+    env_vars = {
+        "ABCDE_RETENTION_RAW": "60",
+        "ABCDE_RETENTION_INTERVAL": "0.01",
+        "ABCDE_RESULT_CACHE_SIZE": "10",
+        "ABCDE_WORKERS": "2",
+    }
+    with mock.patch.dict(os.environ, env_vars):
+        with TestClient(app) as client:
+            assert client.post("/sensor", json=payload).status_code == 200
+            for _ in range(100):
+                stats = client.get("/stats").json()
+                if stats["compaction"]["runs"] > 1:
+                    break
+                time.sleep(0.01)
+    assert stats["compaction"]["retention"]["raw"] == 60
+    assert stats["compaction"]["errors"] == 0
+    assert stats["compaction"]["rows_deleted"] == 1
+    # the write and the deletion
+    assert stats["result_cache"]["shared"]["generation"] == 2
+    assert RETENTION.seconds["raw"] == 0
+
+
+@pytest.mark.usefixtures("seeded")
+@pytest.mark.parametrize(
+    "date, naive",
+    [
+        ("2024-01-02T10:20:30Z", "2024-01-02T10:20:30"),
+        ("2024-01-02T10:20:30+02:00", "2024-01-02T08:20:30"),
+    ],
+)
+def test_retention_timezone(date, naive):
+    # dates with a timezone are compared with the cutoffs as naive UTC
+    env_vars = {"ABCDE_RETENTION_RAW": str(30 * 24 * HOUR), "ABCDE_HOT_TIER": "true"}
+    with mock.patch.dict(os.environ, env_vars):
+        with TestClient(app) as client:
+            results = []
+            for since in (date, naive):
+                q = f"max temperature sensor1 since {since}"
+                resp = client.get("/query", params={"query": q})
+                assert resp.status_code == 200
+                results.append(resp.json())
+                resp = client.post("/query/batch", json=[{"query": q}])
+                assert resp.status_code == 200
+    assert results[0] == results[1]
+    assert results[0]["data"] == [
+        {"sensor": "sensor1", "metric": "temperature", "unit": "C", "value": 9.0}
+    ]
+    assert results[0]["meta"]["date"] == naive
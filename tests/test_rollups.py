@@ -0,0 +1,227 @@
+"""test rollup based aggregation"""
+
+import datetime
+import random
+
+import pytest
+from sqlalchemy import create_engine, func, literal, literal_column, select
+from sqlalchemy.dialects import postgresql
+from sqlmodel import Session
+
+from abcde.query_parser import Query
+from abcde.sql_models import (
+    Base,
+    Sensor,
+    SensorMetric,
+    SensorRollup,
+    SensorValue,
+    bucket_ceil,
+    bucket_floor,
+    epoch_bucket,
+    rollup_rows,
+    rollup_upsert,
+)
+
+AGGREGATIONS = {
+    "min": func.min,
+    "max": func.max,
+    "sum": func.sum,
+    "average": func.avg,
+}
+
+
+@pytest.fixture(scope="module")
+def random_data():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+
+    rnd = random.Random(42)
+    dt_now = datetime.datetime(2025, 12, 1)
+    with Session(engine) as session:
+        session.add_all([Sensor(name=f"sensor{i}") for i in range(1, 4)])
+        session.add_all(
+            [
+                SensorMetric(name="temperature", unit="C"),
+                SensorMetric(name="humidity", unit="%"),
+            ]
+        )
+        session.commit()
+
+        # written in chunks like the batch ingest does, the rollups of the
+        # chunks are merged by the upsert
+        for _ in range(5):
+            values = [
+                {
+                    "sensor_id": rnd.randint(1, 3),
+                    "metric_id": rnd.randint(1, 2),
+                    # quarter values, the sums are exact in floating point
+                    "value": rnd.randint(-400, 400) / 4,
+                    "timestamp": dt_now
+                    - datetime.timedelta(seconds=rnd.randint(0, 3 * 24 * 3600)),
+                }
+                for _ in range(100)
+            ]
+            session.execute(SensorValue.__table__.insert(), values)
+            session.execute(rollup_upsert(engine.dialect), rollup_rows(values))
+        session.commit()
+
+    yield engine
+    engine.dispose()
+
+
+def raw_results(session, aggregation, since, sensors, metrics):
+    stmt = (
+        select(
+            Sensor.name,
+            SensorMetric.name,
+            SensorMetric.unit,
+            AGGREGATIONS[aggregation](SensorValue.value),
+        )
+        .join(SensorValue, Sensor.id == SensorValue.sensor_id)
+        .join(SensorMetric, SensorMetric.id == SensorValue.metric_id)
+        .where(SensorValue.timestamp >= since, SensorMetric.name.in_(metrics))
+        .group_by(Sensor.name, SensorMetric.name)
+        .order_by(Sensor.name, SensorMetric.name)
+    )
+    if sensors:
+        stmt = stmt.where(Sensor.name.in_(sensors))
+    return [tuple(row) for row in session.execute(stmt)]
+
+
+@pytest.mark.parametrize("aggregation", list(AGGREGATIONS))
+@pytest.mark.parametrize(
+    "query,since,sensors",
+    [
+        (
+            "sensor1 temperature last 2 days",
+            datetime.datetime(2025, 11, 29),
+            ["sensor1"],
+        ),
+        ("all sensors humidity last hour", datetime.datetime(2025, 11, 30, 23), None),
+        (
+            "sensor1 sensor2 temperature humidity since 2025.11.29",
+            datetime.datetime(2025, 11, 29),
+            ["sensor1", "sensor2"],
+        ),
+        (
+            "all sensors temperature last 1000 minutes",
+            datetime.datetime(2025, 11, 30, 7, 20),
+            None,
+        ),
+    ],
+)
+def test_rollup_matches_raw(mocker, random_data, query, since, sensors, aggregation):
+    dt_mock = mocker.patch("abcde.query_parser.datetime")
+    dt_mock.now.return_value = datetime.datetime(2025, 12, 1)
+
+    parser = Query(f"{aggregation} {query}")
+    with Session(random_data) as session:
+        result = [tuple(row) for row in session.execute(parser.get_stmt())]
+        assert parser.parsed["date"] == [since]
+        assert result
+        assert result == raw_results(
+            session, aggregation, since, sensors, parser.parsed["metric"]
+        )
+
+
+def test_rollup_partial_edges(mocker, random_data):
+    dt_mock = mocker.patch("abcde.query_parser.datetime")
+    dt_mock.now.return_value = datetime.datetime(2025, 11, 30, 13, 27, 41, 500)
+
+    for n in (1, 59, 61, 1439, 1441, 2000):
+        parser = Query(f"average all sensors temperature last {n} minutes")
+        with Session(random_data) as session:
+            result = [tuple(row) for row in session.execute(parser.get_stmt())]
+            assert result == raw_results(
+                session, "average", parser.parsed["date"][0], None, ["temperature"]
+            )
+
+
+def raw_bucket_results(session, aggregation, since, seconds, metrics):
+    epoch = datetime.datetime(1970, 1, 1)
+    stmt = (
+        select(Sensor.name, SensorMetric.name, SensorValue.timestamp, SensorValue.value)
+        .join(SensorValue, Sensor.id == SensorValue.sensor_id)
+        .join(SensorMetric, SensorMetric.id == SensorValue.metric_id)
+        .where(SensorValue.timestamp >= since, SensorMetric.name.in_(metrics))
+    )
+    buckets = {}
+    for sensor, metric, timestamp, value in session.execute(stmt):
+        offset = int((timestamp - epoch).total_seconds()) // seconds * seconds
+        start = epoch + datetime.timedelta(seconds=offset)
+        buckets.setdefault((sensor, metric, start), []).append(value)
+
+    aggregate = {
+        "min": min,
+        "max": max,
+        "sum": sum,
+        "average": lambda values: sum(values) / len(values),
+    }[aggregation]
+    return [key + (aggregate(values),) for key, values in sorted(buckets.items())]
+
+
+@pytest.mark.parametrize("aggregation", list(AGGREGATIONS))
+@pytest.mark.parametrize(
+    "bucket,seconds",
+    [
+        ("per 90 seconds", 90),
+        ("per 15 minutes", 900),
+        ("hourly", 3600),
+        ("every 5 hours", 18000),
+        ("daily", 86400),
+    ],
+)
+def test_bucket_matches_raw(mocker, random_data, bucket, seconds, aggregation):
+    dt_mock = mocker.patch("abcde.query_parser.datetime")
+    dt_mock.now.return_value = datetime.datetime(2025, 11, 30, 13, 27, 41, 500)
+
+    parser = Query(f"{aggregation} all sensors temperature last 2 days {bucket}")
+    with Session(random_data) as session:
+        result = [
+            (row.sensor, row.metric, row.timestamp, row.value)
+            for row in session.execute(parser.get_stmt())
+        ]
+        assert parser.parsed["bucket"] == [seconds]
+        assert len(result) > 3
+        assert result == raw_bucket_results(
+            session, aggregation, parser.parsed["date"][0], seconds, ["temperature"]
+        )
+
+
+def test_epoch_bucket(random_data):
+    ts = datetime.datetime(2025, 11, 30, 13, 59, 59, 999999)
+    with Session(random_data) as session:
+        for seconds, start in (
+            (60, datetime.datetime(2025, 11, 30, 13, 59)),
+            (3600, datetime.datetime(2025, 11, 30, 13)),
+            (7200, datetime.datetime(2025, 11, 30, 12)),
+        ):
+            bucket = epoch_bucket(literal(ts), literal_column(str(seconds)))
+            assert session.scalar(select(bucket)) == start
+
+    stmt = select(epoch_bucket(SensorValue.timestamp, literal_column("60")))
+    assert "to_timestamp" in str(stmt.compile(dialect=postgresql.dialect()))
+
+
+def test_rollup_counts(random_data):
+    with Session(random_data) as session:
+        for resolution in ("minute", "hour", "day"):
+            count = session.scalar(
+                select(func.sum(SensorRollup.count)).where(
+                    SensorRollup.resolution == resolution
+                )
+            )
+            assert count == 500
+
+
+def test_buckets():
+    ts = datetime.datetime(2025, 11, 30, 13, 27, 41, 500)
+    assert bucket_floor(ts, "minute") == datetime.datetime(2025, 11, 30, 13, 27)
+    assert bucket_floor(ts, "hour") == datetime.datetime(2025, 11, 30, 13)
+    assert bucket_floor(ts, "day") == datetime.datetime(2025, 11, 30)
+    assert bucket_ceil(ts, "minute") == datetime.datetime(2025, 11, 30, 13, 28)
+    assert bucket_ceil(ts, "day") == datetime.datetime(2025, 12, 1)
+    assert bucket_ceil(bucket_floor(ts, "hour"), "hour") == bucket_floor(ts, "hour")
+
+    with pytest.raises(ValueError):
+        bucket_floor(ts, "week")
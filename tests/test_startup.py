@@ -0,0 +1,24 @@
+"""test the modules imported at startup"""
+
+import subprocess
+import sys
+
+# only needed by the seed script, the write path or unusual date formats
+LAZY_MODULES = (
+    "abcde.seed",
+    "sqlmodel",
+    "dateutil.parser",
+    "dateutil.relativedelta",
+    "sqlalchemy.dialects.postgresql",
+)
+
+
+def test_lazy_imports():
+    code = (
+        "import sys, abcde.main\n"
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, check=True, text=True
+    )
+    assert result.stdout.strip() == ""
@@ -0,0 +1,196 @@
+"""test storage backends"""
+
+import datetime
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from abcde.ingest import insert_values
+from abcde.main import app
+from abcde.models import SensorInput
+from abcde.query_parser import SeriesQuery
+from abcde.storage import PostgresStorage, get_storage, get_url_storage
+from abcde.seed import _reset_engine, add_data, get_engine
+from abcde.utils import _reset_engines, get_async_engine, get_async_read_engine
+
+
+def write(rows, timestamps):
+    async def _write():
+        async with AsyncSession(get_async_engine()) as session:
+            await insert_values(session, rows, timestamps)
+
+    return _write
+
+
+def test_backend(backend):
+    add_data()
+
+    now = datetime.datetime.now()
+    old = now - datetime.timedelta(days=70)
+    rows = [
+        SensorInput(sensor="sensor3", metric="rain", unit="mm", value=value)
+        for value in (1, 2, 3)
+    ]
+    timestamps = [old, old + datetime.timedelta(days=1), now]
+
+    with TestClient(app) as client:
+        client.portal.call(write(rows, timestamps))
+
+        def query(q):
+            resp = client.get("/query", params={"query": q})
+            assert resp.status_code == 200
+            return resp.json()["data"]
+
+        assert query("min temperature sensor1") == [
+            {"sensor": "sensor1", "metric": "temperature", "unit": "C", "value": 7.0}
+        ]
+        assert [row["value"] for row in query("average humidity all sensors")] == [
+            1.0,
+            4.0,
+        ]
+        assert [
+            row["value"] for row in query("average humidity all sensors last 3 weeks")
+        ] == [2.0, 5.0]
+        since = old.strftime("%Y.%m.%d")
+        assert query(f"sum rain sensor3 since {since}")[0]["value"] == 6
+        assert query("sum rain sensor3 last 10 days")[0]["value"] == 3
+        assert query("max humidity sensor2 daily last 3 weeks")[0]["values"] == [
+            6,
+            5,
+            4,
+        ]
+
+        resp = client.get("/series", params={"query": f"rain sensor3 since {since}"})
+        assert len(resp.text.splitlines()) == 3
+
+    if backend.partitioned:
+        engine = get_engine()
+        with engine.connect() as conn:
+            partitions = conn.scalars(
+                text(
+                    "SELECT inhrelid::regclass::text FROM pg_inherits "
+                    "WHERE inhparent = 'sensor_values'::regclass"
+                )
+            ).all()
+            assert f"sensor_values_{old:%Y%m}" in partitions
+            assert f"sensor_values_{now:%Y%m}" in partitions
+
+            # the window of the query is pruned to the partition of the range
+            stmt = SeriesQuery("rain sensor3 last 1 hours").get_stmt()
+            compiled = stmt.compile(
+                dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+            )
+            plan = "\n".join(conn.scalars(text(f"EXPLAIN {compiled}")))
+            assert f"sensor_values_{now:%Y%m}" in plan
+            assert f"sensor_values_{old:%Y%m}" not in plan
+
+
+def test_get_storage():
+    assert get_url_storage("sqlite:////tmp/x.db").name == "sqlite"
+    assert (
+        get_url_storage("sqlite:////tmp/x.db")
+        .async_url("sqlite:////tmp/x.db")
+        .drivername
+        == "sqlite+aiosqlite"
+    )
+    url = "postgresql+psycopg2://user:secret@db/abcde"
+    storage = get_url_storage(url)
+    assert storage.partitioned
+    async_url = storage.async_url(url)
+    assert async_url.drivername == "postgresql+asyncpg"
+    assert async_url.password == "secret"
+
+    with pytest.raises(ValueError):
+        get_storage("mysql")
+
+
+def test_partition_ddl():
+    ddl = PostgresStorage.partition_ddl(datetime.datetime(2025, 12, 1))
+    assert "sensor_values_202512 PARTITION OF sensor_values" in ddl
+    assert "FROM ('2025-12-01T00:00:00') TO ('2026-01-01T00:00:00')" in ddl
+
+
+def test_sqlite_tuned():
+    with tempfile.TemporaryDirectory() as tmp:
+        env_vars = {
+            "ABCDE_DB_URL": f"sqlite:///{tmp}/tuned.db",
+            "ABCDE_SQLITE_TUNED": "true",
+            "ABCDE_SQLITE_READ_POOL_SIZE": "3",
+        }
+        with mock.patch.dict(os.environ, env_vars):
+            get_engine.cache_clear()
+            get_async_engine.cache_clear()
+            write_engine = get_async_engine()
+            read_engine = get_async_read_engine()
+            assert read_engine is not write_engine
+            assert write_engine.pool.size() == 1
+            assert read_engine.pool.size() == 3
+
+            async def pragmas(engine, *names):
+                async with engine.connect() as conn:
+                    return [
+                        (await conn.exec_driver_sql(f"PRAGMA {name}")).scalar()
+                        for name in names
+                    ]
+
+            async def write_on_reader():
+                async with read_engine.begin() as conn:
+                    await conn.execute(text("DELETE FROM sensors"))
+
+            with TestClient(app) as client:
+                payload = {"sensor": "s1", "metric": "rain", "unit": "mm", "value": 2}
+                assert client.post("/sensor", json=payload).status_code == 200
+                resp = client.get("/query", params={"query": "max rain sensor1"})
+                assert resp.json()["data"] == []
+                resp = client.get("/query", params={"query": "max rain all sensors"})
+                assert resp.json()["data"][0]["value"] == 2
+
+                assert client.portal.call(
+                    pragmas, write_engine, "journal_mode", "synchronous", "busy_timeout"
+                ) == ["wal", 1, 5000]
+                assert client.portal.call(
+                    pragmas, read_engine, "journal_mode", "query_only", "cache_size"
+                ) == ["wal", 1, -32 * 1024]
+                with pytest.raises(OperationalError, match="readonly"):
+                    client.portal.call(write_on_reader)
+
+        get_engine.cache_clear()
+        get_async_engine.cache_clear()
+
+
+def test_shared_read_engine(backend):
+    if backend.name == "sqlite":
+        assert get_async_read_engine() is get_async_engine()
+
+
+def test_concurrent_schema(db_url):
+    storage = get_url_storage(db_url)
+
+    # workers start at the same time, each with engines of its own
+    def create_schema(_):
+        engine = create_engine(db_url, connect_args=storage.connect_args())
+        with engine.begin() as conn:
+            storage.create_schema(conn)
+        engine.dispose()
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(create_schema, range(8)))
+
+
+def test_reset_engines(backend):
+    engine = get_engine()
+    write_engine = get_async_engine()
+    read_engine = get_async_read_engine()
+    # as in a forked worker
+    _reset_engine()
+    _reset_engines()
+    assert get_engine() is not engine
+    assert get_async_engine() is not write_engine
+    assert get_async_read_engine() is not read_engine
@@ -0,0 +1,134 @@
+"""test the sensor and metric name vocabularies"""
+
+import asyncio
+import os
+import random
+import string
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from abcde.ingest import insert_values
+from abcde.language_parser import cosine_sim
+from abcde.main import app
+from abcde.models import SensorInput
+from abcde.query_parser import PARSE_CACHE, TAGGER, Query, add_names
+from abcde.storage import get_storage
+from abcde.vocabulary import MAX_MISSED, NUMBERS, SCAN_SIZE, Vocabulary, trigrams
+
+
+def reference_lookup(names, word, similarity=0.9):
+    """Score every name of the vocabulary."""
+    key = word.lower()
+    for name in names:
+        if name.lower() == key:
+            return name
+    grams = trigrams(key)
+    best, best_sim = None, similarity
+    for name in names:
+        if NUMBERS.findall(name.lower()) != NUMBERS.findall(key):
+            continue
+        name_grams = trigrams(name.lower())
+        shared = len(grams & name_grams)
+        if not shared or shared < max(len(grams), len(name_grams)) - MAX_MISSED:
+            continue
+        sim = cosine_sim(key, name)
+        if sim > best_sim or (best is None and sim >= best_sim):
+            best, best_sim = name, sim
+    return best
+
+
+def test_vocabulary():
+    vocabulary = Vocabulary(["temperature", "Rain", "sensor12", "greenhouse-north"])
+    assert len(vocabulary) == 4
+    assert vocabulary.add(["rain", "wind"]) == 1
+    assert vocabulary.lookup("RAIN") == "Rain"
+    assert vocabulary.lookup("tempreature") == "temperature"
+    assert vocabulary.lookup("rian") == "Rain"
+    assert vocabulary.lookup("greenhose-north") == "greenhouse-north"
+    assert vocabulary.lookup("sensro12") == "sensor12"
+    # the numbers are never corrected
+    assert vocabulary.lookup("sensor21") is None
+    assert vocabulary.lookup("temperature2") is None
+    assert vocabulary.lookup("humidity") is None
+
+
+def test_vocabulary_matches_reference():
+    rnd = random.Random(5)
+    syllables = ["green", "house", "north", "south", "barn", "field", "roof", "tank"]
+    names = [
+        "-".join(rnd.choices(syllables, k=rnd.randint(1, 3)))
+        + rnd.choice(["", str(rnd.randint(1, 20))])
+        for _ in range(20 * SCAN_SIZE)
+    ]
+    vocabulary = Vocabulary(names)
+    # the group without numbers is indexed, the others are scanned
+    assert vocabulary.groups[""].postings is not None
+    names = list(vocabulary.exact.values())
+    for name in rnd.sample(names, 200):
+        for word in (
+            name,
+            name.upper(),
+            name[:-1],
+            name + rnd.choice(string.ascii_lowercase),
+            name.replace("o", "0"),
+            "".join(rnd.sample(name, len(name))),
+        ):
+            assert vocabulary.lookup(word) == reference_lookup(names, word), word
+
+
+def test_add_names():
+    text = "max dew_point greenhouse-east"
+    with pytest.raises(ValueError):
+        Query(text).parse()
+    assert add_names(["greenhouse-east"], ["dew_point"]) == 2
+    assert not PARSE_CACHE.data and not TAGGER.cache.data
+    assert Query(text).parse()["sensor"] == ["greenhouse-east"]
+    assert Query("max dew_piont greenhouse-east").parse()["metric"] == ["dew_point"]
+    assert add_names(["greenhouse-east"], ["dew_point"]) == 0
+
+
+def write(env, sensor, metric):
+    """Write a value through an engine of its own, like another worker."""
+
+    async def run():
+        url = env["ABCDE_DB_URL"].replace("sqlite:", "sqlite+aiosqlite:")
+        engine = create_async_engine(url)
+        async with engine.begin() as conn:
+            await conn.run_sync(get_storage("sqlite").create_schema)
+        async with AsyncSession(engine) as session:
+            await insert_values(
+                session, [SensorInput(sensor=sensor, metric=metric, unit="x", value=1)]
+            )
+        await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_vocabulary_api(env):
+    write(env, "barn-west", "co2_ppm")
+    with mock.patch.dict(
+        os.environ, {"ABCDE_WORKERS": "2", "ABCDE_VOCABULARY_SYNC_MS": "0"}
+    ):
+        with TestClient(app) as client:
+            # loaded at startup
+            resp = client.get("/query", params={"query": "max co2_ppm barn-west"})
+            assert resp.status_code == 200
+            assert resp.json()["data"][0]["value"] == 1
+
+            # added by the write
+            payload = {"sensor": "silo-7", "metric": "pm25", "unit": "ug", "value": 4}
+            assert client.post("/sensor", json=payload).status_code == 200
+            resp = client.get("/query", params={"query": "max pm25 slio-7"})
+            assert resp.json()["data"][0]["sensor"] == "silo-7"
+
+            # written by another worker, read by the sync
+            write(env, "barn-north", "lux")
+            resp = client.post("/query/batch", json=[{"query": "min lux barn-north"}])
+            assert resp.json()[0]["data"][0]["sensor"] == "barn-north"
+            stats = client.get("/stats").json()["vocabulary"]
+    # at startup and after the tables grew by the POST and the other worker
+    assert stats["loads"] == 3
+    assert stats["syncs"] >= 2
@@ -0,0 +1,180 @@
+"""test write-behind buffer"""
+
+import asyncio
+from unittest import mock
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from abcde.main import app
+from abcde.write_behind import BufferFull, WriteBehindBuffer
+
+
+def test_flush_by_size():
+    flushed = []
+
+    async def flush(rows, timestamps):
+        assert len(rows) == len(timestamps)
+        flushed.append(rows)
+
+    async def run():
+        buffer = WriteBehindBuffer(
+            flush, batch_size=3, flush_ms=10000, queue_size=10, put_timeout_ms=10
+        )
+        await buffer.start()
+        for i in range(7):
+            await buffer.put(i)
+        await asyncio.sleep(0.01)
+        assert flushed == [[0, 1, 2], [3, 4, 5]]
+        assert buffer.stats()["queue_depth"] == 0
+        return buffer
+
+    buffer = asyncio.run(run())
+    assert buffer.stats()["rows_flushed"] == 6
+
+
+def test_flush_by_time_and_drain():
+    flushed = []
+
+    async def flush(rows, _):
+        flushed.append(rows)
+
+    async def run():
+        buffer = WriteBehindBuffer(
+            flush, batch_size=100, flush_ms=10, queue_size=100, put_timeout_ms=10
+        )
+        await buffer.start()
+        await buffer.put(1)
+        await buffer.put(2)
+        await asyncio.sleep(0.05)
+        assert flushed == [[1, 2]]
+
+        await buffer.put(3)
+        await buffer.stop()
+        assert flushed == [[1, 2], [3]]
+
+        with pytest.raises(BufferFull):
+            await buffer.put(4)
+        return buffer
+
+    stats = asyncio.run(run()).stats()
+    assert stats["flushes"] == 2
+    assert stats["rows_flushed"] == 3
+    assert stats["max_flush_ms"] >= stats["avg_flush_ms"] > 0
+
+
+def test_backpressure():
+    release = asyncio.Event()
+
+    async def flush(_, __):
+        await release.wait()
+
+    async def run():
+        buffer = WriteBehindBuffer(
+            flush, batch_size=1, flush_ms=10, queue_size=1, put_timeout_ms=10
+        )
+        await buffer.start()
+        await buffer.put(1)
+        await asyncio.sleep(0.01)
+        await buffer.put(2)
+        with pytest.raises(BufferFull):
+            await buffer.put(3)
+        release.set()
+        await buffer.stop()
+
+    asyncio.run(run())
+
+
+def test_flush_error():
+    attempts = []
+
+    async def flush(rows, _):
+        attempts.append(rows)
+        raise RuntimeError("db is gone")
+
+    async def run():
+        buffer = WriteBehindBuffer(
+            flush,
+            batch_size=1,
+            flush_ms=10,
+            queue_size=1,
+            put_timeout_ms=10,
+            retries=2,
+            retry_ms=1,
+        )
+        await buffer.start()
+        await buffer.put(1)
+        await buffer.stop()
+        return buffer
+
+    stats = asyncio.run(run()).stats()
+    assert attempts == [[1]] * 3
+    assert stats["retries"] == 2
+    assert stats["errors"] == 1
+    assert stats["rows_dropped"] == 1
+    assert stats["rows_flushed"] == 0
+
+
+def test_flush_retry():
+    written = []
+
+    async def flush(rows, _):
+        if not written:
+            written.append(None)
+            raise RuntimeError("database is locked")
+        written.extend(rows)
+
+    async def run():
+        buffer = WriteBehindBuffer(
+            flush,
+            batch_size=2,
+            flush_ms=10,
+            queue_size=10,
+            put_timeout_ms=10,
+            retry_ms=1,
+        )
+        await buffer.start()
+        for value in range(5):
+            await buffer.put(value)
+        await buffer.stop()
+        return buffer
+
+    stats = asyncio.run(run()).stats()
+    assert written[1:] == [0, 1, 2, 3, 4]
+    assert stats["retries"] == 1
+    assert stats["errors"] == 0
+    assert stats["rows_dropped"] == 0
+    assert stats["rows_flushed"] == 5
+
+
+def test_api_write_behind(env):
+    env_vars = {
+        "ABCDE_WRITE_BEHIND": "true",
+        "ABCDE_WRITE_BEHIND_FLUSH_MS": "10000",
+    }
+    payload = {
+        "sensor": "sensor3",
+        "metric": "temperature",
+        "unit": "C",
+        "value": 10,
+    }
+    with mock.patch.dict(os.environ, env_vars):
+        with TestClient(app) as client:
+            for _ in range(3):
+                resp = client.post("/sensor", json=payload)
+                assert resp.status_code == 202
+            assert client.get("/stats").json()["write_behind"]["queue_size"] > 0
+
+        with TestClient(app) as client:
+            resp = client.get(
+                "/query", params={"query": "sum temperature sensor3 last week"}
+            )
+            assert resp.json()["data"] == [
+                {
+                    "sensor": "sensor3",
+                    "metric": "temperature",
+                    "unit": "C",
+                    "value": 30,
+                }
+            ]